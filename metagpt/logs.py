@@ -7,6 +7,7 @@
 """
 
 import sys
+from contextvars import ContextVar
 from datetime import datetime
 
 from loguru import logger as _logger
@@ -34,7 +35,14 @@ def define_log_level(print_level="INFO", logfile_level="DEBUG", name: str = None
 logger = define_log_level()
 
 
+# 当前任务中接收流式输出的回调，设置后每个 token 都会交给它（例如边生成边朗读）
+LLM_STREAM_LISTENER: ContextVar = ContextVar("llm-stream-listener", default=None)
+
+
 def log_llm_stream(msg):
+    listener = LLM_STREAM_LISTENER.get()
+    if listener is not None:
+        listener(msg)
     _llm_stream_log(msg)
 
 
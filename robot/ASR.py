@@ -2,7 +2,8 @@
 import json
 from aip import AipSpeech
 from .sdk import TencentSpeech, AliSpeech, XunfeiSpeech, BaiduSpeech, FunASREngine, VolcSpeech
-from . import utils, config
+from . import config
+from .AudioClip import as_clip
 from robot import logging
 from abc import ABCMeta, abstractmethod
 import requests
@@ -17,6 +18,10 @@ class AbstractASR(object):
 
     __metaclass__ = ABCMeta
 
+    # 引擎接受的音频格式，按优先顺序排列：
+    # pcm/wav 直接从内存中的录音取得，file 表示引擎只接受 wav 文件路径
+    FORMATS = ("file",)
+
     @classmethod
     def get_config(cls):
         return {}
@@ -29,8 +34,23 @@ class AbstractASR(object):
 
     @abstractmethod
     def transcribe(self, fp):
+        """
+        识别一段录音
+
+        :param fp: wav 文件路径或 AudioClip
+        :returns: 识别文本，失败时返回空字符串
+        """
         pass
 
+    def stream(self, on_partial=None):
+        """
+        开始一次流式识别
+
+        :param on_partial: 识别结果变化时调用
+        :returns: 流式识别会话（feed/finish/cancel），不支持流式识别的引擎返回 None
+        """
+        return None
+
 
 class AzureASR(AbstractASR):
     """
@@ -38,6 +58,7 @@ class AzureASR(AbstractASR):
     """
 
     SLUG = "azure-asr"
+    FORMATS = ("pcm",)
 
     def __init__(self, secret_key, region, lang="zh-CN", **args):
         super(self.__class__, self).__init__()
@@ -60,8 +81,7 @@ class AzureASR(AbstractASR):
         return config.get("azure_yuyin", {})
 
     def transcribe(self, fp):
-        # 识别本地文件
-        pcm = utils.get_pcm_from_wav(fp)
+        pcm = as_clip(fp).pcm
         ret = self.sess.post(
             url=self.post_url,
             data=pcm,
@@ -100,6 +120,7 @@ class BaiduASR(AbstractASR):
     """
 
     SLUG = "baidu-asr"
+    FORMATS = ("pcm",)
 
     def __init__(self, appid, api_key, secret_key, dev_pid=1936, **args):
         super(self.__class__, self).__init__()
@@ -115,8 +136,7 @@ class BaiduASR(AbstractASR):
         return config.get("baidu_yuyin", {})
 
     def transcribe(self, fp):
-        # 识别本地文件
-        pcm = utils.get_pcm_from_wav(fp)
+        pcm = as_clip(fp).pcm
         res = self.client.asr(pcm, "pcm", 16000, {"dev_pid": self.dev_pid})
         if res["err_no"] == 0:
             logger.info(f"{self.SLUG} 语音识别到了：{res['result']}")
@@ -134,6 +154,8 @@ class TencentASR(AbstractASR):
     """
 
     SLUG = "tencent-asr"
+    # 一句话识别直接接受 wav，不需要再转成 mp3
+    FORMATS = ("file",)
 
     def __init__(self, appid, secretid, secret_key, region="ap-guangzhou", **args):
         super(self.__class__, self).__init__()
@@ -146,9 +168,9 @@ class TencentASR(AbstractASR):
         return config.get("tencent_yuyin", {})
 
     def transcribe(self, fp):
-        mp3_path = utils.convert_wav_to_mp3(fp)
-        r = self.engine.ASR(mp3_path, "mp3", "1", self.region)
-        utils.check_and_delete(mp3_path)
+        clip = as_clip(fp)
+        r = self.engine.ASR(clip.to_file(), "wav", "1", self.region)
+        clip.close()
         res = json.loads(r)
         if "Response" in res and "Result" in res["Response"]:
             logger.info(f"{self.SLUG} 语音识别到了：{res['Response']['Result']}")
@@ -163,6 +185,7 @@ class VolcASR(AbstractASR):
     """
 
     SLUG = "volc-asr"
+    FORMATS = ("pcm",)
 
     def __init__(self, appid, token, cluster, asr_cluster, voice_type, host, api_url_ws, api_url_http, **args):
         super(self.__class__, self).__init__()
@@ -173,13 +196,15 @@ class VolcASR(AbstractASR):
         # Try to get volc_yuyin config from config
         return config.get("volc_yuyin", {})
 
+    def stream(self, on_partial=None):
+        return self.engine.ASR_stream(on_partial)
+
     def transcribe(self, fp):
-        mp3_path = utils.convert_wav_to_mp3(fp)
-        res = self.engine.ASR(mp3_path, "mp3")
+        clip = as_clip(fp)
+        res = self.engine.ASR(clip.path, "raw", audio_data=clip.pcm, sample_rate=clip.sample_rate)
         # logger.info(f"asr 识别结果：{res}")
         # {'id': 1, 'path': 'dfd738b53982930c445db79246a40843.mp3', 'result': {'payload_msg': {'addition': {'duration': '7104', 'logid': '20240927105708ADAF1C2F956BC832041C', 'split_time': '[]'}, 'code': 1000, 'message': 'Success', 'reqid': '86767e08-2469-4043-a25f-455143cd40c9', 'result': [{'confidence': 0, 'text': '小女孩和妈妈在客厅玩耍，爸爸提醒该睡觉了，窗外星星在闪烁。'}], 'sequence': -4}, 'payload_size': 310}}
         # {'id': 1, 'path': '/install/pudding-robot/temp/out1.mp3', 'result': {'payload_msg': {'addition': {'duration': '2880', 'logid': '202409272122021DA5C852906AF738075C'}, 'code': 1013, 'message': 'No valid speeches found in input audio', 'reqid': '540b31be-a435-4324-89aa-f461e490d421', 'sequence': -2}, 'payload_size': 187}}
-        utils.check_and_delete(mp3_path)
         if "result" in res and "payload_msg" in res["result"] and "message" in res["result"]["payload_msg"] and res["result"]["payload_msg"]["message"] == "Success":
             logger.info(f"{self.SLUG} 语音识别到了：{res['result']['payload_msg']['result'][0]['text']}")
             return res['result']['payload_msg']['result'][0]['text']
@@ -208,7 +233,11 @@ class XunfeiASR(AbstractASR):
         return config.get("xunfei_yuyin", {})
 
     def transcribe(self, fp):
-        return XunfeiSpeech.transcribe(fp, self.appid, self.api_key, self.api_secret)
+        clip = as_clip(fp)
+        try:
+            return XunfeiSpeech.transcribe(clip.to_file(), self.appid, self.api_key, self.api_secret)
+        finally:
+            clip.close()
 
 
 class AliASR(AbstractASR):
@@ -228,7 +257,9 @@ class AliASR(AbstractASR):
         return config.get("ali_yuyin", {})
 
     def transcribe(self, fp):
-        result = AliSpeech.asr(self.appKey, self.token, fp)
+        clip = as_clip(fp)
+        result = AliSpeech.asr(self.appKey, self.token, clip.to_file())
+        clip.close()
         if result:
             logger.info(f"{self.SLUG} 语音识别到了：{result}")
             return result
@@ -261,8 +292,9 @@ class WhisperASR(AbstractASR):
 
     def transcribe(self, fp):
         if self.openai:
+            clip = as_clip(fp)
             try:
-                with open(fp, "rb") as f:
+                with open(clip.to_file(), "rb") as f:
                     result = self.openai.Audio.transcribe("whisper-1", f)
                     if result:
                         logger.info(f"{self.SLUG} 语音识别到了：{result.text}")
@@ -270,6 +302,8 @@ class WhisperASR(AbstractASR):
             except Exception:
                 logger.critical(f"{self.SLUG} 语音识别出错了", stack_info=True)
                 return ""
+            finally:
+                clip.close()
         logger.critical(f"{self.SLUG} 语音识别出错了", stack_info=True)
         return ""
 
@@ -289,7 +323,9 @@ class FunASR(AbstractASR):
         return config.get("fun_asr", {})
 
     def transcribe(self, fp):
-        result = self.engine(fp)
+        clip = as_clip(fp)
+        result = self.engine(clip.to_file())
+        clip.close()
         if result:
             logger.info(f"{self.SLUG} 语音识别到了：{result}")
             return result
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import tempfile
+import wave
+
+from robot import constants, logging
+
+logger = logging.getLogger(__name__)
+
+
+class AudioClip(object):
+    """
+    内存中的一段录音
+
+    录音器已经得到的 PCM 直接交给 ASR 引擎，引擎按自己声明的格式（AbstractASR.FORMATS）
+    取用：pcm、wav 在内存中生成，只有引擎确实需要压缩格式或文件路径时才编码或落盘，
+    不再每次都调用 ffmpeg 转成 mp3 临时文件。
+    """
+
+    def __init__(self, pcm, sample_rate=16000, channels=1, sampwidth=2, path=None):
+        """
+        :param pcm: 16 位 PCM 数据
+        :param sample_rate: 采样率
+        :param channels: 声道数
+        :param sampwidth: 每个采样的字节数
+        :param path: 对应的 wav 文件路径（录音器保存的文件），没有时为 None
+        """
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sampwidth = sampwidth
+        self.path = path
+        self._wav = None
+        self._temp = None
+
+    @classmethod
+    def from_wav(cls, path):
+        """
+        从 wav 文件读取
+        """
+        with wave.open(path, "rb") as wav:
+            return cls(
+                wav.readframes(wav.getnframes()),
+                wav.getframerate(),
+                wav.getnchannels(),
+                wav.getsampwidth(),
+                path=path,
+            )
+
+    @classmethod
+    def from_frames(cls, frames, sample_rate=16000, channels=1, sampwidth=2, path=None):
+        """
+        从录音器的帧列表构造，不读文件
+        """
+        return cls(b"".join(frames), sample_rate, channels, sampwidth, path=path)
+
+    @property
+    def duration(self):
+        return len(self.pcm) / (self.sample_rate * self.channels * self.sampwidth)
+
+    def wav(self):
+        """
+        :returns: 内存中的 wav 数据
+        """
+        if self._wav is None:
+            buf = io.BytesIO()
+            with wave.open(buf, "wb") as wav:
+                wav.setnchannels(self.channels)
+                wav.setsampwidth(self.sampwidth)
+                wav.setframerate(self.sample_rate)
+                wav.writeframes(self.pcm)
+            self._wav = buf.getvalue()
+        return self._wav
+
+    def mp3(self):
+        """
+        :returns: mp3 数据，通过管道调用 ffmpeg 编码，只给只接受 mp3 的引擎使用
+        """
+        from pydub import AudioSegment
+
+        segment = AudioSegment(
+            data=self.pcm,
+            sample_width=self.sampwidth,
+            frame_rate=self.sample_rate,
+            channels=self.channels,
+        )
+        return segment.export(io.BytesIO(), format="mp3").getvalue()
+
+    def encode(self, fmt):
+        """
+        按格式取得音频数据
+
+        :param fmt: pcm、wav 或 mp3
+        :returns: bytes
+        """
+        if fmt == "pcm":
+            return self.pcm
+        if fmt == "wav":
+            return self.wav()
+        if fmt == "mp3":
+            return self.mp3()
+        raise ValueError(f"不支持的音频格式：{fmt}")
+
+    def to_file(self):
+        """
+        给只接受文件路径的引擎使用：有录音文件时直接返回，否则写一个临时 wav 文件
+
+        :returns: wav 文件路径
+        """
+        if self.path and os.path.exists(self.path):
+            return self.path
+        if self._temp is None:
+            fd, self._temp = tempfile.mkstemp(suffix=".wav", dir=constants.TEMP_PATH)
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.wav())
+        return self._temp
+
+    def close(self):
+        """
+        删除 to_file() 生成的临时文件
+        """
+        if self._temp:
+            if os.path.exists(self._temp):
+                os.remove(self._temp)
+            self._temp = None
+
+
+def as_clip(audio):
+    """
+    :param audio: AudioClip 或 wav 文件路径
+    :returns: AudioClip
+    """
+    if isinstance(audio, AudioClip):
+        return audio
+    return AudioClip.from_wav(audio)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import collections
+import math
+import threading
+import time
+
+import pyaudio
+
+from robot import config, logging
+from snowboy.snowboydecoder import FRAME_SAMPLES, RingBuffer, no_alsa_error
+
+logger = logging.getLogger(__name__)
+
+
+class AudioInput(object):
+    """
+    音频输入引擎
+
+    每种录音格式只打开一个长期存在的 PyAudio 输入流，唤醒词检测和主动聆听共用，
+    不再每次聆听都重新打开麦克风。回调把每一帧分发给所有订阅者的环形缓冲区，
+    同时保留最近 preroll_ms 的录音：聆听开始前（唤醒提示音、打开监听器期间）
+    孩子已经说出的话可以补到录音的开头。
+    """
+
+    def __init__(
+        self, rate=16000, channels=1, sampwidth=2, preroll_ms=500, buffer_seconds=5, period_ms=32
+    ):
+        """
+        :param rate: 采样率
+        :param channels: 声道数
+        :param sampwidth: 每个采样的字节数
+        :param preroll_ms: 保留最近多长的录音用于补在聆听开头（毫秒）
+        :param buffer_seconds: 每个订阅者的缓冲区能存多少秒，读得太慢时丢弃最旧的
+        :param period_ms: PyAudio 回调周期（毫秒），订阅者按自己的帧长读取，
+                          周期短一些打断检测能更早拿到声音
+        """
+        self.rate = rate
+        self.channels = channels
+        self.sampwidth = sampwidth
+        self.buffer_size = rate * channels * sampwidth * buffer_seconds
+        self.period = min(FRAME_SAMPLES, max(1, rate * period_ms // 1000))
+        frames = math.ceil(preroll_ms * rate / 1000 / self.period)
+        self._preroll = collections.deque(maxlen=max(frames, 1))
+        self._rings = []
+        self._lock = threading.Lock()
+        self._pa = None
+        self._stream = None
+
+    def start(self):
+        with self._lock:
+            if self._stream is not None:
+                return
+            with no_alsa_error():
+                self._pa = pyaudio.PyAudio()
+            self._stream = self._pa.open(
+                input=True,
+                output=False,
+                format=self._pa.get_format_from_width(self.sampwidth),
+                channels=self.channels,
+                rate=self.rate,
+                frames_per_buffer=self.period,
+                stream_callback=self._callback,
+            )
+            logger.info(f"音频输入已启动：{self.rate} Hz，预录 {self.preroll_ms} ms")
+
+    @property
+    def preroll_ms(self):
+        return self._preroll.maxlen * self.period * 1000 // self.rate
+
+    def subscribe(self, preroll_since=None):
+        """
+        开始接收录音
+
+        :param preroll_since: 不为 None 时，把这个时间点（time.monotonic()）之后
+                              已经录到的预录音频先放进缓冲区
+        :returns: snowboy 的 RingBuffer，用 read() 阻塞读取整帧
+        """
+        self.start()
+        ring = RingBuffer(self.buffer_size)
+        with self._lock:
+            if preroll_since is not None:
+                for captured, data in self._preroll:
+                    if captured >= preroll_since:
+                        ring.extend(data)
+            self._rings.append(ring)
+        return ring
+
+    def unsubscribe(self, ring):
+        with self._lock:
+            if ring in self._rings:
+                self._rings.remove(ring)
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        with self._lock:
+            # 记录这一帧录完的时间，用于判断预录音频是否在聆听请求之后
+            self._preroll.append((time.monotonic(), in_data))
+            for ring in self._rings:
+                ring.extend(in_data)
+        return None, pyaudio.paContinue
+
+
+_inputs = {}
+_inputs_lock = threading.Lock()
+
+
+def get_input(rate=16000, channels=1, sampwidth=2):
+    """
+    获取某种录音格式的共享输入引擎
+
+    :returns: AudioInput；配置 /audio_input/shared 为 false 时返回 None，
+              监听器各自打开输入流
+    """
+    if not config.get("/audio_input/shared", True):
+        return None
+    key = (rate, channels, sampwidth)
+    with _inputs_lock:
+        audio_input = _inputs.get(key)
+        if audio_input is None:
+            audio_input = AudioInput(
+                rate,
+                channels,
+                sampwidth,
+                preroll_ms=config.get("/audio_input/preroll_ms", 500),
+                buffer_seconds=config.get("/audio_input/buffer_seconds", 5),
+                period_ms=config.get("/audio_input/period_ms", 32),
+            )
+            _inputs[key] = audio_input
+    return audio_input
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+import collections
+import math
+import threading
+import time
+
+import numpy as np
+import pyaudio
+
+from robot import config, logging
+from robot.Dsp import GainStage, gain_for
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer(object):
+    """
+    单生产者、单消费者的 int16 环形缓冲区
+
+    缓冲区预先分配，读写位置都是单调递增的总数，生产者只修改写位置，
+    消费者只修改读位置，因此两边不需要加锁。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buf = np.zeros(capacity, dtype=np.int16)
+        self.written = 0
+        self.read = 0
+
+    def free(self):
+        return self.capacity - (self.written - self.read)
+
+    def write(self, samples):
+        """
+        生产者调用，写入尽可能多的采样
+
+        :param samples: int16 数组，或已经饱和到 int16 范围的 int32 数组
+        :returns: 实际写入的采样数
+        """
+        n = min(len(samples), self.free())
+        start = self.written % self.capacity
+        first = min(n, self.capacity - start)
+        self._buf[start : start + first] = samples[:first]
+        if n > first:
+            self._buf[: n - first] = samples[first:n]
+        self.written += n
+        return n
+
+    def read_into(self, out):
+        """
+        消费者调用，读出最多 len(out) 个采样，不足的部分补零
+
+        :returns: 实际读出的采样数
+        """
+        n = min(len(out), self.written - self.read)
+        start = self.read % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._buf[start : start + first]
+        if n > first:
+            out[first:n] = self._buf[: n - first]
+        out[n:] = 0
+        self.read += n
+        return n
+
+    def clear(self):
+        """
+        消费者调用，丢弃所有未读的采样
+        """
+        self.read = self.written
+
+
+class _Segment(object):
+    __slots__ = ("samples", "rate", "silence", "gain", "fade", "offset", "done")
+
+    def __init__(self, samples=None, rate=None, silence=0, gain=0, fade=False, done=None):
+        self.samples = samples
+        self.rate = rate
+        self.silence = silence
+        self.gain = gain
+        self.fade = fade
+        self.offset = 0
+        self.done = done
+
+
+class Channel(object):
+    """
+    输出引擎上的一路声音，每个播放器各占一路，由混音线程与其他声道叠加后输出
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self._segments = collections.deque()
+        self.closed = False
+
+    def write(self, pcm, sample_rate=None, volume=100, wait=False):
+        """
+        排队播放一段 16 位单声道 PCM
+
+        :param pcm: bytes、memoryview 或 int16 数组，不会被复制
+        :param sample_rate: 采样率，与输出不同时由混音线程重采样
+        :param volume: 音量百分比
+        :param wait: 是否等到这段声音播放完（或被 flush）再返回
+        :returns: 播放完成时被 set 的 Event
+        """
+        samples = pcm if isinstance(pcm, np.ndarray) else np.frombuffer(pcm, dtype=np.int16)
+        done = threading.Event()
+        # 前面没有排队的声音时才淡入，流式合成的连续数据块之间不淡入
+        fade = not self._segments
+        self._segments.append(
+            _Segment(samples, sample_rate or self.output.rate, gain=gain_for(volume), fade=fade)
+        )
+        self._segments.append(_Segment(done=done))
+        self.output.wake()
+        if wait:
+            done.wait()
+        return done
+
+    def silence(self, seconds, wait=False):
+        """
+        排队播放一段静音，静音以采样数计，不占用调用方线程
+        """
+        done = threading.Event()
+        self._segments.append(_Segment(silence=int(seconds * self.output.rate)))
+        self._segments.append(_Segment(done=done))
+        self.output.wake()
+        if wait:
+            done.wait()
+        return done
+
+    def drain(self, timeout=None):
+        """
+        等待已排队的声音全部播放完
+        """
+        done = threading.Event()
+        self._segments.append(_Segment(done=done))
+        self.output.wake()
+        return done.wait(timeout)
+
+    def flush(self):
+        """
+        立即丢弃这一路所有未播放的声音，等待中的调用全部返回
+        """
+        segments = self._segments
+        self._segments = collections.deque()
+        for segment in segments:
+            if segment.done:
+                segment.done.set()
+        self.output.flush()
+
+    def busy(self):
+        return bool(self._segments)
+
+    def close(self):
+        """
+        不再使用这一路，排队的声音播放完后从输出引擎中移除
+        """
+        self.closed = True
+        self.output.prune()
+
+    def _mix(self, acc, markers, base):
+        """
+        混音线程调用，把最多 len(acc) 个采样叠加到 acc 上
+
+        :param markers: 收集 (播放位置, Event)，声音播放到该位置时通知
+        :param base: acc[0] 在输出流中的位置
+        """
+        segments = self._segments
+        pos = 0
+        while pos < len(acc) and segments:
+            segment = segments[0]
+            if segment.done is not None:
+                markers.append((base + pos, segment.done))
+                segments.popleft()
+                continue
+            if segment.samples is None:
+                n = min(segment.silence - segment.offset, len(acc) - pos)
+            else:
+                if segment.rate != self.output.rate:
+                    segment.samples = self.output.resample(segment.samples, segment.rate)
+                    segment.rate = self.output.rate
+                n = min(len(segment.samples) - segment.offset, len(acc) - pos)
+                self.output.gain.mix(
+                    segment.samples[segment.offset : segment.offset + n],
+                    acc[pos : pos + n],
+                    segment.gain,
+                    segment.offset if segment.fade else None,
+                )
+            segment.offset += n
+            pos += n
+            total = segment.silence if segment.samples is None else len(segment.samples)
+            if segment.offset >= total:
+                segments.popleft()
+        # 这一块之后紧跟的完成标记也一并收集，避免多等一个周期
+        while segments and segments[0].done is not None:
+            markers.append((base + pos, segments.popleft().done))
+
+
+class AudioOutput(object):
+    """
+    音频输出引擎
+
+    每种输出格式只打开一个长期存在的 PyAudio 回调流。各个播放器把声音写入自己的
+    Channel，混音线程按块完成音量调整、重采样和静音插入，叠加后写入环形缓冲区，
+    PyAudio 回调每个周期从环形缓冲区取数据，取不到时输出静音。
+
+    flush 只需清空队列并让回调在下一个周期丢弃缓冲区，打断延迟不超过一个周期，
+    丢弃前的最后一个周期淡出，避免爆音。
+    """
+
+    def __init__(self, rate=24000, period_ms=5, buffer_ms=60):
+        """
+        :param rate: 输出采样率，其他采样率的声音会被重采样
+        :param period_ms: PyAudio 回调周期（毫秒），决定打断延迟
+        :param buffer_ms: 混音线程最多领先播放的时长（毫秒）
+        """
+        self.rate = rate
+        self.period = max(1, rate * period_ms // 1000)
+        self.block = self.period * 2
+        self.ring = RingBuffer(max(self.block * 2, rate * buffer_ms // 1000))
+        self.gain = GainStage(self.block, fade=self.period)
+        self._channels = []
+        self._channels_lock = threading.Lock()
+        self._markers = collections.deque()
+        self._flush_requested = 0
+        self._flush_done = 0
+        self._wake = threading.Condition()
+        self._space = threading.Event()
+        self._out = np.zeros(self.period, dtype=np.int16)
+        self._ref = np.zeros(self.period, dtype=np.float32)
+        # 最近约 1 秒实际送给声卡的每个周期的 (时间, 平均能量)，作为打断检测的回声参考
+        self.reference = collections.deque(maxlen=max(1, rate // self.period))
+        self._pa = None
+        self._stream = None
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def channel(self):
+        self.start()
+        channel = Channel(self)
+        with self._channels_lock:
+            # 整体替换列表，混音线程遍历的旧列表不受影响
+            self._channels = [c for c in self._channels if not (c.closed and not c.busy())] + [channel]
+        return channel
+
+    def prune(self):
+        """
+        移除已经关闭、声音也都播放完的声道
+        """
+        with self._channels_lock:
+            channels = [c for c in self._channels if not (c.closed and not c.busy())]
+            if len(channels) != len(self._channels):
+                self._channels = channels
+
+    def start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            try:
+                self._pa = pyaudio.PyAudio()
+                self._stream = self._pa.open(
+                    format=pyaudio.paInt16,
+                    channels=1,
+                    rate=self.rate,
+                    output=True,
+                    frames_per_buffer=self.period,
+                    stream_callback=self._callback,
+                )
+            except Exception:
+                # 打开失败时保持未启动状态，下次 channel()/start() 重试，而不是留下一个不出声的引擎
+                if self._pa is not None:
+                    self._pa.terminate()
+                self._pa = None
+                self._stream = None
+                raise
+            threading.Thread(target=self._mixer, daemon=True).start()
+            self._started = True
+            logger.info(f"音频输出已启动：{self.rate} Hz，周期 {self.period} 帧")
+
+    def wake(self):
+        with self._wake:
+            self._wake.notify()
+
+    def flush(self):
+        """
+        丢弃已经混好但还没播放的声音，在下一个回调周期生效
+        """
+        self._flush_requested += 1
+        self._space.set()
+
+    def resample(self, samples, rate):
+        """
+        线性插值重采样到输出采样率
+        """
+        if len(samples) == 0:
+            return samples
+        n = int(len(samples) * self.rate / rate)
+        x = np.linspace(0, len(samples) - 1, n)
+        return np.interp(x, np.arange(len(samples)), samples).astype(np.int16)
+
+    def reference_db(self, window):
+        """
+        最近 window 秒内播放出去的声音最响的一个周期的能量
+
+        :returns: 分贝，没有播放时返回 None
+        """
+        since = time.monotonic() - window
+        loudest = 0.0
+        for captured, energy in reversed(list(self.reference)):
+            if captured < since:
+                break
+            loudest = max(loudest, energy)
+        return 10 * math.log10(loudest + 1.0) if loudest > 0 else None
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        ring = self.ring
+        out = self._out if frame_count == self.period else np.zeros(frame_count, dtype=np.int16)
+        ring.read_into(out)
+        if self._flush_done != self._flush_requested:
+            self._flush_done = self._flush_requested
+            self.gain.fade_out(out)
+            ring.clear()
+        markers = self._markers
+        while markers and markers[0][0] <= ring.read:
+            markers.popleft()[1].set()
+        self._space.set()
+        if frame_count == self.period:
+            ref = self._ref
+            ref[:] = out
+            self.reference.append((time.monotonic(), float(np.dot(ref, ref)) / frame_count))
+        return out.tobytes(), pyaudio.paContinue
+
+    def _mixer(self):
+        acc = np.zeros(self.block, dtype=np.int32)
+        while True:
+            with self._wake:
+                while not any(channel.busy() for channel in self._channels):
+                    self._wake.wait()
+            while self.ring.free() < self.block:
+                self._space.clear()
+                self._space.wait(0.05)
+            acc[:] = 0
+            base = self.ring.written
+            markers = []
+            channels = self._channels
+            for channel in channels:
+                channel._mix(acc, markers, base)
+            self.gain.limit(acc)
+            # 只写入有声音的部分，队列空了就不再用静音占住缓冲区
+            end = max([m[0] - base for m in markers] + [0])
+            if any(channel.busy() for channel in channels):
+                end = self.block
+            if any(channel.closed and not channel.busy() for channel in channels):
+                self.prune()
+            flush = self._flush_requested
+            self.ring.write(acc[:end])
+            if flush != self._flush_requested:
+                # 写入期间发生了 flush，回调可能已经先清空过缓冲区，再清空一次，
+                # 这一块的完成标记立即通知
+                self.flush()
+                for _, done in markers:
+                    done.set()
+                continue
+            self._markers.extend(markers)
+
+
+_outputs = {}
+_outputs_lock = threading.Lock()
+
+
+def get_output(rate=None):
+    """
+    获取某个采样率的共享输出引擎，默认使用配置中的采样率
+    """
+    rate = rate or config.get("/audio_output/rate", 24000)
+    with _outputs_lock:
+        output = _outputs.get(rate)
+        if output is None:
+            output = AudioOutput(
+                rate,
+                period_ms=config.get("/audio_output/period_ms", 5),
+                buffer_ms=config.get("/audio_output/buffer_ms", 60),
+            )
+            _outputs[rate] = output
+    return output
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from robot import Vad, config, logging
+
+logger = logging.getLogger(__name__)
+
+
+class BargeInDetector(object):
+    """
+    打断检测：机器人说话时孩子开口，立即停止朗读
+
+    从共享输入流按子帧读取麦克风声音，同时取输出引擎最近实际播放的能量作为回声参考：
+
+    - VAD 判断子帧能量是否高出噪声基底（语音）
+    - 回声门限：麦克风能量必须比“参考能量 + 回声耦合”再高出 echo_margin_db，
+      回声耦合（喇叭到麦克风的增益）在没有人说话的播放期间持续学习
+    - 连续 onset_ms 的子帧都满足时认为孩子开口了
+
+    只比较能量，不做自适应滤波，在树莓派上每个子帧只需要几十微秒。
+    """
+
+    def __init__(
+        self,
+        audio_input,
+        output,
+        on_barge_in,
+        is_active=lambda: True,
+        frame_ms=20,
+        margin_db=12,
+        echo_margin_db=8,
+        onset_ms=80,
+        echo_window_ms=250,
+        coupling_db=0,
+        **args,
+    ):
+        """
+        :param audio_input: robot.AudioInput 共享输入
+        :param output: robot.AudioOutput 输出引擎，提供回声参考
+        :param on_barge_in: 检测到打断时调用，参数为孩子开口的时间（time.monotonic()）
+        :param is_active: 返回 True 时才检测（例如正在朗读且没有在录音）
+        :param frame_ms: 子帧时长（毫秒）
+        :param margin_db: 高出噪声基底多少分贝才可能是语音
+        :param echo_margin_db: 比估计的回声再高出多少分贝才算孩子的声音
+        :param onset_ms: 连续多长的语音才触发打断
+        :param echo_window_ms: 回声参考取最近多长时间内最响的播放声音，覆盖声卡和房间的延迟
+        :param coupling_db: 回声耦合的初始值，之后自动学习
+        """
+        self.audio_input = audio_input
+        self.output = output
+        self.on_barge_in = on_barge_in
+        self.is_active = is_active
+        self.frame_ms = frame_ms
+        self.echo_margin_db = echo_margin_db
+        self.onset_ms = onset_ms
+        self.echo_window = echo_window_ms / 1000
+        self.coupling_db = coupling_db
+        self.vad = Vad.create(
+            "energy", sample_rate=audio_input.rate, frame_ms=frame_ms, margin_db=margin_db
+        )
+        self.frame_bytes = audio_input.rate * frame_ms // 1000 * audio_input.sampwidth
+        self.triggered = 0
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        threading.Thread(target=self._run, daemon=True).start()
+        logger.info("打断检测已启动")
+
+    def stop(self):
+        self._running = False
+
+    def _run(self):
+        ring = self.audio_input.subscribe()
+        onset = 0
+        fired = False
+        try:
+            while self._running:
+                data = ring.read(self.frame_bytes, 0.2)
+                if not data:
+                    continue
+                speech, energy_db = self.vad.speech_frames(data)
+                if not self.is_active():
+                    onset = 0
+                    fired = False
+                    continue
+                if fired:
+                    continue
+                ref_db = self.output.reference_db(self.echo_window)
+                for is_speech, mic_db in zip(speech, energy_db):
+                    if ref_db is None:
+                        voice = is_speech
+                    else:
+                        echo_db = ref_db + self.coupling_db
+                        voice = is_speech and mic_db > echo_db + self.echo_margin_db
+                        if is_speech and not voice:
+                            # 听得到回声、但不像有人说话时学习喇叭到麦克风的耦合
+                            target = mic_db - ref_db
+                            rate = 0.05 if target > self.coupling_db else 0.2
+                            self.coupling_db += rate * (target - self.coupling_db)
+                    onset = onset + self.frame_ms if voice else 0
+                if onset >= self.onset_ms:
+                    fired = True
+                    onset_time = time.monotonic() - onset / 1000
+                    self.triggered += 1
+                    logger.info(f"检测到打断，回声耦合 {self.coupling_db:.1f} dB")
+                    self.on_barge_in(onset_time)
+        finally:
+            self.audio_input.unsubscribe(ring)
+
+    def stats(self):
+        return {
+            "triggered": self.triggered,
+            "coupling_db": round(self.coupling_db, 1),
+            "noise_floor_db": None
+            if self.vad.noise_floor_db is None
+            else round(self.vad.noise_floor_db, 1),
+        }
+
+
+def create(audio_input, output, on_barge_in, is_active):
+    """
+    按配置创建打断检测
+
+    :returns: BargeInDetector；配置 /barge_in/enable 为 false 或没有共享输入时返回 None
+    """
+    if not config.get("/barge_in/enable", False) or audio_input is None:
+        return None
+    profile = dict(config.get("barge_in", {}) or {})
+    profile.pop("enable", None)
+    return BargeInDetector(audio_input, output, on_barge_in, is_active, **profile)
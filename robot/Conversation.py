@@ -8,17 +8,14 @@ import re
 import os
 import threading
 import traceback
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import subprocess
 import ruamel.yaml
 import sys
 import pexpect
-import queue
-import pyaudio
-import numpy as np
 
 from snowboy import snowboydecoder
 
+from robot.AudioClip import AudioClip
 from robot.LifeCycleHandler import LifeCycleHandler
 from robot.Brain import Brain
 from robot.Scheduler import Scheduler
@@ -26,14 +23,23 @@ from robot.sdk import History
 from robot import (
     AI,
     ASR,
+    AudioInput,
+    AudioOutput,
+    BargeIn,
     config,
     constants,
     logging,
     NLU,
     Player,
+    Prefetcher,
+    Runtime,
+    SpeechScheduler,
     statistic,
+    SynthesisPipeline,
     TTS,
     utils,
+    Vad,
+    VoiceCache,
 )
 
 from metagpt.team import Team
@@ -41,19 +47,18 @@ from metagpt.team import Team
 import asyncio
 import uuid
 
+from robot.agents import narration, sentence_stream
 from robot.agents.pudding_agent import Actuator, StoryBot
 
 
 logger = logging.getLogger(__name__)
 
-def run_event_loop(loop, coro):
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(coro)
-
 class Conversation(object):
 
     def __init__(self, profiling=False):
         self.brain, self.asr, self.ai, self.tts, self.nlu = None, None, None, None, None
+        # 智能体、朗读和播放共用的事件循环与线程池
+        self.runtime = Runtime.get_runtime()
         self.reInit()
         self.scheduler = Scheduler(self)
         # 历史会话消息
@@ -62,6 +67,8 @@ class Conversation(object):
         self.matchPlugin = None
         self.immersiveMode = None
         self.isRecording = False
+        # 唤醒后正在进行的流式识别会话，没有启用流式识别时为 False
+        self._asr_session = None
         self.profiling = profiling
         self.onSay = None
         self.onStream = None
@@ -75,18 +82,42 @@ class Conversation(object):
 
         self.is_speaking = False  # 用于标记当前是否在朗读
 
-        self.queue = queue.Queue()  # 普通队列
-        self.priority_queue = queue.Queue()  # 优先级队列
+        # 朗读队列：优先级、暂停/恢复和取消都由调度器处理，工作线程阻塞等待，不再轮询
+        self.speech = SpeechScheduler.SpeechScheduler(on_preempt=self._preempt)
+        # 普通朗读（绘本的每一句）共用的取消令牌，clearQueue() 时取消并换一个新的
+        self.speech_token = SpeechScheduler.CancelToken("book")
         self.lock = threading.Lock()  # 保证线程安全
         self.condition = threading.Condition(self.lock)  # 用于线程之间的同步控制
-        self.tts_lock = threading.Lock()  # 保证线程安全
-        self.tts_condition = threading.Condition(self.tts_lock)  # 用于线程之间的同步控制
-        self.paused = False
 
         self.storyMode = False
 
+        # 绘本语音预合成
+        self.prefetcher = Prefetcher.get_prefetcher(self.tts)
+        # 整段文字分句朗读（say_sync 的多句回复、_tts/_tts_sync）的合成流水线
+        self.synthesis = SynthesisPipeline.get_pipeline(self._synthesize)
+        # 固定用语每本绘本都会用到，钉在缓存中不被淘汰
+        for phrase in narration.fixed_phrases():
+            VoiceCache.get_cache().pin(
+                phrase, **self._voice(narration.SPEED_RATIO, narration.EMOTION, narration.NARRATOR)
+            )
+        utils.lruCache()
+
+        # 最后一句完整播放完的绘本句子的位置，被打断时据此恢复 book_* 进度
+        self._played_position = None
+        # 每次 interrupt() 加一，用来判断一句话是否被打断
+        self._interrupts = 0
+
         threading.Thread(target=self._process_queue, daemon=True).start()  # 启动后台线程处理队列
 
+        # 朗读时孩子开口就停止朗读（barge_in.enable）
+        self.barge_in = BargeIn.create(
+            AudioInput.get_input(),
+            AudioOutput.get_output(),
+            self.onBargeIn,
+            lambda: self.is_speaking and not self.isRecording,
+        )
+        self.barge_in and self.barge_in.start()
+
         self.book_id = None
         self.book_content_id = None
         self.book_content_sequence = None
@@ -100,7 +131,7 @@ class Conversation(object):
         self.team = Team()
         self.team.hire(
             [
-                Actuator(self.nickname, self.playmate, self.say, self.say_sync, self.say_with_priority, self.activeListen, self.resume, self.setStoryMode, self.clearQueue, self.set_book_id, self.set_book_content_id, self.set_book_content_sequence, self.set_book_content_text_id, self.set_book_content_text_sequence),
+                Actuator(self.nickname, self.playmate, self.say, self.say_sync, self.say_with_priority, self.activeListen, self.resume, self.setStoryMode, self.clearQueue, self.set_book_id, self.set_book_content_id, self.set_book_content_sequence, self.set_book_content_text_id, self.set_book_content_text_sequence, prefetch_callback=self.prefetch, pipeline_callback=self.pipeline_sync),
                 StoryBot(self.nickname, self.playmate),
             ]
         )
@@ -261,23 +292,22 @@ class Conversation(object):
 
     def pause(self):
         """暂停文本转语音任务"""
-        with self.lock:
-            self.paused = True
-        with self.tts_lock:
-            self.is_speaking = False
+        self.speech.pause()
 
     def resume(self):
         """恢复文本转语音任务"""
-        with self.lock:
-            self.paused = False
-            self.condition.notify_all()  # 通知所有等待的线程继续执行
-        with self.tts_lock:
-            self.is_speaking = False
-            self.tts_condition.notify_all()
+        self.speech.resume()
 
     def clearQueue(self):
-        while not self.queue.empty():
-            self.queue.get()
+        """丢弃队列中所有普通朗读任务（当前绘本剩下的句子），优先朗读不受影响"""
+        token, self.speech_token = self.speech_token, SpeechScheduler.CancelToken("book")
+        dropped = self.speech.cancel(token)
+        logger.info(f"清空朗读队列：丢弃 {dropped} 条")
+
+    def _preempt(self):
+        """高优先级语音打断当前语音"""
+        self.player.stop()
+        self.tts.stop_websocket_stream()
 
     def set_book_id(self, book_id):
         self.book_id = book_id
@@ -294,6 +324,23 @@ class Conversation(object):
     def set_book_content_text_sequence(self, bookt_content_text_sequence):
         self.book_content_text_sequence = bookt_content_text_sequence
 
+    def prefetch(self, segments):
+        """
+        在后台预合成一本绘本的语音，参见 TTSPrefetcher.prefetch
+        """
+        if self.prefetcher:
+            self.prefetcher.prefetch(segments)
+
+    def _voice(self, speed_ratio, emotion, character_category):
+        """
+        语音缓存的区分参数，同一段文字不同发音人、语速、情感分别缓存
+        """
+        return {
+            "voice_type": self.tts.get_voice_type(character_category),
+            "speed_ratio": speed_ratio,
+            "emotion": emotion,
+        }
+
     def _lastCompleted(self, index, onCompleted):
         if index >= self.tts_count - 1:
             # logger.debug(f"执行onCompleted")
@@ -301,81 +348,63 @@ class Conversation(object):
         with self.lock:
             self.condition.notify()  # 通知下一个音频可以开始
 
-    def _play_silence(self, duration=2):
-        # 初始化 PyAudio
-        p = pyaudio.PyAudio()
-
-        # 设置流参数
-        volume = 0.0  # 静音
-        sample_rate = 44100  # 采样率
-        samples = np.zeros(int(sample_rate * duration), dtype=np.float32)  # 生成静音数据
-
-        # 创建流
-        stream = p.open(format=pyaudio.paFloat32,
-                        channels=1,
-                        rate=sample_rate,
-                        output=True)
-
-        # 播放静音
-        stream.write(samples.tobytes())
+    def _runCompleted(self, onCompleted):
+        """
+        一句话播放完后执行回调：协程交给共享事件循环，普通函数直接调用
+        """
+        if not onCompleted:
+            return
+        if asyncio.iscoroutinefunction(onCompleted):
+            self.runtime.submit(onCompleted())
+        else:
+            onCompleted()
 
-        # 关闭流
-        stream.stop_stream()
-        stream.close()
-        p.terminate()
+    def _play_silence(self, duration=2):
+        # 静音直接排在共享输出流里，不再为每段静音打开一个 PyAudio
+        self.player.play_silence(duration)
 
     async def stream_and_play(self, phrase, silent, speed_ratio, emotion, character_category, volume=50, cache=False):
         pcm_chunks = []  # 用于收集所有的音频数据块
-        async for audio_chunk in self.tts.get_speech_ws_stream(phrase, silent, speed_ratio, emotion, character_category):
-            pcm_chunks.append(audio_chunk)  # 收集 PCM 数据块
-            # 实时播放每块数据
-            self.player.doPlayChunk(audio_chunk, volume)
+        try:
+            async for audio_chunk in self.tts.get_speech_ws_stream(phrase, silent, speed_ratio, emotion, character_category):
+                self.speech.mark("first_audio")
+                pcm_chunks.append(audio_chunk)  # 收集 PCM 数据块
+                # 实时播放每块数据（只是排队，不阻塞接收）
+                self.player.doPlayChunk(audio_chunk, volume)
+        except TTS.SpeechStopped:
+            logger.info(f"语音合成被打断：{phrase}")
+            return
         if cache:
-            # 当所有数据块播放完毕后，保存音频缓存
-            await utils.saveWsStreamVoiceCache(pcm_chunks, phrase)
+            # 数据块接收完毕后保存音频缓存，此时声音可能还在播放
+            await utils.saveWsStreamVoiceCache(
+                pcm_chunks, phrase, **self._voice(speed_ratio, emotion, character_category)
+            )
+        # 等待这句话播放完（或被打断）
+        await asyncio.get_running_loop().run_in_executor(None, self.player.drain)
 
     def _ttsAction(self, msg, volume, tts_silent, cache_play_silence_duration, speed_ratio, emotion, character_category, cache, index, onCompleted=None):
         if msg:
-            voice = ""
-            if utils.getCache(msg):
+            voice = utils.getCache(msg, **self._voice(speed_ratio, emotion, character_category))
+            if self.prefetcher:
+                # 推进预合成窗口；这句话正在预合成时等它写入缓存，避免重复合成
+                self.prefetcher.on_play(msg, speed_ratio, emotion, character_category)
+                if not voice and self.prefetcher.wait(msg, speed_ratio, emotion, character_category):
+                    voice = utils.getCache(msg, **self._voice(speed_ratio, emotion, character_category))
+            if voice:
                 logger.info(f"第{index}段TTS命中缓存，播放缓存语音")
-                # 获取缓存音频文件，使用asyncio调用异步方法
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                voice = loop.run_until_complete(utils.getCache_async(msg))
-                loop.close()
-
                 logger.info(f"即将播放第{index}段TTS。msg: {msg}")
-                self.player.play_sync(voice, volume, not cache)
+                # 缓存文件由语音缓存统一管理，播放后不能删除
+                self.speech.mark("first_audio")
+                self.player.play_sync(voice, volume, False)
                 self._play_silence(duration=cache_play_silence_duration)
-                if onCompleted:
-                    loop = asyncio.get_event_loop()
-                    if asyncio.iscoroutinefunction(onCompleted):
-                        # 使用 run_coroutine_threadsafe 调度协程
-                        asyncio.run_coroutine_threadsafe(onCompleted(), loop)
-                    else:
-                        # 直接调用普通函数
-                        onCompleted()
+                self._runCompleted(onCompleted)
                 return voice
             else:
-                try:
-                    loop = asyncio.get_running_loop()  # 检查是否有事件循环
-                except RuntimeError:
-                    loop = asyncio.new_event_loop()  # 创建一个新的事件循环
-                    asyncio.set_event_loop(loop)
-
-                # 运行异步 stream_and_play 方法
-                loop.run_until_complete(
+                # 在共享事件循环中运行 stream_and_play，阻塞到这句话播放完
+                self.runtime.run(
                     self.stream_and_play(msg, tts_silent, speed_ratio, emotion, character_category, volume, cache))
 
-                if onCompleted:
-                    loop = asyncio.get_event_loop()
-                    if asyncio.iscoroutinefunction(onCompleted):
-                        # 使用 run_coroutine_threadsafe 调度协程
-                        asyncio.run_coroutine_threadsafe(onCompleted(), loop)
-                    else:
-                        # 直接调用普通函数
-                        onCompleted()
+                self._runCompleted(onCompleted)
 
                 # 获取http语音
                 # voice = self.tts.get_speech_http(msg, tts_silent, speed_ratio, emotion, character_category)
@@ -426,36 +455,6 @@ class Conversation(object):
                 #     logger.error(f"语音合成失败：{e}", stack_info=True)
                 #     return None
 
-    def _ttsAction_sync(self, msg, cache, index):
-        if msg:
-            voice = ""
-            if utils.getCache(msg):
-                logger.info(f"第{index}段TTS命中缓存，播放缓存语音")
-                voice = utils.getCache(msg)
-
-                with self.play_lock:
-                    self.player.play_sync(
-                        voice,
-                        not cache
-                    )
-                return voice
-            else:
-                try:
-                    voice = self.tts.get_speech_http(msg)
-                    logger.info(f"第{index}段TTS合成成功。msg: {msg}")
-
-                    with self.play_lock:
-                        logger.info(f"即将播放第{index}段TTS。msg: {msg}")
-                        self.player.play_sync(
-                            voice,
-                            not cache
-                        )
-                    return voice
-                except Exception as e:
-                    logger.error(f"语音合成失败：{e}", stack_info=True)
-                    traceback.print_exc()
-                    return None
-
     def getHistory(self):
         return self.history
 
@@ -464,18 +463,68 @@ class Conversation(object):
         self.storyMode = storyMode
 
     def interrupt(self):
+        self._interrupts += 1
         # 在故事模式下，需要暂停文本转语音队列的处理
+        # 先暂停再停止播放，避免朗读线程在这之间取出下一句
+        if self.storyMode:
+            self.pause()
+            self._restore_position()
         # 停止当前的缓存语音播放
         if self.player:
             self.player.stop()
         # 停止语音转文本的websocket流
         if self.tts:
             self.tts.stop_websocket_stream()
-        if self.storyMode:
-            self.pause()
+        # 放弃还没播放的分句合成
+        self.synthesis.cancel()
         # if self.immersiveMode:
         #     self.brain.pause()
 
+    def _book_position(self):
+        return (
+            self.book_id,
+            self.book_content_id,
+            self.book_content_sequence,
+            self.book_content_text_id,
+            self.book_content_text_sequence,
+        )
+
+    def _restore_position(self):
+        """
+        绘本的句子在入队时就更新了 book_* 进度，被打断时改回最后一句完整播放完的位置，
+        续读时从被打断的那句接着读
+        """
+        position = self._played_position
+        if position is None or position[0] != self.book_id:
+            return
+        _, content_id, content_sequence, text_id, text_sequence = position
+        self.set_book_content_id(content_id)
+        self.set_book_content_sequence(content_sequence)
+        self.set_book_content_text_id(text_id)
+        self.set_book_content_text_sequence(text_sequence)
+
+    def onBargeIn(self, onset):
+        """
+        打断检测回调：朗读时孩子开口了
+
+        :param onset: 孩子开口的时间（time.monotonic()）
+        """
+        threading.Thread(target=self._bargeIn, args=(onset,), daemon=True).start()
+
+    def _bargeIn(self, onset):
+        self.interrupt()
+        logger.info(f"朗读被打断，距孩子开口 {(time.monotonic() - onset) * 1000:.0f} ms")
+        self.isRecording = True
+        try:
+            # 从孩子开口的那一刻开始录，开头的音节由预录音频补上
+            query = self.activeListen(silent=True, preroll_since=onset)
+        finally:
+            self.isRecording = False
+        if query:
+            self.doResponse(query)
+        elif self.storyMode:
+            self.resume()
+
     def reInit(self):
         """重新初始化"""
         try:
@@ -486,7 +535,11 @@ class Conversation(object):
         try:
             self.ai = AI.get_robot_by_slug(config.get("robot", "tuling"))
             self.tts = TTS.get_engine_by_slug(config.get("tts_engine", "baidu-tts"))
+            if getattr(self, "prefetcher", None):
+                self.prefetcher.tts = self.tts
             self.nlu = NLU.get_engine_by_slug(config.get("nlu_engine", "unit"))
+            if getattr(self, "player", None):
+                self.player.close()
             self.player = Player.SoxPlayer()
             self.brain = Brain(self)
             self.brain.printPlugins()
@@ -544,10 +597,8 @@ class Conversation(object):
         self.team.invest(investment=100)
         self.team.run_project(context_str)
 
-        event_loop = asyncio.new_event_loop()
-
-        t = threading.Thread(target=run_event_loop, args=(event_loop, self.team.run(n_round=20)))
-        t.start()
+        # 智能体的动作中有朗读、录音等阻塞调用，在运行时的常驻工作线程中运行
+        self.runtime.spawn(self.team.run(n_round=20), group="team")
 
     def doParse(self, query):
         args = {
@@ -570,11 +621,12 @@ class Conversation(object):
         logger.info("结束录音")
         self.lifeCycleHandler.onThink()
         self.isRecording = False
+        session, self._asr_session = self._asr_session, None
         if self.profiling:
             logger.info("性能调试已打开")
             pr = cProfile.Profile()
             pr.enable()
-            self.doConverse(fp, callback)
+            self.doConverse(fp, callback, asr_session=session)
             pr.disable()
             s = io.StringIO()
             sortby = "cumulative"
@@ -582,12 +634,46 @@ class Conversation(object):
             ps.print_stats()
             print(s.getvalue())
         else:
-            self.doConverse(fp, callback)
+            self.doConverse(fp, callback, asr_session=session)
 
-    def doConverse(self, fp, callback=None, onSay=None, onStream=None):
+    def onRecordFrame(self, data):
+        """
+        唤醒后录音的每一帧，启用流式识别时边录边送给 ASR
+        """
+        if self._asr_session is None:
+            self._asr_session = self._asr_stream() or False
+        if self._asr_session:
+            self._asr_session.feed(data)
+
+    def _asr_stream(self):
+        """
+        开始一次流式识别
+
+        :returns: 流式识别会话，未启用或引擎不支持时返回 None
+        """
+        if not config.get("/asr_stream/enable", False):
+            return None
+        try:
+            return self.asr.stream(on_partial=lambda text: logger.info(f"实时识别：{text}"))
+        except Exception as e:
+            logger.warning(f"流式识别启动失败，改用录音文件识别：{e}")
+            return None
+
+    def _transcribe(self, fp, session=None):
+        """
+        取得识别结果：优先使用录音过程中的流式识别结果，失败时再识别录音文件
+        """
+        if session:
+            query = session.finish(config.get("/asr_stream/final_timeout", 3))
+            if query is not None:
+                logger.info(f"{self.asr.SLUG} 流式识别到了：{query}")
+                return query
+        return self.asr.transcribe(fp)
+
+    def doConverse(self, fp, callback=None, onSay=None, onStream=None, asr_session=None):
         self.interrupt()
         try:
-            query = self.asr.transcribe(fp)
+            query = self._transcribe(fp, asr_session)
             logger.info(f"doConverse query-------:{query}")
         except Exception as e:
             logger.critical(f"ASR识别失败：{e}", stack_info=True)
@@ -664,65 +750,78 @@ class Conversation(object):
 
     def _tts(self, msg, volume, silent, speed_ratio, emotion, character_category, cache, onCompleted=None):
         """
-        对字符串进行 TTS 并返回合成后的音频
-        :param lines: 字符串列表
+        对字符串分句后交给合成流水线，并发合成、按顺序播放
+        :param msg: 字符串
         :param cache: 是否缓存 TTS 结果
+        :returns: 播放过的语音文件列表
         """
-        audios = []
-        pattern = r"http[s]?://.+"
-        logger.info("_tts")
-        with self.tts_lock:
-            with ThreadPoolExecutor(max_workers=5) as pool:
-                all_task = []
-                index = 0
-                if re.match(pattern, msg):
-                    logger.info("内容包含URL，屏蔽后续内容")
-                    self.tts_count -= 1
-                if msg:
-                    task = pool.submit(
-                        self._ttsAction, msg.strip(), volume, silent, speed_ratio, emotion, character_category, cache, index, onCompleted
-                    )
-                    index += 1
-                    all_task.append(task)
-                else:
-                    self.tts_count -= 1
-                for future in as_completed(all_task):
-                    audio = future.result()
-                    if audio:
-                        audios.append(audio)
-            return audios
+        splitter = sentence_stream.SentenceSplitter(config.get("/llm_stream/min_chars", 6))
+        lines = splitter.feed(msg) + splitter.flush()
+        return self._play_lines(lines, volume, silent, speed_ratio, emotion, character_category, cache, onCompleted)
 
     def _tts_sync(self, lines, cache):
         """
-        对字符串进行 TTS 并返回合成后的音频，同步播放
+        对字符串列表进行 TTS 并按顺序同步播放，多句并发合成
         :param lines: 字符串列表
         :param cache: 是否缓存 TTS 结果
+        :returns: 播放过的语音文件列表
         """
+        return self._play_lines(lines, 20, 125, 1.0, "happy", -1, cache)
+
+    def _play_lines(self, lines, volume, silent, speed_ratio, emotion, character_category, cache, onCompleted=None):
         audios = []
         pattern = r"http[s]?://.+"
-        logger.info("_tts")
+        tasks = []
+        for line in lines:
+            line = line.strip()
+            if re.match(pattern, line):
+                logger.info("内容包含URL，屏蔽后续内容")
+                break
+            if line:
+                tasks.append((line, silent, speed_ratio, emotion, character_category, cache))
         with self.tts_lock:
-            with ThreadPoolExecutor(max_workers=5) as pool:
-                all_task = []
-                index = 0
-                for line in lines:
-                    if re.match(pattern, line):
-                        logger.info("内容包含URL，屏蔽后续内容")
-                        self.tts_count -= 1
-                        continue
-                    if line:
-                        task = pool.submit(
-                            self._ttsAction_sync, line.strip(), cache, index
-                        )
-                        index += 1
-                        all_task.append(task)
+            # 后面的句子在前面的句子播放时合成，播放顺序与提交顺序一致；interrupt() 时放弃剩下的句子
+            for index, (task, result) in enumerate(self.synthesis.map(tasks)):
+                if result is None:
+                    continue
+                voice, pcm, temporary = result
+                logger.info(f"即将播放第{index}段TTS。msg: {task[0]}")
+                with self.play_lock:
+                    if pcm is not None:
+                        self.player.doPlayChunk(pcm, volume)
+                        self.player.drain()
                     else:
-                        self.tts_count -= 1
-                for future in as_completed(all_task):
-                    audio = future.result()
-                    if audio:
-                        audios.append(audio)
-            return audios
+                        self.player.play_sync(voice, volume, temporary)
+                        audios.append(voice)
+        self._runCompleted(onCompleted)
+        return audios
+
+    async def _synthesize(self, task):
+        """
+        合成流水线中合成一句话
+
+        :param task: (msg, silent, speed_ratio, emotion, character_category, cache)
+        :returns: (语音文件, PCM 数据, 播放后是否删除文件)，语音文件和 PCM 数据只有一个不为 None
+        """
+        msg, silent, speed_ratio, emotion, character_category, cache = task
+        voice = self._voice(speed_ratio, emotion, character_category)
+        cached = utils.getCache(msg, **voice)
+        if cached:
+            return cached, None, False
+        if self.tts.is_streaming():
+            pcm_chunks = [
+                chunk
+                async for chunk in self.tts.get_speech_ws_stream(msg, silent, speed_ratio, emotion, character_category)
+            ]
+            if cache:
+                return await utils.saveWsStreamVoiceCache(pcm_chunks, msg, **voice), None, False
+            return None, b"".join(pcm_chunks), False
+        path = await asyncio.get_running_loop().run_in_executor(None, self.tts.get_speech, msg)
+        if path and cache:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, lambda: utils.saveVoiceFileCache(path, msg, **voice)
+            ), None, False
+        return path, None, True
 
     def _after_play(self, msg, audios, plugin=""):
         pass
@@ -779,56 +878,77 @@ class Conversation(object):
 
     def _process_queue(self):
         """
-        循环处理队列中的任务
+        循环处理队列中的任务，队列为空或暂停时阻塞等待
         """
         while True:
+            item = self.speech.get()
+            if item is None:
+                break
+            interrupts = self._interrupts
+            self._pipeline_next()
             try:
-                with self.lock:
-                    while self.paused:  # 如果暂停，则等待
-                        self.condition.wait()  # 在这里等待
-                # task = None
-                if not self.priority_queue.empty():
-                    task = self.priority_queue.get()
-                # 如果优先级队列为空，检查普通队列
-                elif not self.queue.empty():
-                    task = self.queue.get()
-                else:
-                    time.sleep(0.01)  # 如果两个队列都为空，休眠防止占用过多CPU资源
-                    continue
-
-                # task = self.queue.get()  # 从队列中取出一个任务
-                if task is None:
-                    break
-                if not self.is_speaking:
-                    # clearBook是一个标志位，在播放完绘本的最后一句后传入，退出绘本故事模式，清空绘本id等设置
-                    msg, volume, tts_silent, cache_play_silence_duration, speed_ratio, emotion, character_category, cache, plugin, onCompleted, append_history, clearBook = task
-                    if not clearBook:
-                        with self.tts_lock:
-                            self.is_speaking = True
-                            logger.info("开始处理语音...")
-                            # 调用 _process_say 来执行语音处理
-                        try:
-                            self._process_say(msg, volume, tts_silent, cache_play_silence_duration, speed_ratio, emotion, character_category, cache, plugin,
-                                                  onCompleted, append_history)
-                        finally:
-                            with self.tts_lock:
-                                self.is_speaking = False
-                                self.tts_condition.notify()  # 确保通知在最后
-                            # 语音播放结束后，通知下一个语音可以开始处理
-                        with self.tts_lock:
-                            self.is_speaking = False
-                            self.tts_condition.notify()
-                    else:
-                        self.setStoryMode(False)
-                        self.set_book_id(None)
-                        self.set_book_content_id(None)
-                        self.set_book_content_sequence(None)
-                        self.set_book_content_text_id(None)
-                        self.set_book_content_text_sequence(None)
+                # clearBook是一个标志位，在播放完绘本的最后一句后传入，退出绘本故事模式，清空绘本id等设置
+                msg, volume, tts_silent, cache_play_silence_duration, speed_ratio, emotion, character_category, cache, plugin, onCompleted, append_history, clearBook = item.task
+                if not clearBook:
+                    self.is_speaking = True
+                    logger.info("开始处理语音...")
+                    try:
+                        self._process_say(msg, volume, tts_silent, cache_play_silence_duration, speed_ratio, emotion, character_category, cache, plugin,
+                                          onCompleted, append_history)
+                        if item.context is not None and interrupts == self._interrupts:
+                            self._played_position = item.context
+                    finally:
+                        self.is_speaking = False
                 else:
-                    logger.info("正在处理语音，跳过新任务")
+                    if self.prefetcher:
+                        self.prefetcher.cancel()
+                    self.setStoryMode(False)
+                    self._played_position = None
+                    self.set_book_id(None)
+                    self.set_book_content_id(None)
+                    self.set_book_content_sequence(None)
+                    self.set_book_content_text_id(None)
+                    self.set_book_content_text_sequence(None)
             except Exception as e:
-                print(f"Error in processing queue: {e}")  # 输出错误信息
+                logger.error(f"处理朗读任务出错：{e}", stack_info=True)
+            finally:
+                self.speech.task_done(item)
+                timing = item.timing
+                if "first_audio" in timing:
+                    logger.info(
+                        f"朗读耗时：排队 {(timing['start'] - timing['enqueued']) * 1000:.0f} ms，"
+                        f"首个声音 {(timing['first_audio'] - timing['start']) * 1000:.0f} ms，"
+                        f"总计 {(timing['done'] - timing['enqueued']) * 1000:.0f} ms"
+                    )
+
+    def _pipeline_next(self):
+        """
+        当前这句开始处理时，提前发出队列中下一句的流式合成请求（缓存未命中时），
+        这句播放完时下一句的音频已经在路上
+        """
+        item = self.speech.peek()
+        if item is None:
+            return
+        msg, volume, tts_silent, cache_play_silence_duration, speed_ratio, emotion, character_category, cache, plugin, onCompleted, append_history, clearBook = item.task
+        if not msg or clearBook:
+            return
+        self._pipeline(msg, tts_silent, speed_ratio, emotion, character_category)
+
+    def _pipeline(self, msg, tts_silent, speed_ratio, emotion, character_category):
+        if VoiceCache.get_cache().peek(msg, **self._voice(speed_ratio, emotion, character_category)):
+            return
+        if self.prefetcher and self.prefetcher.is_scheduled(msg, speed_ratio, emotion, character_category):
+            return
+        self.tts.pipeline(msg, tts_silent, speed_ratio, emotion, character_category)
+
+    def pipeline_sync(self, msg, tts_silent=125, speed_ratio=1.0, emotion="happy", character_category=-1):
+        """
+        提前发出一句话的流式合成请求（缓存未命中时），之后以相同参数 say_sync 时直接使用，
+        边生成边朗读时用来让下一句的合成与这一句的播放重叠
+        """
+        msg = utils.stripPunctuation(msg).strip()
+        if msg:
+            self._pipeline(msg, tts_silent, speed_ratio, emotion, character_category)
 
     def _process_say(self, msg, volume, tts_silent, cache_play_silence_duration, speed_ratio, emotion, character_category, cache, plugin, onCompleted,
                      append_history):
@@ -839,6 +959,8 @@ class Conversation(object):
         if not msg:
             return
 
+        self.speech.mark("start")
+
         logger.info(f"即将朗读语音：{msg}")
 
         # 如果 onCompleted 是 None，默认设置为 self._onCompleted
@@ -855,16 +977,24 @@ class Conversation(object):
         """
         将文本加入朗读队列
         """
-        # 将任务放入队列
-        self.queue.put((msg, volume, tts_silent, cache_play_silence_duration, speed_ratio, emotion, character_category, cache, plugin, onCompleted, append_history, clearBook))
+        # 将任务放入队列，绘本的句子带上入队时的阅读位置
+        self.speech.put(
+            (msg, volume, tts_silent, cache_play_silence_duration, speed_ratio, emotion, character_category, cache, plugin, onCompleted, append_history, clearBook),
+            SpeechScheduler.NORMAL,
+            self.speech_token,
+            context=self._book_position() if self.storyMode and self.book_id is not None else None,
+        )
 
-    def say_with_priority(self, msg, volume, tts_silent=125, cache_play_silence_duration=2, speed_ratio=1.0, emotion="happy", character_category=-1, cache=False, plugin="", onCompleted=None, append_history=True, clearBook=False):
+    def say_with_priority(self, msg, volume, tts_silent=125, cache_play_silence_duration=2, speed_ratio=1.0, emotion="happy", character_category=-1, cache=False, plugin="", onCompleted=None, append_history=True, clearBook=False, priority=SpeechScheduler.HIGH):
         """
-       将文本加入优先朗读队列
-       """
-        # 将任务插入优先级队列
-        self.priority_queue.put(
-            (msg, volume, tts_silent, cache_play_silence_duration, speed_ratio, emotion, character_category, cache, plugin, onCompleted, append_history, clearBook))
+        将文本加入优先朗读队列
+
+        :param priority: SpeechScheduler.HIGH 插到普通朗读之前；SpeechScheduler.URGENT 还会打断正在播放的语音
+        """
+        self.speech.put(
+            (msg, volume, tts_silent, cache_play_silence_duration, speed_ratio, emotion, character_category, cache, plugin, onCompleted, append_history, clearBook),
+            priority,
+        )
 
     def say_sync(self, msg, volume, tts_silent=125, cache_play_silence_duration=2, speed_ratio=1.0, emotion="happy", character_category=-1, cache=False, plugin="", onCompleted=None, append_history=True):
         """
@@ -883,19 +1013,30 @@ class Conversation(object):
             return
 
         logger.info(f"即将朗读语音：{msg}")
+        # 只查询不计入命中统计，_ttsAction 还会再查一次
+        if not VoiceCache.get_cache().peek(msg, **self._voice(speed_ratio, emotion, character_category)):
+            splitter = sentence_stream.SentenceSplitter(config.get("/llm_stream/min_chars", 6))
+            lines = splitter.feed(msg) + splitter.flush()
+            if len(lines) > 1:
+                # 多句话交给合成流水线：后面的句子在前面的句子播放时合成
+                audios = self._play_lines(lines, volume, tts_silent, speed_ratio, emotion, character_category, cache, onCompleted)
+                self._after_play(msg, audios, plugin)
+                return
         audios = self._ttsAction(msg, volume, tts_silent, cache_play_silence_duration, speed_ratio, emotion, character_category, cache, 0, onCompleted)
         self._after_play(msg, audios, plugin)
 
-    def activeListen(self, silent=False, silent_count_threshold=10, recording_timeout=60):
+    def activeListen(self, silent=False, silent_count_threshold=10, recording_timeout=60, preroll_since=None):
         """
         主动问一个问题(适用于多轮对话)
         :param silent: 是否不触发唤醒表现（主要用于极客模式）
-        :param
+        :param preroll_since: 从这个时间（time.monotonic()）开始录音，默认为播放结束时
         """
         if self.immersiveMode:
             self.player.stop()
         elif self.player.is_playing():
             self.player.join()  # 确保所有音频都播完
+        # 从这一刻起孩子说的话都要录下来，包括唤醒提示音和打开监听器期间
+        listen_since = preroll_since or time.monotonic()
         logger.info("进入主动聆听...")
         try:
             if not silent:
@@ -903,16 +1044,28 @@ class Conversation(object):
             listener = snowboydecoder.ActiveListener(
                 [constants.getHotwordModel(config.get("hotword", "wukong.pmdl"))]
             )
+            session = self._asr_stream()
             voice = listener.listen(
                 silent_count_threshold=silent_count_threshold,
                 recording_timeout=recording_timeout,
+                audio_frame_callback=session.feed if session else None,
+                vad=Vad.get_vad(sample_rate=listener.detector.SampleRate()),
+                audio_input=AudioInput.get_input(
+                    listener.detector.SampleRate(), listener.detector.NumChannels()
+                ),
+                preroll_since=listen_since,
             )
             if not silent:
                 self.lifeCycleHandler.onThink()
             if voice:
-                query = self.asr.transcribe(voice)
+                # 录音数据已经在内存中，直接交给 ASR，不再读回录音文件
+                clip = AudioClip.from_frames(
+                    listener.recordedData, listener.detector.SampleRate(), path=voice
+                )
+                query = self._transcribe(clip, session)
                 utils.check_and_delete(voice)
                 return query
+            session and session.cancel()
             return ""
         except Exception as e:
             logger.error(f"主动聆听失败：{e}", stack_info=True)
@@ -923,5 +1076,6 @@ class Conversation(object):
         """播放一个音频"""
         if self.player:
             self.interrupt()
+            self.player.close()
         self.player = Player.SoxPlayer()
         self.player.play(src, delete=delete, onCompleted=onCompleted)
\ No newline at end of file
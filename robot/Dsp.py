@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+# 增益使用 Q14 定点数：16384 表示 1.0，int16 采样乘以增益后仍在 int32 范围内，
+# 最大增益约为 4.0
+GAIN_SHIFT = 14
+UNITY = 1 << GAIN_SHIFT
+MAX_GAIN = (1 << 31) // 32768 - 1
+
+
+def gain_for(volume):
+    """
+    把音量百分比换算成 Q14 定点增益，播放前计算一次，之后每块直接使用
+
+    :param volume: 音量百分比，100 为原始音量
+    """
+    return max(0, min(MAX_GAIN, int(round(volume * UNITY / 100))))
+
+
+class GainStage(object):
+    """
+    播放器的音量处理：定点增益、饱和、软限幅和淡入淡出
+
+    所有中间结果写入预先分配的 int32 缓冲区，处理过程中不再分配内存，
+    也不会像浮点乘法后直接 astype(int16) 那样溢出回绕。
+    一个 GainStage 只能在一个线程里使用。
+    """
+
+    def __init__(self, block, fade=0, knee=0.9, ratio=4):
+        """
+        :param block: 单次处理的最大采样数
+        :param fade: 淡入淡出的采样数，0 表示不淡入淡出
+        :param knee: 软限幅起点（相对满幅的比例），为 None 时只做硬饱和
+        :param ratio: 超过起点部分的压缩比
+        """
+        self.block = block
+        self._tmp = np.zeros(block, dtype=np.int32)
+        self._mask = np.zeros(block, dtype=bool)
+        self.fade = fade
+        # 淡入、淡出曲线；淡出在 PyAudio 回调线程中执行，使用单独的缓冲区
+        self._ramp = (np.arange(1, fade + 1, dtype=np.int64) * UNITY // fade).astype(np.int32) if fade else None
+        self._ramp_down = self._ramp[::-1] - self._ramp[0] if fade else None
+        self._fade_tmp = np.zeros(fade, dtype=np.int32)
+        self.knee = int(knee * 32767) if knee else None
+        self.ratio = ratio
+
+    def mix(self, samples, dst, gain, offset=None):
+        """
+        把一块 int16 采样乘以增益后叠加到 int32 的 dst 上
+
+        :param samples: int16 数组，长度不超过 block
+        :param dst: int32 数组，与 samples 等长
+        :param gain: gain_for() 得到的定点增益
+        :param offset: 需要淡入时传入这一块在整段声音中的位置，位于开头 fade 个采样内的部分淡入
+        """
+        n = len(samples)
+        tmp = self._tmp[:n]
+        np.multiply(samples, gain, out=tmp, dtype=np.int32)
+        np.right_shift(tmp, GAIN_SHIFT, out=tmp)
+        if self.fade and offset is not None and offset < self.fade:
+            k = min(n, self.fade - offset)
+            head = tmp[:k]
+            np.multiply(head, self._ramp[offset : offset + k], out=head)
+            np.right_shift(head, GAIN_SHIFT, out=head)
+        np.add(dst, tmp, out=dst)
+
+    def fade_out(self, samples):
+        """
+        对一块 int16 采样原地淡出，用于打断时避免爆音
+        """
+        if not self.fade:
+            return
+        n = min(len(samples), self.fade)
+        tmp = self._fade_tmp[:n]
+        np.multiply(samples[:n], self._ramp_down[:n], out=tmp, dtype=np.int32)
+        np.right_shift(tmp, GAIN_SHIFT, out=tmp)
+        samples[:n] = tmp
+        samples[n:] = 0
+
+    def limit(self, acc):
+        """
+        对叠加后的 int32 采样原地软限幅并饱和到 int16 范围
+        """
+        peak = max(acc.max(), -acc.min())
+        if self.knee is not None and peak > self.knee:
+            # 超过起点的部分按压缩比压缩，只有接近满幅的块才会走到这里
+            mask = self._mask[: len(acc)]
+            np.greater(np.abs(acc, out=self._tmp[: len(acc)]), self.knee, out=mask)
+            over = acc[mask]
+            acc[mask] = np.sign(over) * (self.knee + (np.abs(over) - self.knee) // self.ratio)
+            peak = max(acc.max(), -acc.min())
+        if peak > 32767:
+            np.minimum(acc, 32767, out=acc)
+            np.maximum(acc, -32768, out=acc)
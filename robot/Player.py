@@ -1,17 +1,17 @@
 # -*- coding: utf-8 -*-
-import asyncio
 import subprocess
 import os
 import platform
 import queue
 import signal
 import threading
-import pyaudio
-import numpy as np
 from pydub import AudioSegment
 import io
 
 from robot import logging
+from robot.AudioOutput import get_output
+from robot.Runtime import get_runtime
+from robot.VoiceCache import PcmAudio
 from ctypes import CFUNCTYPE, c_char_p, c_int, cdll
 from contextlib import contextmanager
 
@@ -87,12 +87,16 @@ class SoxPlayer(AbstractPlayer):
         self.play_event = threading.Event()
         self.consumer_thread = threading.Thread(target=self.playLoop)
         self.consumer_thread.start()
-        self.loop = asyncio.new_event_loop()  # 创建事件循环
-        self.thread_loop = threading.Thread(target=self.loop.run_forever)
-        self.thread_loop.start()
+        self.runtime = get_runtime()
 
-        # 初始化 pyaudio
-        self.p = pyaudio.PyAudio()
+        # 在共享输出引擎上占用的声道，第一次播放 PCM 时创建
+        self._channel = None
+
+    @property
+    def channel(self):
+        if self._channel is None:
+            self._channel = get_output().channel()
+        return self._channel
 
     def executeOnCompleted(self, res, onCompleted):
         # 全部播放完成，播放统一的 onCompleted()
@@ -103,7 +107,12 @@ class SoxPlayer(AbstractPlayer):
 
     def playLoop(self):
         while True:
-            (src, onCompleted) = self.play_queue.get()
+            item = self.play_queue.get()
+            if item is None:
+                # close()
+                self.play_queue.task_done()
+                break
+            (src, onCompleted) = item
             if src:
                 self.playing = True
                 with self.play_lock:
@@ -111,10 +120,8 @@ class SoxPlayer(AbstractPlayer):
                     self.src = src
                     res = self.doPlayAudio(src)
                     self.play_queue.task_done()
-                    # 将 onCompleted() 方法的调用放到事件循环的线程中执行
-                    self.loop.call_soon_threadsafe(
-                        self.executeOnCompleted, res, onCompleted
-                    )
+                    # onCompleted() 可能阻塞，放到运行时的线程池中执行，不耽误播放下一个音频
+                    self.runtime.run_in_executor(self.executeOnCompleted, res, onCompleted)
 
     def doPlayAudio(self, src, volume=20):
         system = platform.system()
@@ -136,51 +143,16 @@ class SoxPlayer(AbstractPlayer):
 
     def doPlay(self, audio_stream, volume=50):
         self.playing = True
-        # 将 MP3 流转换为 PCM 数据
-        audio_stream.seek(0)
-        mp3_audio = AudioSegment.from_mp3(io.BytesIO(audio_stream.read()))
-
-        # 导出 PCM 数据
-        pcm_data = io.BytesIO()
-        mp3_audio.export(pcm_data, format="raw")
-
-        # 重置指针到流的开头
-        pcm_data.seek(0)
-
-        sample_width = mp3_audio.sample_width
-        channels = mp3_audio.channels
-        sample_rate = mp3_audio.frame_rate
-
-        # 打开一个 pyaudio 播放流
-        stream = self.p.open(format=self.p.get_format_from_width(sample_width),
-                        channels=channels,
-                        rate=sample_rate,
-                        output=True)
-
-        # 定义每次读取的块大小（字节）
-        chunk_size = 1024
-
         try:
-            # 逐块读取并播放 PCM 数据
-            while True:
-                data = pcm_data.read(chunk_size)
-                if not data:
-                    break
-                # 将字节数据转换为 NumPy 数组，进行振幅调整
-                audio_array = np.frombuffer(data, dtype=np.int16)  # 假设为 16 位采样
-                audio_array = (audio_array * (volume / 100)).astype(np.int16)  # 音量减半
-
-                # 将调整后的数据转换回字节格式并播放
-                stream.write(audio_array.tobytes())
-
+            # 将 MP3 流转换为 PCM 数据，送入共享输出流
+            audio_stream.seek(0)
+            mp3_audio = AudioSegment.from_mp3(io.BytesIO(audio_stream.read()))
+            mp3_audio = mp3_audio.set_channels(1).set_sample_width(2)
+            self.channel.write(mp3_audio.raw_data, mp3_audio.frame_rate, volume, wait=True)
             logger.info("播放完成")
         except Exception as e:
             logger.error(f"播放过程中出错: {e}")
         finally:
-            # 停止和关闭流
-            stream.stop_stream()
-            stream.close()
-
             self.playing = False
 
         return True
@@ -193,7 +165,10 @@ class SoxPlayer(AbstractPlayer):
             logger.critical(f"path not exists: {src}", stack_info=True)
 
     def play_sync(self, src, volume=20, delete=False):
-        if src and (os.path.exists(src) or src.startswith("http")):
+        if src and src.endswith(".pcm"):
+            # PCM 缓存直接送入 PyAudio，不需要启动 play 进程解码
+            self.play_pcm(src, volume)
+        elif src and (os.path.exists(src) or src.startswith("http")):
             self.delete = delete
             self.playing = True
             # self.play_event.clear()  # Reset the event
@@ -206,27 +181,46 @@ class SoxPlayer(AbstractPlayer):
         else:
             logger.critical(f"path not exists: {src}", stack_info=True)
 
-    def doPlayChunk(self, pcm_chunk, volume=50):
-        pcm_data = io.BytesIO(pcm_chunk)
-        sample_width = 2  # 假设使用16位PCM
-        channels = 1  # 假设单声道
-        sample_rate = 24000  # 假设采样率为44100Hz
-
-        chunk_size = 4096
-
-        stream = self.p.open(format=self.p.get_format_from_width(sample_width),
-                        channels=channels,
-                        rate=sample_rate,
-                        output=True)
-
-        while True:
-            data = pcm_data.read(chunk_size)
-            if not data:
-                break
-
-            audio_array = np.frombuffer(data, dtype=np.int16)
-            audio_array = (audio_array * (volume / 100)).astype(np.int16)
-            stream.write(audio_array.tobytes())
+    def doPlayChunk(self, pcm_chunk, volume=50, sample_rate=24000):
+        """
+        排队播放一块 16 位单声道 PCM，立即返回，需要等待播放完成时调用 drain()
+        """
+        self.channel.write(pcm_chunk, sample_rate, volume)
+
+    def play_silence(self, duration):
+        """
+        在已排队的声音之后插入一段静音，并等待播放到静音结束
+        """
+        self.channel.silence(duration, wait=True)
+
+    def drain(self, timeout=None):
+        """
+        等待已排队的 PCM 全部播放完，stop() 之后立即返回
+        """
+        return self.channel.drain(timeout)
+
+    def play_pcm(self, src, volume=20):
+        """
+        播放 PCM 缓存文件：以内存映射方式打开，直接交给共享输出流，stop() 可立即打断
+        """
+        self.playing = True
+        try:
+            audio = PcmAudio(src)
+            try:
+                if audio.channels != 1 or audio.sample_width != 2:
+                    raise ValueError(f"不支持的 PCM 格式：{audio.channels} 声道，{audio.sample_width} 字节")
+                self.channel.write(audio.data, audio.sample_rate, volume, wait=True)
+            finally:
+                try:
+                    audio.close()
+                except BufferError:
+                    # 被打断时混音线程可能还引用着这块内存，交给垃圾回收释放
+                    pass
+            logger.info(f"播放完成：{src}")
+        except Exception as e:
+            logger.error(f"播放 PCM 缓存出错：{e}")
+        finally:
+            self.playing = False
 
     def preappendCompleted(self, onCompleted):
         onCompleted and self.onCompleteds.insert(0, onCompleted)
@@ -238,6 +232,8 @@ class SoxPlayer(AbstractPlayer):
         self.run()
 
     def stop(self):
+        if self._channel:
+            self._channel.flush()
         if self.proc:
             self.onCompleteds = []
             self.proc.terminate()
@@ -248,6 +244,15 @@ class SoxPlayer(AbstractPlayer):
             # if self.delete:
             #     utils.check_and_delete(self.src)
 
+    def close(self):
+        """
+        不再使用这个播放器：结束播放线程，归还输出引擎上的声道（排队的声音仍会播完）
+        """
+        self.play_queue.put(None)
+        channel, self._channel = self._channel, None
+        if channel:
+            channel.close()
+
     def is_playing(self):
         return self.playing or not self.play_queue.empty()
 
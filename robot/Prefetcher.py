@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from robot import config, logging, utils
+from robot.Runtime import get_runtime
+from robot.VoiceCache import get_cache
+
+logger = logging.getLogger(__name__)
+
+
+class TTSPrefetcher(object):
+    """
+    绘本语音预合成
+
+    选中绘本后，把绘本里所有已知的句子（书名、副标题、封面、每页文字和描述、
+    以及固定的翻页用语）分段交给预合成器。预合成器在共享运行时的事件循环中以有限的并发
+    调用流式 TTS，始终只比播放进度领先 pages_ahead 段，合成结果写入语音缓存，
+    播放时直接命中缓存。
+    """
+
+    def __init__(self, tts, concurrency=2, pages_ahead=2, wait_timeout=10):
+        """
+        :param tts: TTS 引擎
+        :param concurrency: 同时进行的合成请求数
+        :param pages_ahead: 领先播放进度的段数
+        :param wait_timeout: 播放到一句正在合成的话时，最多等待多久（秒）
+        """
+        self.tts = tts
+        self.concurrency = concurrency
+        self.pages_ahead = pages_ahead
+        self.wait_timeout = wait_timeout
+
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._segments = []
+        self._segment_of = {}
+        self._scheduled = 0
+        self._futures = {}
+
+        self._runtime = get_runtime()
+        # 在共享事件循环中第一次合成时创建
+        self._semaphore = None
+
+    def _voice(self, speed_ratio, emotion, character_category):
+        return {
+            "voice_type": self.tts.get_voice_type(character_category),
+            "speed_ratio": speed_ratio,
+            "emotion": emotion,
+        }
+
+    def _key(self, text, speed_ratio, emotion, character_category):
+        return utils.getCacheKey(text, **self._voice(speed_ratio, emotion, character_category))
+
+    def is_supported(self):
+        """
+        只有实现了流式合成的引擎才能预合成
+        """
+        return self.tts.is_streaming()
+
+    def prefetch(self, segments):
+        """
+        开始预合成一本绘本，之前未完成的预合成会被放弃
+
+        :param segments: 按播放顺序排列的分段，每段是
+                         (text, speed_ratio, emotion, character_category) 的列表，
+                         第一段通常是封面和固定用语，之后每页一段
+        """
+        if not self.is_supported():
+            return
+        with self._lock:
+            self._generation += 1
+            self._segments = segments
+            self._segment_of = {}
+            for index, segment in enumerate(segments):
+                for line in segment:
+                    self._segment_of.setdefault(self._key(*line), index)
+            self._scheduled = 0
+            self._futures = {}
+            self._schedule_until(self.pages_ahead)
+        logger.info(f"开始预合成绘本语音，共 {len(segments)} 段")
+
+    def _schedule_until(self, last):
+        """
+        提交 [已提交段, last] 之间的句子，调用方需持有 self._lock
+        """
+        last = min(last, len(self._segments) - 1)
+        while self._scheduled <= last:
+            for line in self._segments[self._scheduled]:
+                key = self._key(*line)
+                if key in self._futures:
+                    continue
+                self._futures[key] = self._runtime.submit(
+                    self._synthesize(line, self._generation), group="prefetch"
+                )
+            self._scheduled += 1
+
+    def on_play(self, text, speed_ratio, emotion, character_category):
+        """
+        播放到某一句时调用，推进预合成窗口
+        """
+        key = self._key(text, speed_ratio, emotion, character_category)
+        with self._lock:
+            index = self._segment_of.get(key)
+            if index is not None:
+                self._schedule_until(index + self.pages_ahead)
+
+    def is_scheduled(self, text, speed_ratio, emotion, character_category):
+        """
+        这句话是否已经交给预合成
+        """
+        key = self._key(text, speed_ratio, emotion, character_category)
+        with self._lock:
+            return key in self._futures
+
+    def wait(self, text, speed_ratio, emotion, character_category):
+        """
+        如果这句话正在预合成，等待它写入缓存
+
+        :returns: 是否已经写入缓存
+        """
+        key = self._key(text, speed_ratio, emotion, character_category)
+        with self._lock:
+            future = self._futures.get(key)
+        if future is None:
+            return False
+        try:
+            return bool(future.result(timeout=self.wait_timeout))
+        except FutureTimeoutError:
+            logger.warning(f"等待预合成超时：{text}")
+        except Exception as e:
+            logger.error(f"预合成失败：{e}")
+        return False
+
+    def cancel(self):
+        """
+        放弃当前绘本的预合成，正在进行的合成一并中止
+        """
+        with self._lock:
+            self._generation += 1
+            self._segments = []
+            self._segment_of = {}
+            self._scheduled = 0
+            self._futures = {}
+        self._runtime.cancel("prefetch")
+
+    async def _synthesize(self, line, generation):
+        text, speed_ratio, emotion, character_category = line
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            if generation != self._generation:
+                return False
+            voice = self._voice(speed_ratio, emotion, character_category)
+            if get_cache().peek(text, **voice):
+                return True
+            pcm_chunks = []
+            async for chunk in self.tts.get_speech_ws_stream(
+                text, 125, speed_ratio, emotion, character_category
+            ):
+                pcm_chunks.append(chunk)
+            if not pcm_chunks:
+                return False
+            await utils.saveWsStreamVoiceCache(pcm_chunks, text, **voice)
+            logger.debug(f"预合成完成：{text}")
+            return True
+
+
+def get_prefetcher(tts):
+    """
+    根据配置创建预合成器，未开启时返回 None
+    """
+    if not config.get("/tts_prefetch/enable", True):
+        return None
+    return TTSPrefetcher(
+        tts,
+        concurrency=config.get("/tts_prefetch/concurrency", 2),
+        pages_ahead=config.get("/tts_prefetch/pages_ahead", 2),
+        wait_timeout=config.get("/tts_prefetch/wait_timeout", 10),
+    )
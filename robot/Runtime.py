@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from robot import config, logging
+
+logger = logging.getLogger(__name__)
+
+
+class Runtime(object):
+    """
+    统一的异步运行时
+
+    整个进程共用一个长期运行的事件循环线程和有限大小的线程池，代替各处临时创建的
+    事件循环和线程：
+
+    - submit() / run()：把协程交给共享事件循环，协程中不能有阻塞调用；同时运行的
+      协程数不超过 max_tasks，超出的排队等待
+    - run_in_executor()：阻塞的普通函数放到线程池中执行，也是共享事件循环的默认执行器
+    - spawn()：协程中有阻塞调用（例如智能体朗读、录音）时，在 agent_workers 个常驻工作
+      线程中运行，每个工作线程复用自己的事件循环，不会卡住共享事件循环；指定 pool 时在
+      这个名字专用的单个工作线程中运行，不会因为常驻工作线程被长时间运行的智能体占满而排队
+    - cancel()：按分组取消还没完成的协程
+    """
+
+    def __init__(self, workers=4, agent_workers=3, max_tasks=64):
+        """
+        :param workers: 执行阻塞函数的线程数
+        :param agent_workers: 运行含阻塞调用的协程的线程数
+        :param max_tasks: 共享事件循环中同时运行的协程数上限
+        """
+        self.max_tasks = max_tasks
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="runtime")
+        self._agents = ThreadPoolExecutor(max_workers=agent_workers, thread_name_prefix="runtime-agent")
+        self._pools = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 分组 -> {concurrent.futures.Future: 取消函数}
+        self._groups = {}
+        self.submitted = 0
+        self.spawned = 0
+        self.running = 0
+        # run_in_executor() 提交和完成的函数数
+        self.executed = 0
+        self.completed = 0
+
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(self.executor)
+        ready = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run_loop, args=(ready,), name="runtime-loop", daemon=True
+        )
+        self._thread.start()
+        ready.wait()
+
+    def _run_loop(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._slots = asyncio.Semaphore(self.max_tasks)
+        ready.set()
+        self._loop.run_forever()
+
+    @property
+    def loop(self):
+        """
+        共享事件循环，基础设施（连接池等）可以直接在上面调度不受数量限制的协程
+        """
+        return self._loop
+
+    def in_loop(self):
+        """
+        当前线程是否就是共享事件循环线程
+        """
+        return threading.current_thread() is self._thread
+
+    def submit(self, coro, group=None):
+        """
+        在共享事件循环中运行协程，立即返回
+
+        :param coro: 协程，其中不能有阻塞调用
+        :param group: 分组名，cancel(group) 时一并取消
+        :returns: concurrent.futures.Future，可以 result() 阻塞等待，cancel() 取消协程
+        """
+        future = asyncio.run_coroutine_threadsafe(self._bounded(coro), self._loop)
+        self._track(group, future, future.cancel)
+        self.submitted += 1
+        return future
+
+    def run(self, coro, timeout=None, group=None):
+        """
+        在共享事件循环中运行协程，阻塞到完成，供同步代码调用
+
+        :returns: 协程的返回值
+        """
+        if self.in_loop():
+            coro.close()
+            raise RuntimeError("不能在共享事件循环线程中阻塞等待协程，请直接 await")
+        return self.submit(coro, group).result(timeout)
+
+    async def _bounded(self, coro):
+        try:
+            async with self._slots:
+                self.running += 1
+                try:
+                    return await coro
+                finally:
+                    self.running -= 1
+        finally:
+            # 排队期间被取消时协程还没开始，关闭它以免“从未 await”的警告
+            coro.close()
+
+    def call_soon(self, callback, *args):
+        """
+        在共享事件循环中调用一个不阻塞的普通函数（线程安全）
+        """
+        self._loop.call_soon_threadsafe(callback, *args)
+
+    def run_in_executor(self, func, *args):
+        """
+        在线程池中执行阻塞函数
+
+        :returns: concurrent.futures.Future
+        """
+        with self._lock:
+            self.executed += 1
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(self._executed)
+        return future
+
+    def _executed(self, future):
+        with self._lock:
+            self.completed += 1
+
+    def spawn(self, coro, group=None, pool=None):
+        """
+        在常驻工作线程中运行含阻塞调用的协程，立即返回
+
+        工作线程都在忙时排队等待。
+        :param pool: 专用工作线程的名字，为 None 时使用 agent_workers 个常驻工作线程
+        :returns: concurrent.futures.Future
+        """
+        future = Future()
+        state = {"task": None, "loop": None, "cancelled": False}
+
+        def cancel():
+            state["cancelled"] = True
+            if future.cancel():
+                coro.close()
+                return True
+            if state["task"] is not None:
+                state["loop"].call_soon_threadsafe(state["task"].cancel)
+            return True
+
+        def run():
+            if state["cancelled"] or not future.set_running_or_notify_cancel():
+                return
+            loop = self._worker_loop()
+            task = loop.create_task(coro)
+            state["loop"], state["task"] = loop, task
+            if state["cancelled"]:
+                task.cancel()
+            try:
+                future.set_result(loop.run_until_complete(task))
+            except BaseException as e:
+                future.set_exception(e)
+
+        self._track(group, future, cancel)
+        self.spawned += 1
+        self._pool(pool).submit(run)
+        return future
+
+    def run_blocking(self, coro, timeout=None, group=None, pool=None):
+        """
+        在常驻工作线程中运行含阻塞调用的协程，阻塞到完成
+        """
+        return self.spawn(coro, group, pool).result(timeout)
+
+    def _pool(self, name):
+        if name is None:
+            return self._agents
+        with self._lock:
+            pool = self._pools.get(name)
+            if pool is None:
+                pool = self._pools[name] = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix=f"runtime-{name}"
+                )
+        return pool
+
+    def _worker_loop(self):
+        loop = getattr(self._local, "loop", None)
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(self.executor)
+            asyncio.set_event_loop(loop)
+            self._local.loop = loop
+        return loop
+
+    def _track(self, group, future, cancel):
+        with self._lock:
+            self._groups.setdefault(group, {})[future] = cancel
+        future.add_done_callback(lambda f: self._untrack(group, f))
+
+    def _untrack(self, group, future):
+        with self._lock:
+            futures = self._groups.get(group)
+            if futures is not None:
+                futures.pop(future, None)
+                if not futures:
+                    del self._groups[group]
+
+    def cancel(self, group=None):
+        """
+        取消一个分组中还没完成的协程
+
+        :param group: 分组名，为 None 时取消所有协程
+        :returns: 取消的个数
+        """
+        with self._lock:
+            if group is None:
+                cancels = [cancel for futures in self._groups.values() for cancel in futures.values()]
+            else:
+                cancels = list(self._groups.get(group, {}).values())
+        for cancel in cancels:
+            cancel()
+        if cancels:
+            logger.info(f"取消 {len(cancels)} 个协程：{group or '全部'}")
+        return len(cancels)
+
+    def stats(self):
+        with self._lock:
+            groups = {str(group): len(futures) for group, futures in self._groups.items()}
+            executed, completed = self.executed, self.completed
+        return {
+            "submitted": self.submitted,
+            "spawned": self.spawned,
+            "running": self.running,
+            "pending": groups,
+            "executed": executed,
+            # 线程池中排队和正在执行的函数数
+            "executor_pending": executed - completed,
+        }
+
+    def shutdown(self):
+        """
+        取消所有协程并停止事件循环
+        """
+        self.cancel()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self.executor.shutdown(wait=False)
+        self._agents.shutdown(wait=False)
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.shutdown(wait=False)
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime():
+    """
+    获取进程共用的运行时
+    """
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                _runtime = Runtime(
+                    workers=config.get("/runtime/workers", 4),
+                    agent_workers=config.get("/runtime/agent_workers", 3),
+                    max_tasks=config.get("/runtime/max_tasks", 64),
+                )
+    return _runtime
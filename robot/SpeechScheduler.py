@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+from robot import logging
+
+logger = logging.getLogger(__name__)
+
+# 优先级，数字越小越先播放
+URGENT = 0  # 立即打断正在播放的低优先级语音
+HIGH = 1  # 插到所有普通语音之前，不打断当前语音
+NORMAL = 2
+
+
+class CancelToken(object):
+    """
+    取消令牌：同一批语音（例如同一本绘本）共用一个令牌，取消后还在队列中的都会被丢弃
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        return f"CancelToken({self.name!r}, cancelled={self.cancelled})"
+
+
+class SpeechItem(object):
+    """
+    队列中的一条语音
+
+    timing 记录各阶段的时间点（time.monotonic()）：
+    enqueued 入队、start 开始处理（查缓存或合成）、first_audio 第一块声音送入播放器、done 处理完毕
+    """
+
+    __slots__ = ("task", "priority", "token", "context", "timing")
+
+    def __init__(self, task, priority=NORMAL, token=None, context=None):
+        self.task = task
+        self.priority = priority
+        self.token = token
+        # 调用方附带的信息，例如这句话在绘本中的位置
+        self.context = context
+        self.timing = {"enqueued": time.monotonic()}
+
+    @property
+    def cancelled(self):
+        return self.token is not None and self.token.cancelled
+
+
+class SpeechScheduler(object):
+    """
+    朗读任务调度器
+
+    - 单个阻塞优先级队列，同一优先级内先进先出，队列为空或暂停时工作线程在条件变量上等待
+    - URGENT 语音入队时，如果正在播放的语音优先级更低，调用 on_preempt 打断它
+    - 被取消令牌标记的语音在出队时丢弃
+    - 记录每条语音从入队到开始处理、第一块声音和处理完毕的耗时
+    """
+
+    # 保留最近这么多条语音的耗时用于统计
+    HISTORY = 200
+
+    def __init__(self, on_preempt=None):
+        """
+        :param on_preempt: 高优先级语音打断当前语音时调用，通常是停止播放器
+        """
+        self.on_preempt = on_preempt
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._paused = False
+        self._closed = False
+        self._local = threading.local()
+        self.current = None
+        self.history = collections.deque(maxlen=self.HISTORY)
+        self.enqueued = 0
+        self.cancelled = 0
+        self.preempted = 0
+
+    def put(self, task, priority=NORMAL, token=None, context=None):
+        """
+        加入一条语音
+
+        :param context: 附带的信息，出队后通过 item.context 取回
+        :returns: SpeechItem
+        """
+        item = SpeechItem(task, priority, token, context)
+        with self._cond:
+            heapq.heappush(self._heap, (priority, next(self._seq), item))
+            self.enqueued += 1
+            current = self.current
+            self._cond.notify()
+        if priority == URGENT and current is not None and current.priority > URGENT:
+            self.preempted += 1
+            logger.info("高优先级语音打断当前语音")
+            self.on_preempt and self.on_preempt()
+        return item
+
+    def get(self):
+        """
+        工作线程调用，阻塞直到有可播放的语音且未暂停
+
+        :returns: SpeechItem，调度器关闭后返回 None
+        """
+        with self._cond:
+            while True:
+                while not self._closed and (self._paused or not self._heap):
+                    self._cond.wait()
+                if self._closed:
+                    return None
+                _, _, item = heapq.heappop(self._heap)
+                if item.cancelled:
+                    self.cancelled += 1
+                    continue
+                self.current = item
+                self._local.item = item
+                return item
+
+    def peek(self):
+        """
+        :returns: 下一条将要播放的语音（不出队），没有时返回 None
+        """
+        with self._cond:
+            for _, _, item in heapq.nsmallest(4, self._heap):
+                if not item.cancelled:
+                    return item
+        return None
+
+    def task_done(self, item):
+        """
+        工作线程处理完一条语音后调用
+        """
+        item.timing.setdefault("start", item.timing["enqueued"])
+        item.timing["done"] = time.monotonic()
+        with self._cond:
+            if self.current is item:
+                self.current = None
+            self.history.append(item.timing)
+        self._local.item = None
+
+    def mark(self, stage):
+        """
+        记录当前线程正在处理的语音到达某个阶段，每个阶段只记录第一次
+        """
+        item = getattr(self._local, "item", None)
+        if item is not None and stage not in item.timing:
+            item.timing[stage] = time.monotonic()
+
+    def pause(self):
+        with self._cond:
+            self._paused = True
+
+    def resume(self):
+        with self._cond:
+            self._paused = False
+            self._cond.notify_all()
+
+    @property
+    def paused(self):
+        return self._paused
+
+    def cancel(self, token=None, below=None):
+        """
+        丢弃队列中的语音
+
+        :param token: 只丢弃持有这个令牌的语音，并把令牌标记为已取消
+        :param below: 只丢弃优先级低于（数字大于等于）这个值的语音
+        :returns: 丢弃的条数
+        """
+        if token is not None:
+            token.cancel()
+        with self._cond:
+            keep = []
+            for entry in self._heap:
+                item = entry[2]
+                matched = (token is None or item.token is token) and (
+                    below is None or item.priority >= below
+                )
+                if not matched and not item.cancelled:
+                    keep.append(entry)
+            dropped = len(self._heap) - len(keep)
+            heapq.heapify(keep)
+            self._heap = keep
+            self.cancelled += dropped
+        return dropped
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def stats(self):
+        """
+        :returns: 队列状态与最近语音各阶段的平均耗时（毫秒）
+        """
+        with self._cond:
+            history = list(self.history)
+            pending = len(self._heap)
+
+        def avg(begin, end):
+            values = [t[end] - t[begin] for t in history if begin in t and end in t]
+            return round(sum(values) / len(values) * 1000, 1) if values else None
+
+        return {
+            "pending": pending,
+            "paused": self._paused,
+            "enqueued": self.enqueued,
+            "cancelled": self.cancelled,
+            "preempted": self.preempted,
+            "completed": len(history),
+            "queue_wait_ms": avg("enqueued", "start"),
+            "first_audio_ms": avg("start", "first_audio"),
+            "total_ms": avg("enqueued", "done"),
+        }
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import time
+from concurrent.futures import CancelledError
+
+from robot import config, logging
+from robot.Runtime import get_runtime
+
+logger = logging.getLogger(__name__)
+
+
+class SynthesisJob(object):
+    """
+    流水线中的一句话
+    """
+
+    __slots__ = ("task", "future", "holding", "cancelled")
+
+    def __init__(self, task):
+        self.task = task
+        self.future = None
+        # 是否占用着领先窗口的一个位置，只在共享事件循环线程中读写
+        self.holding = False
+        self.cancelled = False
+
+
+class SynthesisPipeline(object):
+    """
+    语音合成流水线
+
+    在共享运行时的事件循环中长期运行的合成工作池，调用方按播放顺序提交句子：
+
+    - 最多同时合成 concurrency 句
+    - 合成结果严格按提交顺序交给播放，后面的句子先合成完也要等前面的取走
+    - 已经开始合成、但还没被取走播放的句子不超过 window 句，不会领先播放太多
+    - cancel() 放弃所有还没取走的句子，正在进行的合成一并中止
+    """
+
+    def __init__(self, synthesize, concurrency=2, window=4):
+        """
+        :param synthesize: synthesize(task) 合成一句话并返回结果；可以是协程函数，
+                           普通函数在运行时的线程池中执行
+        :param concurrency: 同时进行的合成数
+        :param window: 领先播放的句子数上限（包括正在合成和已合成待播放的）
+        """
+        self.synthesize = synthesize
+        self.concurrency = concurrency
+        self.window = max(window, concurrency)
+        self._is_coroutine = asyncio.iscoroutinefunction(synthesize)
+        self._jobs = []
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self._waited = 0.0
+
+        self._runtime = get_runtime()
+        # 在共享事件循环中第一次合成时创建
+        self._slots = None
+        self._window = None
+
+    def submit(self, task):
+        """
+        提交一句话，立即返回
+
+        :returns: SynthesisJob，按提交顺序交给 take() 取回结果
+        """
+        job = SynthesisJob(task)
+        with self._lock:
+            # 在锁内提交，保证事件循环中按提交顺序排队
+            job.future = self._runtime.submit(self._run(job), group="synthesis")
+            self._jobs.append(job)
+            self.submitted += 1
+        return job
+
+    def take(self, job, timeout=None):
+        """
+        阻塞等待一句话合成完毕并取走，让出领先窗口给后面的句子
+
+        :returns: 合成结果；合成失败、超时或被取消时返回 None
+        """
+        start = time.monotonic()
+        try:
+            result = job.future.result(timeout)
+            self.completed += 1
+            return result
+        except CancelledError:
+            return None
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"语音合成失败：{job.task}，{e!r}")
+            return None
+        finally:
+            self._waited += time.monotonic() - start
+            self._discard(job)
+
+    def map(self, tasks):
+        """
+        提交一批句子，按顺序逐句产生合成结果（生成器）
+
+        :returns: 依次产生 (task, 结果)；cancel() 之后提前结束
+        """
+        jobs = [self.submit(task) for task in tasks]
+        try:
+            for job in jobs:
+                result = self.take(job)
+                if job.cancelled:
+                    return
+                yield job.task, result
+        finally:
+            # 调用方提前停止迭代时放弃剩下的句子
+            for job in jobs:
+                self._discard(job, cancel=True)
+
+    def cancel(self):
+        """
+        放弃所有还没取走的句子
+
+        :returns: 放弃的句数
+        """
+        with self._lock:
+            jobs = list(self._jobs)
+        for job in jobs:
+            self._discard(job, cancel=True)
+        if jobs:
+            logger.info(f"放弃 {len(jobs)} 句还没播放的语音合成")
+        return len(jobs)
+
+    def _discard(self, job, cancel=False):
+        with self._lock:
+            if job not in self._jobs:
+                return
+            self._jobs.remove(job)
+        if cancel:
+            job.cancelled = True
+            self.cancelled += 1
+            job.future.cancel()
+        self._runtime.call_soon(self._release, job)
+
+    def _release(self, job):
+        if job.holding:
+            job.holding = False
+            self._window.release()
+
+    async def _run(self, job):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._window = asyncio.Semaphore(self.window)
+        await self._window.acquire()
+        job.holding = True
+        async with self._slots:
+            if self._is_coroutine:
+                return await self.synthesize(job.task)
+            return await asyncio.get_running_loop().run_in_executor(None, self.synthesize, job.task)
+
+    def stats(self):
+        taken = self.completed + self.failed
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "pending": len(self._jobs),
+            # 播放方平均等待合成结果的时间，越小说明流水线越能跟上播放
+            "wait_ms": round(self._waited / taken * 1000, 1) if taken else None,
+        }
+
+
+def get_pipeline(synthesize):
+    """
+    根据配置创建合成流水线
+    """
+    return SynthesisPipeline(
+        synthesize,
+        concurrency=config.get("/tts_pipeline/concurrency", 2),
+        window=config.get("/tts_pipeline/window", 4),
+    )
@@ -6,13 +6,13 @@ import pypinyin
 import subprocess
 import uuid
 
-import asyncio
 import edge_tts
 import nest_asyncio
 
 from aip import AipSpeech
 from . import utils, config, constants
 from robot import logging
+from robot.Runtime import get_runtime
 from pathlib import Path
 from pypinyin import lazy_pinyin
 from pydub import AudioSegment
@@ -25,6 +25,9 @@ from xml.etree import ElementTree
 logger = logging.getLogger(__name__)
 nest_asyncio.apply()
 
+# 流式合成被 stop_websocket_stream() 中止时抛出，收到的音频不完整，不能写入缓存
+SpeechStopped = VolcSpeech.TTSStopped
+
 class AbstractTTS(object):
     """
     Generic parent class for all TTS engines
@@ -62,6 +65,34 @@ class AbstractTTS(object):
     def stop_websocket_stream(cls):
         pass
 
+    def get_voice_type(self, character_category):
+        """
+        获取角色对应的发音人，用于区分不同发音人的缓存
+
+        :returns: 发音人，不区分发音人的引擎返回 None
+        """
+        return None
+
+    @classmethod
+    def is_streaming(cls):
+        """
+        是否实现了流式合成（get_speech_ws_stream）
+        """
+        return cls.get_speech_ws_stream is not AbstractTTS.get_speech_ws_stream
+
+    def pipeline(self, phrase, silent, speed_ratio, emotion, character_category):
+        """
+        提前发出下一句的流式合成请求，之后以相同参数调用 get_speech_ws_stream 时直接使用，
+        不支持的引擎忽略
+        """
+        pass
+
+    def get_stats(self):
+        """
+        合成连接的统计信息，没有统计的引擎返回 None
+        """
+        return None
+
 
 class HanTTS(AbstractTTS):
     """
@@ -323,7 +354,11 @@ class VolcTTS(AbstractTTS):
         **args,
     ):
         super(self.__class__, self).__init__()
-        self.engine = VolcSpeech.volcSpeech(appid, token, cluster, asr_cluster, voice_type, host, api_url_ws, api_url_http)
+        self.engine = VolcSpeech.volcSpeech(
+            appid, token, cluster, asr_cluster, voice_type, host, api_url_ws, api_url_http,
+            pool_size=config.get("/tts_ws_pool/size", 2),
+            idle_timeout=config.get("/tts_ws_pool/idle_timeout", 50),
+        )
         self.appid, self.token, self.cluster, self.voice_type, self.host, self.api_url_ws, self.api_url_http = appid, token, cluster, voice_type, host, api_url_ws, api_url_http
 
     @classmethod
@@ -338,6 +373,18 @@ class VolcTTS(AbstractTTS):
     def get_speech_ws_stream(self, phrase, silent, speed_ratio, emotion, character_category, operation="submit"):
         return self.engine.tts_ws_stream(phrase, silent, speed_ratio, emotion, character_category, operation)
 
+    def get_voice_type(self, character_category):
+        return self.engine._get_voice_type(character_category)
+
+    def pipeline(self, phrase, silent, speed_ratio, emotion, character_category):
+        self.engine.pipeline(phrase, silent, speed_ratio, emotion, character_category)
+
+    def get_stats(self):
+        return self.engine.stats()
+
+    def stop_websocket_stream(self):
+        self.engine.stop_websocket_stream()
+
     def get_speech_http(self, phrase, silent, speed_ratio, emotion, character_category):
         audio = self.engine.TTS(phrase, silent, speed_ratio, emotion, character_category)
 
@@ -430,10 +477,7 @@ class EdgeTTS(AbstractTTS):
             return None
 
     def get_speech(self, phrase):
-        event_loop = asyncio.new_event_loop()
-        tmpfile = event_loop.run_until_complete(self.async_get_speech(phrase))
-        event_loop.close()
-        return tmpfile
+        return get_runtime().run(self.async_get_speech(phrase))
         
             
 
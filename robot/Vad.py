@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+import collections
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+
+import numpy as np
+
+from robot import config, logging
+
+logger = logging.getLogger(__name__)
+
+# 判定结果
+LISTENING = "listening"  # 还在录音
+END = "end"  # 说完了
+TIMEOUT = "timeout"  # 一直没有开口
+
+
+class AbstractVAD(object):
+    """
+    录音结束判定（端点检测）
+
+    录音线程每读到一帧就调用 process()，返回 True 时停止录音。
+    音频按 frame_ms 切成子帧，一次性用 numpy 计算整帧的能量，子类只负责判断每个
+    子帧是不是语音；噪声基底跟踪和拖尾时间的自适应由这里统一处理：
+
+    - 噪声基底：能量低于基底时快速跟随下降，非语音子帧上缓慢上升；环境噪声突然变大
+      （开了电视、风扇）时，最近 FLOOR_WINDOW_S 秒内每秒最低能量的最小值成为新的基底
+    - 拖尾时间：以 hangover_ms 为基础，按这句话中已经出现过的停顿长短（说话节奏）
+      放长，信噪比低时再放长，限制在 [min_hangover_ms, max_hangover_ms] 之间
+    """
+
+    __metaclass__ = ABCMeta
+
+    SLUG = None
+
+    # 短于这个时长的静音不算作一次停顿（毫秒）
+    MIN_PAUSE_MS = 100
+    # 噪声基底在非语音子帧上每秒最多上升的分贝数
+    FLOOR_RISE_DB = 3.0
+    # 持续这么多秒的噪声成为新的噪声基底
+    FLOOR_WINDOW_S = 4
+    # 低于这个信噪比时开始延长拖尾（分贝）
+    LOW_SNR_DB = 15.0
+    # 拖尾时间至少是这句话中较长停顿（75 分位）的多少倍
+    PAUSE_FACTOR = 1.5
+
+    def __init__(
+        self,
+        sample_rate=16000,
+        frame_ms=20,
+        margin_db=10,
+        hangover_ms=700,
+        min_hangover_ms=400,
+        max_hangover_ms=1800,
+        start_timeout_ms=5000,
+        min_speech_ms=120,
+        **args,
+    ):
+        """
+        :param sample_rate: 采样率
+        :param frame_ms: 子帧时长（毫秒）
+        :param margin_db: 高出噪声基底多少分贝才可能是语音
+        :param hangover_ms: 基础拖尾时间，停顿超过拖尾时间认为一句话说完了
+        :param min_hangover_ms: 拖尾时间下限
+        :param max_hangover_ms: 拖尾时间上限
+        :param start_timeout_ms: 一直没有开口时最多等待多久
+        :param min_speech_ms: 累计多长的语音才算开口，过滤咳嗽、碰撞声
+        """
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.sub = sample_rate * frame_ms // 1000
+        self.margin_db = margin_db
+        self.hangover_ms = hangover_ms
+        self.min_hangover_ms = min_hangover_ms
+        self.max_hangover_ms = max_hangover_ms
+        self.start_timeout_ms = start_timeout_ms
+        self.min_speech_ms = min_speech_ms
+        self.noise_floor_db = None
+        # 最近几秒每秒的最低能量，和噪声基底一样跨录音保留
+        self._floor_window = collections.deque(maxlen=self.FLOOR_WINDOW_S)
+        self._second_min = None
+        self._second_ms = 0
+        self.reset()
+
+    def reset(self):
+        """
+        开始新的一句话；噪声基底保留，沿用上一次录音的环境噪声
+        """
+        self.result = LISTENING
+        self._rest = np.zeros(0, dtype=np.int16)
+        self.elapsed_ms = 0
+        self.speech_ms = 0
+        self.silence_ms = 0
+        self.first_speech_ms = None
+        self.last_speech_ms = None
+        self.speech_level_db = None
+        self.pauses = []
+        self.hangover = self.hangover_ms
+        self._process_time = 0.0
+        self._frames = 0
+
+    @property
+    def started(self):
+        return self.speech_ms >= self.min_speech_ms
+
+    @abstractmethod
+    def classify(self, subframes, energy_db):
+        """
+        判断每个子帧是不是语音
+
+        :param subframes: (子帧数, 每子帧采样数) 的 int16 数组
+        :param energy_db: 每个子帧的能量（分贝）
+        :returns: 布尔数组
+        """
+        pass
+
+    def process(self, data):
+        """
+        送入一帧录音
+
+        :param data: 16 位单声道 PCM
+        :returns: 是否应该停止录音，原因见 self.result
+        """
+        if self.result != LISTENING:
+            return True
+        begin = time.perf_counter()
+        speech, energy_db = self.speech_frames(data)
+        if len(speech):
+            self._endpoint(speech, energy_db)
+        self._process_time += time.perf_counter() - begin
+        self._frames += 1
+        if self.result != LISTENING:
+            get_metrics().record(self)
+            return True
+        return False
+
+    def speech_frames(self, data):
+        """
+        只做逐子帧的语音判断（同时跟踪噪声基底），不做端点检测，打断检测也用它
+
+        :param data: 16 位单声道 PCM，不足一个子帧的部分留到下一次
+        :returns: (每个子帧是否语音, 每个子帧的能量（分贝）)
+        """
+        samples = np.frombuffer(data, dtype=np.int16)
+        if len(self._rest):
+            samples = np.concatenate((self._rest, samples))
+        n = len(samples) // self.sub
+        self._rest = samples[n * self.sub :].copy()
+        subframes = samples[: n * self.sub].reshape(n, self.sub)
+        x = subframes.astype(np.float32)
+        energy_db = 10 * np.log10(np.einsum("ij,ij->i", x, x) / self.sub + 1.0)
+        if n:
+            self._track_floor(energy_db)
+        return self.classify(subframes, energy_db), energy_db
+
+    def _track_floor(self, energy_db):
+        if self.noise_floor_db is None:
+            self.noise_floor_db = float(energy_db.min())
+        rise = self.FLOOR_RISE_DB * self.frame_ms / 1000
+        floor = self.noise_floor_db
+        for e in energy_db:
+            if e < floor:
+                floor = 0.5 * floor + 0.5 * e
+            elif e < floor + self.margin_db:
+                floor = min(e, floor + rise)
+            self._second_min = e if self._second_min is None else min(self._second_min, e)
+            self._second_ms += self.frame_ms
+            if self._second_ms >= 1000:
+                self._floor_window.append(self._second_min)
+                self._second_min = None
+                self._second_ms = 0
+                # 整个窗口内每秒都有高于基底的能量，说明不是语音而是持续的噪声
+                if len(self._floor_window) == self._floor_window.maxlen:
+                    floor = max(floor, float(min(self._floor_window)))
+        self.noise_floor_db = float(floor)
+
+    def _endpoint(self, speech, energy_db):
+        for is_speech, e in zip(speech, energy_db):
+            self.elapsed_ms += self.frame_ms
+            if is_speech:
+                if self.started and self.silence_ms >= self.MIN_PAUSE_MS:
+                    self.pauses.append(self.silence_ms)
+                    self.hangover = self._adapt_hangover()
+                if self.first_speech_ms is None:
+                    self.first_speech_ms = self.elapsed_ms - self.frame_ms
+                self.last_speech_ms = self.elapsed_ms
+                self.silence_ms = 0
+                self.speech_ms += self.frame_ms
+                level = self.speech_level_db
+                self.speech_level_db = e if level is None else 0.9 * level + 0.1 * e
+                continue
+            self.silence_ms += self.frame_ms
+            if self.started:
+                if self.silence_ms >= self.hangover:
+                    self.result = END
+                    return
+            elif self.elapsed_ms >= self.start_timeout_ms:
+                self.result = TIMEOUT
+                return
+
+    def _adapt_hangover(self):
+        """
+        按停顿长短和信噪比计算拖尾时间
+        """
+        hangover = self.hangover_ms
+        if self.pauses:
+            # 说话慢、停顿长的孩子，拖尾要长过他平常的停顿
+            hangover = max(hangover, self.PAUSE_FACTOR * float(np.percentile(self.pauses, 75)))
+        if self.snr_db is not None and self.snr_db < self.LOW_SNR_DB:
+            hangover *= 1 + min(0.5, (self.LOW_SNR_DB - self.snr_db) / 30)
+        return int(min(self.max_hangover_ms, max(self.min_hangover_ms, hangover)))
+
+    @property
+    def snr_db(self):
+        if self.speech_level_db is None or self.noise_floor_db is None:
+            return None
+        return self.speech_level_db - self.noise_floor_db
+
+    @property
+    def endpoint_ms(self):
+        """
+        最后一个语音子帧到判定说完之间的录音时长
+        """
+        if self.result != END:
+            return None
+        return self.elapsed_ms - self.last_speech_ms
+
+    @property
+    def process_us(self):
+        return self._process_time / self._frames * 1e6 if self._frames else 0.0
+
+
+class EnergyVAD(AbstractVAD):
+    """
+    能量 + 过零率
+
+    能量高出噪声基底 margin_db 且过零率不像白噪声的子帧是语音；
+    能量高出基底很多时不看过零率（擦音的过零率也很高）
+    """
+
+    SLUG = "energy"
+
+    def __init__(self, zcr_max=0.35, loud_db=10, **args):
+        """
+        :param zcr_max: 过零率（每个采样间隔的过零比例）上限
+        :param loud_db: 在 margin_db 之上再高出这么多分贝时不看过零率
+        """
+        self.zcr_max = zcr_max
+        self.loud_db = loud_db
+        super(EnergyVAD, self).__init__(**args)
+
+    def classify(self, subframes, energy_db):
+        signs = np.signbit(subframes)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (self.sub - 1)
+        threshold = self.noise_floor_db + self.margin_db
+        return (energy_db > threshold) & (
+            (zcr < self.zcr_max) | (energy_db > threshold + self.loud_db)
+        )
+
+
+class WebrtcVAD(AbstractVAD):
+    """
+    WebRTC VAD（需要 pip install webrtcvad），子帧只能是 10、20 或 30 毫秒
+    """
+
+    SLUG = "webrtc"
+
+    def __init__(self, webrtc_mode=2, **args):
+        """
+        :param webrtc_mode: 0~3，越大越不容易把噪声当成语音
+        """
+        import webrtcvad
+
+        self.vad = webrtcvad.Vad(webrtc_mode)
+        super(WebrtcVAD, self).__init__(**args)
+
+    def classify(self, subframes, energy_db):
+        threshold = self.noise_floor_db + self.margin_db / 2
+        return np.array(
+            [
+                e > threshold and self.vad.is_speech(frame.tobytes(), self.sample_rate)
+                for frame, e in zip(subframes, energy_db)
+            ],
+            dtype=bool,
+        )
+
+
+class EndpointMetrics(object):
+    """
+    最近若干句话的端点检测统计
+    """
+
+    HISTORY = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.history = collections.deque(maxlen=self.HISTORY)
+        self.timeouts = 0
+
+    def record(self, vad):
+        with self._lock:
+            if vad.result == TIMEOUT:
+                self.timeouts += 1
+                return
+            self.history.append(
+                {
+                    "endpoint_ms": vad.endpoint_ms,
+                    "hangover_ms": vad.hangover,
+                    "speech_ms": vad.speech_ms,
+                    "pauses": len(vad.pauses),
+                    "snr_db": vad.snr_db,
+                    "process_us": vad.process_us,
+                }
+            )
+        logger.info(
+            f"说完了：拖尾 {vad.hangover} ms，停顿 {len(vad.pauses)} 次，"
+            f"噪声基底 {vad.noise_floor_db:.1f} dB"
+        )
+
+    def stats(self):
+        with self._lock:
+            history = list(self.history)
+            timeouts = self.timeouts
+
+        def avg(key):
+            values = [h[key] for h in history if h[key] is not None]
+            return round(sum(values) / len(values), 1) if values else None
+
+        return {
+            "utterances": len(history),
+            "timeouts": timeouts,
+            "endpoint_ms": avg("endpoint_ms"),
+            "hangover_ms": avg("hangover_ms"),
+            "speech_ms": avg("speech_ms"),
+            "snr_db": avg("snr_db"),
+            "process_us": avg("process_us"),
+        }
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = EndpointMetrics()
+    return _metrics
+
+
+def get_stats():
+    """
+    端点检测统计，还没有用过本地 VAD 时返回 None
+    """
+    return _metrics.stats() if _metrics is not None else None
+
+
+def get_engines():
+    return [engine for engine in AbstractVAD.__subclasses__() if engine.SLUG]
+
+
+def create(slug, sample_rate=16000, **profile):
+    """
+    创建指定的 VAD，不读配置
+
+    :param slug: energy 或 webrtc
+    :param profile: VAD 参数，未给出的使用默认值
+    """
+    for engine in get_engines():
+        if engine.SLUG == slug:
+            return engine(sample_rate=sample_rate, **profile)
+    raise ValueError(f"找不到名为 {slug} 的 VAD")
+
+
+def get_vad(slug=None, sample_rate=16000):
+    """
+    按配置创建 VAD
+
+    :param slug: energy 或 webrtc，默认使用配置 /vad/engine
+    :returns: VAD 实例；配置为 snowboy（沿用 snowboy 的静音判定）或创建失败时返回 None
+    """
+    slug = slug or config.get("/vad/engine", "snowboy")
+    if slug == "snowboy":
+        return None
+    profile = dict(config.get("vad", {}) or {})
+    profile.pop("engine", None)
+    try:
+        return create(slug, sample_rate, **profile)
+    except Exception as e:
+        logger.warning(f"VAD {slug} 初始化失败，沿用 snowboy 的静音判定：{e}")
+        return None
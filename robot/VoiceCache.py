@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+from robot import config, constants, logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS t_voice_cache (
+    key TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    voice_type TEXT,
+    speed_ratio REAL,
+    emotion TEXT,
+    encoding TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    pinned INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+# PCM 缓存文件头：魔数、采样率、声道数、采样宽度（字节），补齐到 16 字节，
+# 之后紧跟 little-endian 的原始采样数据
+PCM_MAGIC = b"WKPC"
+PCM_HEADER = struct.Struct("<4sIHH4x")
+
+
+class PcmAudio(object):
+    """
+    以内存映射方式打开的 PCM 缓存文件
+
+    data 是采样数据的 memoryview，不会把文件读入内存；用完后需要调用 close()，
+    也可以配合 with 语句使用
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.sample_rate, self.channels, self.sample_width = PCM_HEADER.unpack_from(self._mmap)
+        if magic != PCM_MAGIC:
+            self._mmap.close()
+            raise ValueError(f"不是 PCM 缓存文件：{path}")
+        self.data = memoryview(self._mmap)[PCM_HEADER.size :]
+
+    @property
+    def duration(self):
+        return len(self.data) / (self.sample_rate * self.channels * self.sample_width)
+
+    def close(self):
+        if self._mmap is not None:
+            self.data.release()
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _Entry(object):
+    __slots__ = ("path", "size", "hits", "last_access", "pinned")
+
+    def __init__(self, path, size, hits, last_access, pinned):
+        self.path = path
+        self.size = size
+        self.hits = hits
+        self.last_access = last_access
+        self.pinned = pinned
+
+
+class VoiceCache(object):
+    """
+    TTS 语音缓存
+
+    - 缓存键由 (文字, 发音人, 语速, 情感, 编码) 计算得到，同一句话的不同发音互不冲突
+    - 索引保存在 sqlite 中，启动时整体载入内存，查询不访问磁盘
+    - 总大小超过预算时淘汰：只命中过一次的条目先于多次命中的条目淘汰，
+      同一类中按最近访问时间淘汰；固定用语等钉住的条目永不淘汰
+    """
+
+    # 淘汰时降到预算的这个比例，避免每写一条就淘汰一次
+    LOW_WATERMARK = 0.9
+    # 命中统计攒够这么多条再提交一次
+    FLUSH_EVERY = 32
+
+    def __init__(self, root=None, budget_bytes=512 * 1024 * 1024):
+        """
+        :param root: 缓存目录，默认为 temp/voice_cache
+        :param budget_bytes: 缓存文件总大小上限（字节）
+        """
+        self.root = root or os.path.join(constants.TEMP_PATH, "voice_cache")
+        self.budget_bytes = budget_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(self.root, "index.db"), check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+
+        self._entries = {}
+        self._pinned = set()
+        self._bytes = 0
+        self._dirty = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_served = 0
+        self.bytes_written = 0
+        self._load()
+
+    @staticmethod
+    def make_key(text, voice_type=None, speed_ratio=None, emotion=None, encoding="pcm"):
+        """
+        计算缓存键
+
+        :returns: 40 位十六进制字符串
+        """
+        if speed_ratio is not None:
+            speed_ratio = round(float(speed_ratio), 3)
+        raw = json.dumps(
+            [text, voice_type, speed_ratio, emotion, encoding], ensure_ascii=False
+        )
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key, encoding):
+        return os.path.join(self.root, key[:2], f"{key}.{encoding}")
+
+    def _load(self):
+        missing = []
+        rows = self._conn.execute(
+            "SELECT key, encoding, size, hits, last_access, pinned FROM t_voice_cache"
+        ).fetchall()
+        for key, encoding, size, hits, last_access, pinned in rows:
+            path = self._path(key, encoding)
+            if not os.path.exists(path):
+                missing.append((key,))
+                continue
+            self._entries[key] = _Entry(path, size, hits, last_access, bool(pinned))
+            self._bytes += size
+            if pinned:
+                self._pinned.add(key)
+        if missing:
+            # 文件被外部删除的条目从索引中移除
+            self._conn.executemany("DELETE FROM t_voice_cache WHERE key = ?", missing)
+            self._conn.commit()
+        logger.info(
+            f"语音缓存已加载：{len(self._entries)} 条，{self._bytes / 1024 / 1024:.1f} MB"
+        )
+
+    def get(self, text, voice_type=None, speed_ratio=None, emotion=None, encoding="pcm"):
+        """
+        查询缓存
+
+        :returns: 缓存文件路径，未命中返回 None
+        """
+        key = self.make_key(text, voice_type, speed_ratio, emotion, encoding)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.bytes_served += entry.size
+            entry.hits += 1
+            entry.last_access = time.time()
+            self._conn.execute(
+                "UPDATE t_voice_cache SET hits = ?, last_access = ? WHERE key = ?",
+                (entry.hits, entry.last_access, key),
+            )
+            self._dirty += 1
+            if self._dirty >= self.FLUSH_EVERY:
+                self._conn.commit()
+                self._dirty = 0
+            return entry.path
+
+    def peek(self, text, voice_type=None, speed_ratio=None, emotion=None, encoding="pcm"):
+        """
+        查询缓存，但不计入命中统计，也不更新访问时间，供预合成等后台任务使用
+
+        :returns: 缓存文件路径，未命中返回 None
+        """
+        key = self.make_key(text, voice_type, speed_ratio, emotion, encoding)
+        entry = self._entries.get(key)
+        return entry.path if entry else None
+
+    def put_file(self, src, text, voice_type=None, speed_ratio=None, emotion=None, encoding="pcm"):
+        """
+        把一个已经写好的文件移入缓存（同一文件系统内为原子改名）
+
+        :param src: 源文件，调用后不再存在
+        :returns: 缓存文件路径
+        """
+        key = self.make_key(text, voice_type, speed_ratio, emotion, encoding)
+        path = self._path(key, encoding)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(src, path)
+        size = os.path.getsize(path)
+        now = time.time()
+        with self._lock:
+            old = self._entries.get(key)
+            if old:
+                self._bytes -= old.size
+            pinned = key in self._pinned
+            self._entries[key] = _Entry(path, size, old.hits if old else 0, now, pinned)
+            self._bytes += size
+            self.bytes_written += size
+            self._conn.execute(
+                "INSERT OR REPLACE INTO t_voice_cache "
+                "(key, text, voice_type, speed_ratio, emotion, encoding, size, hits, created, last_access, pinned) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, text, voice_type, speed_ratio, emotion, encoding, size,
+                 self._entries[key].hits, now, now, int(pinned)),
+            )
+            self._conn.commit()
+            self._dirty = 0
+            if self._bytes > self.budget_bytes:
+                self._evict(self.budget_bytes * self.LOW_WATERMARK)
+        return path
+
+    def put_pcm(self, pcm_chunks, text, voice_type=None, speed_ratio=None, emotion=None,
+                sample_rate=24000, channels=1, sample_width=2):
+        """
+        把流式合成得到的 PCM 数据块直接写入缓存，不做任何转码
+
+        :returns: 缓存文件路径
+        """
+        key = self.make_key(text, voice_type, speed_ratio, emotion, "pcm")
+        tmp = os.path.join(self.root, f"{key}.{threading.get_ident()}.part")
+        with open(tmp, "wb") as f:
+            f.write(PCM_HEADER.pack(PCM_MAGIC, sample_rate, channels, sample_width))
+            for chunk in pcm_chunks:
+                f.write(chunk)
+        return self.put_file(tmp, text, voice_type, speed_ratio, emotion, "pcm")
+
+    def pin(self, text, voice_type=None, speed_ratio=None, emotion=None, encoding="pcm"):
+        """
+        钉住一条缓存（可以在写入之前调用），钉住的条目不会被淘汰
+        """
+        key = self.make_key(text, voice_type, speed_ratio, emotion, encoding)
+        with self._lock:
+            self._pinned.add(key)
+            entry = self._entries.get(key)
+            if entry and not entry.pinned:
+                entry.pinned = True
+                self._conn.execute("UPDATE t_voice_cache SET pinned = 1 WHERE key = ?", (key,))
+                self._conn.commit()
+
+    def _evict(self, target_bytes, max_age=None):
+        """
+        淘汰条目直到总大小不超过 target_bytes，调用方需持有 self._lock
+
+        :param max_age: 同时淘汰超过这么多秒未访问的条目
+        """
+        now = time.time()
+        candidates = [
+            (entry.hits > 1, entry.last_access, key)
+            for key, entry in self._entries.items()
+            if not entry.pinned
+        ]
+        candidates.sort()
+        removed = []
+        for _, last_access, key in candidates:
+            expired = max_age is not None and now - last_access > max_age
+            if self._bytes <= target_bytes and not expired:
+                continue
+            entry = self._entries.pop(key)
+            self._bytes -= entry.size
+            removed.append((key,))
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        if removed:
+            self.evictions += len(removed)
+            self._conn.executemany("DELETE FROM t_voice_cache WHERE key = ?", removed)
+            self._conn.commit()
+            self._dirty = 0
+            logger.info(f"语音缓存淘汰 {len(removed)} 条，当前 {self._bytes / 1024 / 1024:.1f} MB")
+        return len(removed)
+
+    def evict(self, max_age=None):
+        """
+        按预算淘汰，并淘汰超过 max_age 秒未访问的条目
+
+        :returns: 淘汰的条目数
+        """
+        with self._lock:
+            return self._evict(self.budget_bytes, max_age)
+
+    def flush(self):
+        with self._lock:
+            self._conn.commit()
+            self._dirty = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0,
+                "entries": len(self._entries),
+                "pinned": sum(1 for entry in self._entries.values() if entry.pinned),
+                "bytes": self._bytes,
+                "budget_bytes": self.budget_bytes,
+                "bytes_served": self.bytes_served,
+                "bytes_written": self.bytes_written,
+                "evictions": self.evictions,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    获取进程内共享的语音缓存
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = VoiceCache(
+                    budget_bytes=int(config.get("/tts_cache/budget_mb", 512) * 1024 * 1024)
+                )
+    return _cache
+
+
+def get_stats():
+    """
+    语音缓存的统计信息，缓存还未创建时返回 None
+    """
+    return _cache.stats() if _cache else None
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# 进程内常驻的绘本目录：启动时加载，数据库变更时自动刷新
+import os
+import threading
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from robot import logging
+from robot.agents.book_repository import get_repository
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogSnapshot(object):
+    """
+    某一时刻的绘本目录，创建后不再修改，可以在多个线程间直接共享
+    """
+
+    __slots__ = ("books", "titles", "en_titles", "prompt", "version")
+
+    def __init__(self, rows, version):
+        # [(id, cn_title), ...]
+        books = [(row[0], row[1]) for row in rows]
+        self.books = books
+        # {id: cn_title}
+        self.titles = dict(books)
+        # {id: en_title}，没有英文书名的绘本不在其中
+        self.en_titles = {row[0]: row[2] for row in rows if row[2]}
+        # 给分类器提示词用的紧凑文本：id:书名；id:书名
+        self.prompt = "；".join(f"{book_id}:{title}" for book_id, title in books)
+        self.version = version
+
+
+class _DBChangeHandler(FileSystemEventHandler):
+    def __init__(self, catalog):
+        FileSystemEventHandler.__init__(self)
+        self._catalog = catalog
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        if os.path.basename(event.src_path).startswith(self._catalog.db_name):
+            self._catalog.schedule_refresh()
+
+
+class BookCatalog(object):
+    """
+    绘本目录缓存
+
+    目录在创建时加载一次，之后只有在 picture_books.db（含 -wal 文件）
+    的修改时间或大小发生变化时才重新查询数据库。读取 books/prompt 不会触发任何 I/O。
+    """
+
+    def __init__(self, repository=None, debounce=0.5):
+        """
+        :param repository: 绘本数据仓库，默认使用进程内共享的仓库
+        :param debounce: 文件变化后延迟多久再刷新（秒），
+                         sqlite 一次提交会触发多个文件事件，合并成一次刷新
+        """
+        self.repository = repository or get_repository()
+        self.debounce = debounce
+        self.db_path = self.repository.db_path
+        self.db_name = os.path.basename(self.db_path)
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._observer = None
+        self._timer = None
+        self._signature = None
+        self._snapshot = CatalogSnapshot([], 0)
+        self.refresh(force=True)
+
+    def _db_signature(self):
+        signature = []
+        for path in (self.db_path, self.db_path + "-wal"):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def refresh(self, force=False):
+        """
+        数据库文件有变化时重新加载目录，并通知订阅者
+
+        :param force: 为 True 时无论是否变化都重新加载
+        :returns: 是否重新加载了目录
+        """
+        with self._lock:
+            signature = self._db_signature()
+            if not force and signature == self._signature:
+                return False
+            try:
+                rows = self.repository.get_all_titles()
+            except Exception as e:
+                logger.error(f"加载绘本目录失败：{e}", stack_info=True)
+                return False
+            self._signature = signature
+            snapshot = CatalogSnapshot(rows, self._snapshot.version + 1)
+            self._snapshot = snapshot
+            listeners = list(self._listeners)
+        logger.info(f"绘本目录已加载，共 {len(snapshot.books)} 本")
+        for listener in listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"绘本目录变更通知失败：{e}", stack_info=True)
+        return True
+
+    def schedule_refresh(self):
+        """
+        延迟 debounce 秒后刷新目录，期间的多次调用只会刷新一次
+        """
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self.refresh)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def subscribe(self, listener):
+        """
+        订阅目录变更，listener 会以最新的 CatalogSnapshot 为参数被调用，
+        订阅时会立即收到一次当前目录
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            snapshot = self._snapshot
+        listener(snapshot)
+
+    def start_watching(self):
+        """
+        监听数据库所在目录，文件变化时在后台刷新目录
+        """
+        if self._observer:
+            return
+        try:
+            observer = Observer()
+            observer.schedule(
+                _DBChangeHandler(self), os.path.dirname(self.db_path), recursive=False
+            )
+            observer.daemon = True
+            observer.start()
+            self._observer = observer
+        except Exception as e:
+            logger.error(f"监听绘本数据库失败：{e}", stack_info=True)
+
+    def stop_watching(self):
+        if self._observer:
+            self._observer.stop()
+            self._observer = None
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def books(self):
+        return self._snapshot.books
+
+    @property
+    def prompt(self):
+        return self._snapshot.prompt
+
+    def get_title(self, book_id):
+        return self._snapshot.titles.get(book_id)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """
+    获取进程内共享的绘本目录，首次调用时加载并开始监听数据库变化
+    """
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                catalog = BookCatalog()
+                catalog.start_watching()
+                _catalog = catalog
+    return _catalog
@@ -0,0 +1,616 @@
+# -*- coding: utf-8 -*-
+# 绘本录入：逐页并发调用多模态大模型描述图片，描述暂存在任务表中，全部完成后一次性写入绘本
+import asyncio
+import hashlib
+import os
+import re
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+import ruamel.yaml
+
+from robot import config, logging
+from robot.agents import page_fingerprint
+from robot.agents.book_repository import get_repository
+from robot.agents.page_image import get_encoder
+
+logger = logging.getLogger(__name__)
+
+COVER = "cover"
+
+# 进行中的任务状态，进程重启后继续
+ACTIVE = ("queued", "orienting", "describing", "writing")
+
+# 人物特征 -> character_category，未给出时默认为年轻女性
+CHARACTER_CATEGORIES = [
+    ("Little Girl", 0),
+    ("Little Boy", 1),
+    ("Young Woman", 2),
+    ("Young Man", 3),
+    ("Mature Woman", 4),
+    ("Mature Man", 5),
+    ("Elderly Woman", 6),
+    ("Elderly Man", 7),
+]
+DEFAULT_CATEGORY = 2
+
+# 文字的语言
+LANGUAGE_CN = 1
+LANGUAGE_EN = 2
+
+
+def page_sequence(file_name):
+    """
+    :returns: 图片对应的页码，封面返回 None
+    :raises ValueError: 文件名既不是 cover 也不是页码
+    """
+    base_name = os.path.splitext(os.path.basename(file_name))[0]
+    if base_name == COVER:
+        return None
+    return int(base_name)
+
+
+def parse_description(description):
+    """
+    从大模型的回复中取出 yaml 代码块并解析
+
+    :returns: dict，不是有效的 yaml 时返回 None
+    """
+    match = re.search(r"```yaml(.*?)```", description, re.DOTALL) or re.search(
+        r"```yaml(.*)", description, re.DOTALL
+    )
+    yaml_str = match.group(1).strip() if match else description
+    if not yaml_str:
+        return None
+    try:
+        data = ruamel.yaml.YAML().load(StringIO(yaml_str))
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _category(item):
+    character_category = item.get("character_category") or ""
+    for name, category in CHARACTER_CATEGORIES:
+        if name in character_category:
+            return category
+    return DEFAULT_CATEGORY
+
+
+def book_fingerprint(pages):
+    """
+    整本绘本的指纹：按页码排列的每页图片指纹再做一次哈希
+
+    :returns: 十六进制字符串；有图片没有指纹（例如升级前暂存的描述）时返回 None
+    """
+    if not pages or any(page.fingerprint is None for page in pages):
+        return None
+    raw = "|".join(f"{COVER if page.sequence is None else page.sequence}:{page.fingerprint}" for page in pages)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def build_book(pages, book_id=None):
+    """
+    把暂存的描述转换成要写入的行
+
+    :param pages: BookRepository.get_ingest_pages 返回的 IngestPage 列表，描述都已暂存
+    :returns: (book, contents, texts)
+    :raises ValueError: 没有封面
+    """
+    book_id = book_id or str(uuid.uuid4())
+    book = None
+    contents = []
+    texts = []
+    for page in pages:
+        data = parse_description(page.description)
+        if page.sequence is None:
+            book = {
+                "id": book_id,
+                "cn_title": data.get("cn_title"),
+                "cn_subtitle": data.get("cn_subtitle"),
+                "en_title": data.get("en_title"),
+                "en_subtitle": data.get("en_subtitle"),
+                "picture_content": data.get("picture_content"),
+            }
+            continue
+        content_id = str(uuid.uuid4())
+        contents.append(
+            {
+                "id": content_id,
+                "book_id": book_id,
+                "sequence": page.sequence,
+                "picture_content": data["picture_content"],
+            }
+        )
+        # 中文在前、英文在后，同一页内的 sequence 连续编号，朗读顺序固定
+        sequence = 0
+        for field, language in (("cn_text", LANGUAGE_CN), ("en_text", LANGUAGE_EN)):
+            for item in data.get(field) or []:
+                if not isinstance(item, dict) or not item.get("text"):
+                    continue
+                texts.append(
+                    {
+                        "id": str(uuid.uuid4()),
+                        "content_id": content_id,
+                        "sequence": sequence,
+                        "language": language,
+                        "text": item["text"],
+                        "type": item.get("type", 1),
+                        "character": item.get("character") or "",
+                        "character_category": _category(item),
+                    }
+                )
+                sequence += 1
+    if book is None:
+        raise ValueError("绘本没有封面")
+    return book, contents, texts
+
+
+class BookIngestor(object):
+    """
+    绘本录入流水线
+
+    - 每张图片先缩小、重新编码（PageImageEncoder），再单独调用大模型描述，最多同时 concurrency 张，
+      失败时按指数退避重试
+    - 每张图片的描述一拿到就暂存到 t_ingest_page，进程重启后继续任务时已描述的图片不再重新描述
+    - 描述过的图片按内容哈希和感知哈希记录在 t_page_fingerprint，再次上传相同（或重新拍摄的）图片时
+      直接使用已有的描述，不调用大模型
+    - 全部描述完成后在一个事务中写入绘本、页面和文字，页面保持上传时的页码；
+      每页都和已有的某本绘本相同时不再写入新的绘本
+    """
+
+    def __init__(
+        self, describe, repository=None, concurrency=4, retries=3, backoff=2.0, encoder=None, max_distance=10
+    ):
+        """
+        :param describe: async describe(is_cover, image) 返回大模型对图片的描述，image 为 PageImage
+        :param repository: 绘本数据仓库，默认使用进程内共享的仓库
+        :param concurrency: 同时描述的图片数
+        :param retries: 每张图片最多尝试几次
+        :param backoff: 第一次重试前等待的秒数，之后每次翻倍
+        :param encoder: 图片编码器，默认使用进程内共享的编码器
+        :param max_distance: 感知哈希相差不超过这么多位时认为是同一张图片，为 0 时只认完全相同的文件
+        """
+        self.describe = describe
+        self.repository = repository or get_repository()
+        self.encoder = encoder or get_encoder()
+        self.max_distance = max_distance
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+
+    def create_job(self, directory, file_names, language=None):
+        """
+        登记录入任务
+
+        :param directory: 上传图片所在的目录
+        :param file_names: 图片文件名，封面为 cover.*，其余以页码命名
+        :param language: 校正图片方向时使用的 tesseract 语言
+        :returns: 任务 id
+        """
+        pages = []
+        for file_name in file_names:
+            try:
+                pages.append((file_name, page_sequence(file_name)))
+            except ValueError:
+                logger.warning(f"无法识别页码，跳过图片：{file_name}")
+        job_id = str(uuid.uuid4())
+        # 保存绝对路径，重启后工作目录不同也能找到图片
+        self.repository.create_ingest_job(job_id, os.path.abspath(directory), pages, language)
+        logger.info(f"登记绘本录入任务 {job_id}，共 {len(pages)} 张图片")
+        return job_id
+
+    def fail(self, job_id, error):
+        """
+        任务失败；已经取消或完成的任务不受影响
+        """
+        self.repository.update_ingest_job(job_id, "failed", error=error, only_from=ACTIVE)
+        logger.error(f"绘本录入任务 {job_id} 失败：{error}")
+
+    async def run(self, job_id):
+        """
+        执行（或继续）录入任务：描述所有图片，然后写入绘本
+
+        :returns: 写入的绘本 id，失败时返回 None
+        """
+        if not await self.describe_pages(job_id):
+            return None
+        return self.commit(job_id)
+
+    async def describe_pages(self, job_id):
+        """
+        描述任务中还没有描述的图片
+
+        :returns: 是否所有图片都已描述
+        """
+        job = self.repository.get_ingest_job(job_id)
+        if job is None or not self.repository.update_ingest_job(
+            job_id, "describing", only_from=ACTIVE
+        ):
+            return False
+        pages = self.repository.get_ingest_pages(job_id)
+        todo = [page for page in pages if page.description is None]
+        logger.info(f"绘本录入任务 {job_id}：{len(pages)} 张图片，{len(pages) - len(todo)} 张已描述")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(
+            *(self._describe(job, page, semaphore) for page in todo)
+        )
+        failed = [page.file_name for page, ok in zip(todo, results) if not ok]
+        if failed:
+            self.fail(job_id, f"{len(failed)} 张图片描述失败：{', '.join(failed)}")
+            return False
+        return True
+
+    def commit(self, job_id):
+        """
+        把暂存的描述一次性写入绘本
+
+        :returns: 写入的绘本 id，失败或任务已取消时返回 None
+        """
+        if not self.repository.update_ingest_job(job_id, "writing", only_from=ACTIVE):
+            return None
+        try:
+            pages = self.repository.get_ingest_pages(job_id)
+            book, contents, texts = build_book(pages)
+            book_id = self.repository.commit_ingested_book(
+                job_id, book, contents, texts, book_fingerprint(pages)
+            )
+            if book_id is None:
+                logger.info(f"绘本录入任务 {job_id} 已取消，不写入")
+                return None
+        except Exception as e:
+            self.fail(job_id, f"写入失败：{e}")
+            return None
+        if book_id != book["id"]:
+            logger.info(f"绘本《{book['cn_title']}》已经录入过（{book_id}），不再重复写入")
+        else:
+            logger.info(f"绘本《{book['cn_title']}》录入完成：{len(contents)} 页，{len(texts)} 段文字")
+        return book_id
+
+    async def _describe(self, job, page, semaphore):
+        """
+        描述一张图片并暂存
+
+        :returns: 是否成功
+        """
+        is_cover = page.sequence is None
+        image_path = os.path.join(job.directory, page.file_name)
+        content_hash = phash = None
+        try:
+            content_hash, phash = await asyncio.get_running_loop().run_in_executor(
+                None, page_fingerprint.fingerprint, image_path
+            )
+            known = self.repository.find_page_fingerprint(content_hash, phash, is_cover, self.max_distance)
+        except Exception as e:
+            logger.warning(f"计算图片 {page.file_name} 的指纹失败：{e}")
+            known = None
+        if known is not None:
+            self.repository.stage_ingest_page(
+                job.id, page.file_name, known.description, fingerprint=known.content_hash
+            )
+            logger.info(f"图片 {page.file_name} 已经描述过，直接使用已有的描述")
+            return True
+
+        for attempt in range(self.retries):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            image = None
+            try:
+                async with semaphore:
+                    # 编码结果有缓存，重试时不会重新编码
+                    image = await asyncio.get_running_loop().run_in_executor(
+                        None, self.encoder.encode, image_path
+                    )
+                    description = await self.describe(is_cover, image)
+                data = parse_description(description)
+                if data is None:
+                    raise ValueError("未找到有效的 YAML")
+                if not data.get("cn_title" if is_cover else "picture_content"):
+                    raise ValueError("描述中缺少必要的字段")
+            except Exception as e:
+                logger.warning(f"描述图片 {page.file_name} 失败（第 {attempt + 1} 次）：{e}")
+                self.repository.fail_ingest_page(
+                    job.id, page.file_name, str(e), image.size if image else 0
+                )
+                continue
+            if content_hash:
+                self.repository.save_page_fingerprint(content_hash, phash, is_cover, description)
+            self.repository.stage_ingest_page(
+                job.id, page.file_name, description, image.size, fingerprint=content_hash
+            )
+            logger.info(
+                f"图片 {page.file_name} 描述完成，发送 {image.size / 1024:.0f} KB"
+                f"（{image.width}x{image.height}，原图 {image.original_size / 1024:.0f} KB）"
+            )
+            return True
+        return False
+
+
+class QueueFull(Exception):
+    """
+    等待处理的录入任务太多
+    """
+
+    pass
+
+
+class IngestQueue(object):
+    """
+    绘本录入任务队列
+
+    任务和每张图片的进度都保存在数据库中，进程重启后 resume() 继续没有完成的任务。
+    每个任务依次经过三个阶段，每个阶段单独限制并发，多本绘本同时上传时设备依然流畅：
+
+    - orienting：校正图片方向，所有任务共用 orient_workers 个线程
+    - describing：调用大模型描述图片，最多 describe_jobs 个任务同时描述
+      （每个任务内部再按 book_ingest.concurrency 并发）
+    - writing：写入绘本，同一时间只有一个任务写入
+
+    任务完成或取消后删除上传目录；失败时保留，可以 retry()。
+    """
+
+    def __init__(
+        self,
+        ingestor,
+        orient,
+        describe,
+        max_jobs=2,
+        orient_workers=2,
+        describe_jobs=1,
+        max_pending=10,
+    ):
+        """
+        :param ingestor: BookIngestor
+        :param orient: orient(image_path, language) 校正一张图片的方向（阻塞）
+        :param describe: describe(job_id) 返回描述一个任务所有图片的协程，
+                         在任务自己的事件循环中运行
+        :param max_jobs: 同时处理的任务数
+        :param orient_workers: 校正图片方向的线程数
+        :param describe_jobs: 同时描述图片的任务数
+        :param max_pending: 排队和处理中的任务数上限，超过时拒绝新任务
+        """
+        self.ingestor = ingestor
+        self.repository = ingestor.repository
+        self.orient = orient
+        self.describe = describe
+        self.max_pending = max_pending
+        self._jobs = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="ingest")
+        self._orient_pool = ThreadPoolExecutor(max_workers=orient_workers, thread_name_prefix="ingest-orient")
+        self._describing = threading.BoundedSemaphore(describe_jobs)
+        self._writing = threading.Lock()
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._cancelled = set()
+        # 任务 id -> (事件循环, 正在描述图片的协程任务)
+        self._tasks = {}
+
+    def submit(self, directory, file_names, language=None):
+        """
+        登记并排队一个录入任务
+
+        :returns: 任务 id
+        :raises QueueFull: 排队和处理中的任务太多
+        """
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                raise QueueFull(f"已有 {len(self._pending)} 个绘本正在录入，请稍后再上传")
+            job_id = self.ingestor.create_job(directory, file_names, language)
+            self._pending.add(job_id)
+        self._jobs.submit(self._process, job_id)
+        return job_id
+
+    def resume(self):
+        """
+        继续上次进程退出时没有完成的任务
+
+        :returns: 继续的任务数
+        """
+        count = 0
+        for job in self.repository.get_ingest_jobs(ACTIVE):
+            if not os.path.isdir(job.directory):
+                self.ingestor.fail(job.id, "上传的图片已不存在")
+                continue
+            with self._lock:
+                if job.id in self._pending:
+                    continue
+                self._pending.add(job.id)
+            logger.info(f"继续录入任务 {job.id}（{job.status}）")
+            self._jobs.submit(self._process, job.id)
+            count += 1
+        return count
+
+    def retry(self, job_id):
+        """
+        重新处理失败的任务，已完成的阶段和已描述的图片不会重做
+
+        :returns: 是否重新排队
+        """
+        job = self.repository.get_ingest_job(job_id)
+        if job is None or job.status != "failed" or not os.path.isdir(job.directory):
+            return False
+        with self._lock:
+            if job_id in self._pending:
+                return False
+            self._pending.add(job_id)
+        self.repository.update_ingest_job(job_id, "queued", only_from=("failed",))
+        self._jobs.submit(self._process, job_id)
+        return True
+
+    def cancel(self, job_id):
+        """
+        取消任务，正在描述的图片请求会被中止
+
+        :returns: 是否取消；任务不存在或已经结束时返回 False
+        """
+        if not self.repository.update_ingest_job(job_id, "cancelled", only_from=ACTIVE + ("failed",)):
+            return False
+        with self._lock:
+            self._cancelled.add(job_id)
+            running = self._tasks.get(job_id)
+            pending = job_id in self._pending
+        if running:
+            loop, task = running
+            loop.call_soon_threadsafe(task.cancel)
+        if not pending:
+            # 没有在处理（例如失败后等待重试），直接清理
+            self._cleanup(job_id)
+        logger.info(f"取消录入任务 {job_id}")
+        return True
+
+    def status(self, job_id, detail=False):
+        """
+        任务的状态和进度
+
+        :param detail: 是否列出每张图片的进度和发给大模型的字节数
+        :returns: dict，任务不存在时返回 None
+        """
+        job = self.repository.get_ingest_job(job_id)
+        if job is None:
+            return None
+        total, oriented, described, image_bytes = self.repository.get_ingest_progress(job_id)
+        status = {
+            "id": job.id,
+            "status": job.status,
+            "book_id": job.book_id,
+            "error": job.error,
+            "pages": total,
+            "oriented": oriented,
+            "described": described,
+            "image_bytes": image_bytes,
+            "created_at": job.created_at,
+            "updated_at": job.updated_at,
+        }
+        if detail:
+            status["page_details"] = [
+                {
+                    "file_name": page.file_name,
+                    "oriented": bool(page.oriented),
+                    "described": page.description is not None,
+                    "attempts": page.attempts,
+                    "error": page.error,
+                    "image_bytes": page.image_bytes,
+                }
+                for page in self.repository.get_ingest_pages(job_id)
+            ]
+        return status
+
+    def recent(self, limit=20):
+        """
+        最近的任务，新的在前
+        """
+        return [self.status(job.id) for job in self.repository.get_recent_ingest_jobs(limit)]
+
+    def _is_cancelled(self, job_id):
+        with self._lock:
+            return job_id in self._cancelled
+
+    def _process(self, job_id):
+        try:
+            job = self.repository.get_ingest_job(job_id)
+            if job is None or job.status not in ACTIVE:
+                return
+            if self._orient_pages(job) and not self._is_cancelled(job_id):
+                if self._describe_pages(job_id) and not self._is_cancelled(job_id):
+                    with self._writing:
+                        self.ingestor.commit(job_id)
+        except Exception as e:
+            self.ingestor.fail(job_id, str(e))
+        finally:
+            with self._lock:
+                self._pending.discard(job_id)
+                self._cancelled.discard(job_id)
+            job = self.repository.get_ingest_job(job_id)
+            if job and job.status in ("committed", "cancelled"):
+                self._cleanup(job_id)
+
+    def _orient_pages(self, job):
+        """
+        :returns: 是否所有图片都已校正方向
+        """
+        if not self.repository.update_ingest_job(job.id, "orienting", only_from=ACTIVE):
+            return False
+        pages = [page for page in self.repository.get_ingest_pages(job.id) if not page.oriented]
+        futures = [self._orient_pool.submit(self._orient_page, job, page) for page in pages]
+        try:
+            for future in futures:
+                future.result()
+        except Exception as e:
+            for future in futures:
+                future.cancel()
+            self.ingestor.fail(job.id, f"校正图片方向失败：{e}")
+            return False
+        return True
+
+    def _orient_page(self, job, page):
+        if self._is_cancelled(job.id):
+            return
+        self.orient(os.path.join(job.directory, page.file_name), job.language)
+        self.repository.orient_ingest_page(job.id, page.file_name)
+
+    def _describe_pages(self, job_id):
+        """
+        :returns: 是否所有图片都已描述
+        """
+        with self._describing:
+            if self._is_cancelled(job_id):
+                return False
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                task = loop.create_task(self.describe(job_id))
+                with self._lock:
+                    self._tasks[job_id] = (loop, task)
+                    if job_id in self._cancelled:
+                        task.cancel()
+                try:
+                    loop.run_until_complete(task)
+                except asyncio.CancelledError:
+                    return False
+            finally:
+                with self._lock:
+                    self._tasks.pop(job_id, None)
+                loop.close()
+        job = self.repository.get_ingest_job(job_id)
+        return job is not None and job.status == "describing"
+
+    def _cleanup(self, job_id):
+        job = self.repository.get_ingest_job(job_id)
+        if job:
+            shutil.rmtree(job.directory, ignore_errors=True)
+
+
+def get_ingestor(describe=None):
+    """
+    根据配置创建绘本录入流水线
+
+    :param describe: 描述图片的协程函数，只登记任务、查询任务时可以不给
+    """
+    return BookIngestor(
+        describe,
+        concurrency=config.get("/book_ingest/concurrency", 4),
+        retries=config.get("/book_ingest/retries", 3),
+        backoff=config.get("/book_ingest/backoff", 2.0),
+        max_distance=config.get("/book_ingest/phash_distance", 10),
+    )
+
+
+def get_queue(orient, describe):
+    """
+    根据配置创建绘本录入任务队列
+
+    :param orient: orient(image_path, language) 校正一张图片的方向
+    :param describe: describe(job_id) 返回描述一个任务所有图片的协程
+    """
+    return IngestQueue(
+        get_ingestor(),
+        orient,
+        describe,
+        max_jobs=config.get("/book_ingest/max_jobs", 2),
+        orient_workers=config.get("/book_ingest/orient_workers", 2),
+        describe_jobs=config.get("/book_ingest/describe_jobs", 1),
+        max_pending=config.get("/book_ingest/max_pending", 10),
+    )
@@ -0,0 +1,622 @@
+# -*- coding: utf-8 -*-
+# 绘本数据仓库：长连接池 + 整本绘本一次性加载 + 绘本录入任务的暂存
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from robot import constants, logging
+from robot.agents import page_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# 绘本封面信息，字段顺序与旧版 get_book_description_by_id 的返回值保持一致
+BookDescription = namedtuple(
+    "BookDescription",
+    ["cn_title", "en_title", "cn_subtitle", "en_subtitle", "picture_content"],
+)
+
+# 绘本页面上的一段文字，字段顺序与旧版 get_book_text_by_content_id 的返回值保持一致
+BookText = namedtuple(
+    "BookText",
+    ["id", "language", "text", "type", "character", "character_category", "sequence"],
+)
+
+# 绘本的一页，前四个字段与旧版 get_book_content_by_book_id 的返回值保持一致
+# （page 与 sequence 相同，保留是为了兼容 content[3] 的用法），texts 为该页的 BookText 列表
+BookPage = namedtuple("BookPage", ["id", "sequence", "picture_content", "page", "texts"])
+
+# 整本绘本
+Book = namedtuple("Book", ["id", "description", "pages"])
+
+# 绘本录入任务，status 依次为 queued、orienting、describing、writing（进行中，重启后继续），
+# 最终为 committed、failed 或 cancelled
+IngestJob = namedtuple(
+    "IngestJob",
+    ["id", "directory", "status", "book_id", "error", "language", "created_at", "updated_at"],
+)
+
+# 录入任务中的一张图片，sequence 为 None 的是封面，oriented 表示已校正方向，
+# description 为暂存的大模型描述，image_bytes 为历次请求累计发给大模型的图片字节数，
+# fingerprint 为描述对应的 t_page_fingerprint.content_hash
+IngestPage = namedtuple(
+    "IngestPage",
+    ["file_name", "sequence", "description", "attempts", "error", "oriented", "image_bytes", "fingerprint"],
+)
+
+# 描述过的图片：content_hash 为图片文件的 sha1，phash 为感知哈希
+PageFingerprint = namedtuple("PageFingerprint", ["content_hash", "phash", "description"])
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS t_picture_book (
+        id TEXT PRIMARY KEY,
+        cn_title TEXT NOT NULL,
+        cn_subtitle TEXT,
+        en_title TEXT,
+        en_subtitle TEXT,
+        picture_content TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_picture_book_content (
+        id TEXT PRIMARY KEY,
+        book_id TEXT NOT NULL,
+        sequence INTEGER NOT NULL,
+        picture_content TEXT NOT NULL,
+        FOREIGN KEY(book_id) REFERENCES t_picture_book(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_picture_book_text (
+        id TEXT PRIMARY KEY,
+        content_id TEXT NOT NULL,
+        sequence INTEGER NOT NULL,
+        language INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        type INTEGER NOT NULL,
+        character TEXT,
+        character_category INTEGER NOT NULL,
+        FOREIGN KEY(content_id) REFERENCES t_picture_book_content(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_ingest_job (
+        id TEXT PRIMARY KEY,
+        directory TEXT NOT NULL,
+        status TEXT NOT NULL,
+        book_id TEXT,
+        error TEXT,
+        language TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_ingest_page (
+        job_id TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        sequence INTEGER,
+        description TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        oriented INTEGER NOT NULL DEFAULT 0,
+        image_bytes INTEGER NOT NULL DEFAULT 0,
+        fingerprint TEXT,
+        PRIMARY KEY (job_id, file_name),
+        FOREIGN KEY(job_id) REFERENCES t_ingest_job(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_page_fingerprint (
+        content_hash TEXT PRIMARY KEY,
+        phash TEXT NOT NULL,
+        is_cover INTEGER NOT NULL,
+        description TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_book_fingerprint (
+        fingerprint TEXT PRIMARY KEY,
+        book_id TEXT NOT NULL,
+        FOREIGN KEY(book_id) REFERENCES t_picture_book(id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_book_content_book ON t_picture_book_content (book_id, sequence)",
+    "CREATE INDEX IF NOT EXISTS idx_book_text_content ON t_picture_book_text (content_id, sequence)",
+    "CREATE INDEX IF NOT EXISTS idx_ingest_job_status ON t_ingest_job (status)",
+    "CREATE INDEX IF NOT EXISTS idx_page_fingerprint_cover ON t_page_fingerprint (is_cover)",
+]
+
+# 表创建之后新增的列：(表, 列, 定义)，旧数据库在 ensure_schema 时补上
+COLUMNS = [
+    ("t_ingest_job", "language", "TEXT"),
+    ("t_ingest_page", "oriented", "INTEGER NOT NULL DEFAULT 0"),
+    ("t_ingest_page", "image_bytes", "INTEGER NOT NULL DEFAULT 0"),
+    ("t_ingest_page", "fingerprint", "TEXT"),
+]
+
+# 以下 SQL 均为固定文本，sqlite3 会按语句文本在每个连接上缓存编译结果，
+# 配合长连接即可复用预编译语句
+SQL_ALL_BOOKS = "SELECT id, cn_title FROM t_picture_book"
+
+SQL_ALL_TITLES = "SELECT id, cn_title, en_title FROM t_picture_book"
+
+SQL_BOOK_DESCRIPTION = """
+SELECT cn_title, en_title, cn_subtitle, en_subtitle, picture_content
+FROM t_picture_book
+WHERE id = ?
+"""
+
+SQL_BOOK_CONTENTS = """
+SELECT id, sequence, picture_content, sequence
+FROM t_picture_book_content
+WHERE book_id = ?
+ORDER BY sequence
+"""
+
+SQL_BOOK_TEXTS = """
+SELECT id, language, text, type, character, character_category, sequence
+FROM t_picture_book_text
+WHERE content_id = ?
+ORDER BY sequence
+"""
+
+SQL_WHOLE_BOOK = """
+SELECT
+    b.cn_title, b.en_title, b.cn_subtitle, b.en_subtitle, b.picture_content,
+    c.id, c.sequence, c.picture_content,
+    t.id, t.language, t.text, t.type, t.character, t.character_category, t.sequence
+FROM t_picture_book b
+LEFT JOIN t_picture_book_content c ON c.book_id = b.id
+LEFT JOIN t_picture_book_text t ON t.content_id = c.id
+WHERE b.id = ?
+ORDER BY c.sequence, c.id, t.sequence
+"""
+
+SQL_INGEST_JOB = """
+SELECT id, directory, status, book_id, error, language, created_at, updated_at
+FROM t_ingest_job
+WHERE id = ?
+"""
+
+SQL_RECENT_INGEST_JOBS = """
+SELECT id, directory, status, book_id, error, language, created_at, updated_at
+FROM t_ingest_job
+ORDER BY created_at DESC
+LIMIT ?
+"""
+
+SQL_INGEST_PROGRESS = """
+SELECT COUNT(*), SUM(oriented), COUNT(description), SUM(image_bytes)
+FROM t_ingest_page
+WHERE job_id = ?
+"""
+
+SQL_INGEST_PAGES = """
+SELECT file_name, sequence, description, attempts, error, oriented, image_bytes, fingerprint
+FROM t_ingest_page
+WHERE job_id = ?
+ORDER BY sequence IS NOT NULL, sequence
+"""
+
+SQL_UPDATE_INGEST_JOB = """
+UPDATE t_ingest_job SET status = ?, book_id = ?, error = ?, updated_at = ? WHERE id = ?
+"""
+
+SQL_PAGE_FINGERPRINT = """
+SELECT content_hash, phash, description FROM t_page_fingerprint WHERE content_hash = ? AND is_cover = ?
+"""
+
+SQL_PAGE_PHASHES = "SELECT content_hash, phash FROM t_page_fingerprint WHERE is_cover = ?"
+
+SQL_BOOK_BY_FINGERPRINT = """
+SELECT f.book_id
+FROM t_book_fingerprint f
+JOIN t_picture_book b ON b.id = f.book_id
+WHERE f.fingerprint = ?
+"""
+
+SQL_INSERT_BOOK = """
+INSERT INTO t_picture_book (id, cn_title, cn_subtitle, en_title, en_subtitle, picture_content)
+VALUES (:id, :cn_title, :cn_subtitle, :en_title, :en_subtitle, :picture_content)
+"""
+
+SQL_INSERT_CONTENT = """
+INSERT INTO t_picture_book_content (id, book_id, sequence, picture_content)
+VALUES (:id, :book_id, :sequence, :picture_content)
+"""
+
+SQL_INSERT_TEXT = """
+INSERT INTO t_picture_book_text (id, content_id, sequence, language, text, type, character, character_category)
+VALUES (:id, :content_id, :sequence, :language, :text, :type, :character, :character_category)
+"""
+
+
+class BookRepository(object):
+    """
+    绘本数据仓库
+
+    维护一个线程安全的 sqlite 连接池，连接在进程内长期复用，
+    数据库开启 WAL 模式，读写互不阻塞。
+    """
+
+    def __init__(self, db_path=None, pool_size=4, timeout=10):
+        """
+        :param db_path: 数据库路径，默认为 story_db/picture_books.db
+        :param pool_size: 连接池的最大连接数
+        :param timeout: 等待数据库锁的超时时间（秒）
+        """
+        self.db_path = db_path or constants.getStoryDB()
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=64,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        # 连接数已满，等待其他线程归还
+        return self._pool.get()
+
+    @contextmanager
+    def connection(self):
+        """
+        从连接池中借出一个连接，用完自动归还
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        """
+        在一个事务中执行写操作，正常结束时提交，出现异常时回滚
+
+        :returns: 游标
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def ensure_schema(self):
+        """
+        创建绘本相关的表和索引（已存在则跳过）
+        """
+        with self.transaction() as cursor:
+            for sql in SCHEMA:
+                cursor.execute(sql)
+            for table, column, definition in COLUMNS:
+                columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+                if column not in columns:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def get_all_books(self):
+        """
+        获取所有绘本
+
+        :returns: (id, cn_title) 列表
+        """
+        with self.connection() as conn:
+            return [(row[0], row[1]) for row in conn.execute(SQL_ALL_BOOKS)]
+
+    def get_all_titles(self):
+        """
+        获取所有绘本的中英文书名
+
+        :returns: (id, cn_title, en_title) 列表
+        """
+        with self.connection() as conn:
+            return [tuple(row) for row in conn.execute(SQL_ALL_TITLES)]
+
+    def get_book_description(self, book_id):
+        """
+        获取绘本的封面信息
+
+        :returns: BookDescription，不存在则返回 None
+        """
+        with self.connection() as conn:
+            row = conn.execute(SQL_BOOK_DESCRIPTION, (book_id,)).fetchone()
+        return BookDescription(*row) if row else None
+
+    def get_book_contents(self, book_id):
+        """
+        获取绘本的所有页面（不含文字）
+
+        :returns: (id, sequence, picture_content, sequence) 列表
+        """
+        with self.connection() as conn:
+            return conn.execute(SQL_BOOK_CONTENTS, (book_id,)).fetchall()
+
+    def get_book_texts(self, content_id):
+        """
+        获取某一页的所有文字
+
+        :returns: BookText 列表
+        """
+        with self.connection() as conn:
+            rows = conn.execute(SQL_BOOK_TEXTS, (content_id,)).fetchall()
+        return [BookText(*row) for row in rows]
+
+    def load_book(self, book_id):
+        """
+        用一次查询加载整本绘本：封面信息 + 按顺序排列的页面 + 每页的文字
+
+        :param book_id: 绘本 id
+        :returns: Book，不存在则返回 None
+        """
+        with self.connection() as conn:
+            rows = conn.execute(SQL_WHOLE_BOOK, (book_id,)).fetchall()
+        if not rows:
+            return None
+
+        description = BookDescription(*rows[0][:5])
+        pages = []
+        page = None
+        for row in rows:
+            content_id = row[5]
+            if content_id is None:
+                continue
+            if page is None or page.id != content_id:
+                page = BookPage(content_id, row[6], row[7], row[6], [])
+                pages.append(page)
+            if row[8] is not None:
+                page.texts.append(BookText(*row[8:]))
+        return Book(book_id, description, pages)
+
+    def create_ingest_job(self, job_id, directory, pages, language=None, status="queued"):
+        """
+        登记一个绘本录入任务
+
+        :param directory: 上传图片所在的目录
+        :param pages: (file_name, sequence) 列表，封面的 sequence 为 None
+        :param language: 校正图片方向时使用的 tesseract 语言
+        """
+        now = time.time()
+        with self.transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO t_ingest_job (id, directory, status, language, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, directory, status, language, now, now),
+            )
+            cursor.executemany(
+                "INSERT INTO t_ingest_page (job_id, file_name, sequence) VALUES (?, ?, ?)",
+                [(job_id, file_name, sequence) for file_name, sequence in pages],
+            )
+
+    def get_ingest_job(self, job_id):
+        """
+        :returns: IngestJob，不存在则返回 None
+        """
+        with self.connection() as conn:
+            row = conn.execute(SQL_INGEST_JOB, (job_id,)).fetchone()
+        return IngestJob(*row) if row else None
+
+    def get_ingest_jobs(self, statuses):
+        """
+        按创建顺序获取处于这些状态的录入任务
+
+        :param statuses: 状态列表
+        :returns: IngestJob 列表
+        """
+        sql = (
+            "SELECT id, directory, status, book_id, error, language, created_at, updated_at "
+            f"FROM t_ingest_job WHERE status IN ({', '.join('?' * len(statuses))}) ORDER BY created_at"
+        )
+        with self.connection() as conn:
+            rows = conn.execute(sql, tuple(statuses)).fetchall()
+        return [IngestJob(*row) for row in rows]
+
+    def get_recent_ingest_jobs(self, limit=20):
+        """
+        最近创建的录入任务，新的在前
+
+        :returns: IngestJob 列表
+        """
+        with self.connection() as conn:
+            rows = conn.execute(SQL_RECENT_INGEST_JOBS, (limit,)).fetchall()
+        return [IngestJob(*row) for row in rows]
+
+    def get_ingest_progress(self, job_id):
+        """
+        :returns: (图片数, 已校正方向的图片数, 已描述的图片数, 发给大模型的图片字节数)
+        """
+        with self.connection() as conn:
+            total, oriented, described, image_bytes = conn.execute(SQL_INGEST_PROGRESS, (job_id,)).fetchone()
+        return total, oriented or 0, described, image_bytes or 0
+
+    def orient_ingest_page(self, job_id, file_name):
+        """
+        记录一张图片已校正方向，重启后不再重复校正
+        """
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE t_ingest_page SET oriented = 1 WHERE job_id = ? AND file_name = ?",
+                (job_id, file_name),
+            )
+
+    def get_ingest_pages(self, job_id):
+        """
+        获取录入任务的所有图片，封面在前，其余按页码排列
+
+        :returns: IngestPage 列表
+        """
+        with self.connection() as conn:
+            rows = conn.execute(SQL_INGEST_PAGES, (job_id,)).fetchall()
+        return [IngestPage(*row) for row in rows]
+
+    def stage_ingest_page(self, job_id, file_name, description, image_bytes=0, fingerprint=None):
+        """
+        暂存一张图片的描述，重启后不再重新描述
+
+        :param image_bytes: 这次请求发给大模型的图片字节数
+        :param fingerprint: 描述对应的 t_page_fingerprint.content_hash
+        """
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE t_ingest_page SET description = ?, attempts = attempts + 1, error = NULL, "
+                "image_bytes = image_bytes + ?, fingerprint = ? WHERE job_id = ? AND file_name = ?",
+                (description, image_bytes, fingerprint, job_id, file_name),
+            )
+
+    def find_page_fingerprint(self, content_hash, phash, is_cover, max_distance=0):
+        """
+        查找描述过的相同图片：先按内容哈希精确匹配，再找感知哈希最接近的
+
+        :param max_distance: 感知哈希最多相差的位数，为 0 时只精确匹配
+        :returns: PageFingerprint，没有找到时返回 None
+        """
+        with self.connection() as conn:
+            row = conn.execute(SQL_PAGE_FINGERPRINT, (content_hash, int(is_cover))).fetchone()
+            if row is not None or not max_distance:
+                return PageFingerprint(*row) if row else None
+            # 只取哈希比较，选中之后再读描述
+            best, best_distance = None, max_distance + 1
+            for key, other in conn.execute(SQL_PAGE_PHASHES, (int(is_cover),)):
+                d = page_fingerprint.distance(other, phash)
+                if d < best_distance:
+                    best, best_distance = key, d
+            if best is None:
+                return None
+            row = conn.execute(SQL_PAGE_FINGERPRINT, (best, int(is_cover))).fetchone()
+        return PageFingerprint(*row) if row else None
+
+    def save_page_fingerprint(self, content_hash, phash, is_cover, description):
+        """
+        记录一张图片的描述，之后上传相同的图片时不再调用大模型
+        """
+        with self.transaction() as cursor:
+            cursor.execute(
+                "INSERT OR REPLACE INTO t_page_fingerprint (content_hash, phash, is_cover, description, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (content_hash, phash, int(is_cover), description, time.time()),
+            )
+
+    def fail_ingest_page(self, job_id, file_name, error, image_bytes=0):
+        """
+        记录一次失败的描述
+
+        :param image_bytes: 这次请求发给大模型的图片字节数，图片没发出去时为 0
+        """
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE t_ingest_page SET attempts = attempts + 1, error = ?, image_bytes = image_bytes + ? "
+                "WHERE job_id = ? AND file_name = ?",
+                (error, image_bytes, job_id, file_name),
+            )
+
+    def update_ingest_job(self, job_id, status, book_id=None, error=None, cursor=None, only_from=None):
+        """
+        更新录入任务的状态
+
+        :param cursor: 在调用方的事务中更新，默认单独提交
+        :param only_from: 状态列表，只有任务当前处于这些状态时才更新
+        :returns: 是否更新了
+        """
+        sql = SQL_UPDATE_INGEST_JOB
+        params = (status, book_id, error, time.time(), job_id)
+        if only_from:
+            sql += f" AND status IN ({', '.join('?' * len(only_from))})"
+            params += tuple(only_from)
+        if cursor is not None:
+            cursor.execute(sql, params)
+            return cursor.rowcount > 0
+        with self.transaction() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount > 0
+
+    def commit_ingested_book(self, job_id, book, contents, texts, fingerprint=None):
+        """
+        在一个事务中写入整本绘本并把录入任务标记为完成，中途失败不会留下半本绘本
+
+        :param book: t_picture_book 的一行（dict）
+        :param contents: t_picture_book_content 的行列表
+        :param texts: t_picture_book_text 的行列表
+        :param fingerprint: 整本绘本的指纹，已有相同指纹的绘本时不再写入，任务指向已有的绘本
+        :returns: 任务对应的绘本 id；任务已不在 writing 状态（例如已取消）时不写入，返回 None
+        """
+        with self.transaction() as cursor:
+            existing = None
+            if fingerprint:
+                existing = cursor.execute(SQL_BOOK_BY_FINGERPRINT, (fingerprint,)).fetchone()
+            book_id = existing[0] if existing else book["id"]
+            if not self.update_ingest_job(
+                job_id, "committed", book_id=book_id, cursor=cursor, only_from=("writing",)
+            ):
+                return None
+            if existing:
+                return book_id
+            cursor.execute(SQL_INSERT_BOOK, book)
+            cursor.executemany(SQL_INSERT_CONTENT, contents)
+            cursor.executemany(SQL_INSERT_TEXT, texts)
+            if fingerprint:
+                cursor.execute(
+                    "INSERT OR REPLACE INTO t_book_fingerprint (fingerprint, book_id) VALUES (?, ?)",
+                    (fingerprint, book_id),
+                )
+        return book_id
+
+    def close(self):
+        """
+        关闭连接池中的所有空闲连接
+        """
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_repository():
+    """
+    获取进程内共享的绘本数据仓库
+    """
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                repository = BookRepository()
+                repository.ensure_schema()
+                _repository = repository
+    return _repository
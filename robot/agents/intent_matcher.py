@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+# 本地意图快速匹配：明确的“讲某本绘本”“聊天”等请求不再经过大模型分类
+import json
+import random
+import re
+import threading
+import time
+
+from pypinyin import lazy_pinyin
+
+from robot import config, logging
+from robot.agents.book_catalog import get_catalog
+
+logger = logging.getLogger(__name__)
+
+# 想听绘本/故事时常用的说法
+STORY_KEYWORDS = [
+    "讲绘本", "讲故事", "读绘本", "读故事", "念绘本", "念故事", "看绘本", "听绘本", "听故事",
+    "播放绘本", "播放故事",
+]
+
+# 单个动词只有紧跟在书名前面时（“我想听小猪佩奇”）才算想听绘本，
+# 单独出现时（“看看你”“听我说”）不算
+STORY_VERB = re.compile(r"(?:讲|读|念|播放|放|听|看)(?:一下|一遍|一本|下)?$")
+_STORY_VERB_CHARS = set("讲读念放听看")
+
+# 出现在关键词前面时意思相反（“我不想听小猪佩奇”），交给大模型判断
+NEGATIONS = ["不要", "不想", "不用", "别", "不"]
+
+# 想和虚拟小伙伴聊天时常用的说法
+CHAT_KEYWORDS = ["聊天", "聊聊", "聊一聊", "说说话", "陪我玩"]
+
+# 命中绘本时的开场白模板
+STORY_TIPS = [
+    "好呀，我们一起来读《{title}》吧！",
+    "没问题，现在就给你讲《{title}》，准备好了吗？",
+    "《{title}》来啦，我们一起翻开看看吧！",
+]
+
+CHAT_TIPS = [
+    "好呀，接下来让{playmate}陪你聊天吧！",
+    "{playmate}已经等不及啦，快和{playmate}聊聊吧！",
+]
+
+# 去掉标点、空白和书名号，只保留文字
+_PUNCTUATION = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def normalize(text):
+    return _PUNCTUATION.sub("", text or "").lower()
+
+
+def _position(chars, keywords):
+    """
+    :returns: 最早出现的关键词的位置，都没有出现时返回 -1
+    """
+    positions = [chars.find(word) for word in keywords if word in chars]
+    return min(positions) if positions else -1
+
+
+def _verb_before(chars, title):
+    """
+    :returns: 紧跟在书名前面的动词的位置，没有时返回 -1
+    """
+    index = chars.find(title)
+    if index < 0:
+        return -1
+    m = STORY_VERB.search(chars[:index])
+    return m.start() if m else -1
+
+
+def _negated(chars, pos):
+    return pos >= 0 and any(word in chars[:pos] for word in NEGATIONS)
+
+
+def _ngrams(seq, n=2):
+    if len(seq) < n:
+        return {tuple(seq)} if seq else set()
+    return {tuple(seq[i : i + n]) for i in range(len(seq) - n + 1)}
+
+
+class _TitleEntry(object):
+    __slots__ = ("book_id", "title", "chars", "pinyin", "char_grams", "pinyin_grams", "en_title")
+
+    def __init__(self, book_id, title, en_title):
+        self.book_id = book_id
+        self.title = title
+        self.chars = normalize(title)
+        self.pinyin = "".join(lazy_pinyin(self.chars))
+        self.char_grams = _ngrams(list(self.chars))
+        self.pinyin_grams = _ngrams(lazy_pinyin(self.chars))
+        self.en_title = normalize(en_title) if en_title else ""
+
+
+class TitleIndex(object):
+    """
+    绘本书名索引，由某一版绘本目录构建，创建后不再修改
+
+    同时按汉字和拼音建立二元组索引，拼音可以容忍语音识别的同音字错误，
+    例如“琳琳好害怕”被识别成“林林好害怕”。
+    """
+
+    def __init__(self, snapshot):
+        self.version = snapshot.version
+        self.entries = []
+        self._gram_index = {}
+        seen = set()
+        for book_id, title in snapshot.books:
+            entry = _TitleEntry(book_id, title, snapshot.en_titles.get(book_id))
+            # 同名绘本只保留第一本，否则两本得分相同，永远无法确定
+            if not entry.chars or entry.chars in seen:
+                continue
+            seen.add(entry.chars)
+            self.entries.append(entry)
+            for gram in entry.pinyin_grams:
+                self._gram_index.setdefault(gram, []).append(entry)
+
+    def _candidates(self, grams):
+        candidates = {}
+        for gram in grams:
+            for entry in self._gram_index.get(gram, ()):
+                candidates[entry.book_id] = entry
+        return candidates.values()
+
+    @staticmethod
+    def _score(entry, chars, pinyin, char_grams, pinyin_grams):
+        if entry.chars in chars:
+            return 1.0
+        if entry.en_title and entry.en_title in chars:
+            return 1.0
+        if entry.pinyin in pinyin:
+            return 0.95
+        # 书名太短时二元组没有区分度，只接受完整匹配
+        if len(entry.chars) <= 2:
+            return 0.0
+        char_score = len(entry.char_grams & char_grams) / len(entry.char_grams)
+        pinyin_score = len(entry.pinyin_grams & pinyin_grams) / len(entry.pinyin_grams) * 0.9
+        return max(char_score, pinyin_score)
+
+    def search(self, text):
+        """
+        在书名索引中查找与输入最接近的绘本
+
+        :param text: 用户说的话
+        :returns: [(score, entry), ...]，按得分从高到低排列
+        """
+        chars = normalize(text)
+        if not chars:
+            return []
+        syllables = lazy_pinyin(chars)
+        pinyin = "".join(syllables)
+        char_grams = _ngrams(list(chars))
+        pinyin_grams = _ngrams(syllables)
+
+        candidates = list(self._candidates(pinyin_grams))
+        # 英文书名不在拼音索引中，单独检查
+        candidates += [e for e in self.entries if e.en_title and e.en_title in chars and e not in candidates]
+        results = []
+        for entry in candidates:
+            score = self._score(entry, chars, pinyin, char_grams, pinyin_grams)
+            if score > 0:
+                results.append((score, entry))
+        results.sort(key=lambda item: item[0], reverse=True)
+        return results
+
+
+class _StageTimer(object):
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0,
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class IntentStats(object):
+    """
+    快速匹配的命中率以及各阶段耗时统计
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.hits = {}
+            self.stages = {}
+
+    def record_hit(self, rule):
+        with self._lock:
+            self.requests += 1
+            self.hits[rule] = self.hits.get(rule, 0) + 1
+
+    def record_miss(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_stage(self, stage, elapsed):
+        with self._lock:
+            self.stages.setdefault(stage, _StageTimer()).add(elapsed)
+
+    def to_dict(self):
+        with self._lock:
+            hits = sum(self.hits.values())
+            return {
+                "requests": self.requests,
+                "hits": hits,
+                "fallbacks": self.requests - hits,
+                "hit_rate": round(hits / self.requests, 4) if self.requests else 0,
+                "rules": dict(self.hits),
+                "latency": {name: timer.to_dict() for name, timer in self.stages.items()},
+            }
+
+
+class IntentMatcher(object):
+    """
+    StoryBot 分类器前面的本地匹配阶段
+
+    能以高置信度确定意图时，直接输出与 Classify 相同结构的 yaml
+    （next_step/book_id/audio/tips），否则返回 None，交给大模型处理。
+    """
+
+    def __init__(self, catalog=None, threshold=0.8, margin=0.15):
+        """
+        :param catalog: 绘本目录，默认使用进程内共享的目录
+        :param threshold: 书名匹配的最低得分
+        :param margin: 最佳结果需要领先第二名的分差，避免在相近的书名之间乱猜
+        """
+        self.threshold = threshold
+        self.margin = margin
+        self.stats = IntentStats()
+        self._index = None
+        (catalog or get_catalog()).subscribe(self._rebuild)
+
+    def _rebuild(self, snapshot):
+        start = time.perf_counter()
+        self._index = TitleIndex(snapshot)
+        logger.info(
+            f"书名索引已重建（目录版本 {snapshot.version}，{len(self._index.entries)} 本），"
+            f"耗时 {(time.perf_counter() - start) * 1000:.1f} ms"
+        )
+
+    def match_book(self, text):
+        """
+        :returns: 高置信度命中的 _TitleEntry，否则返回 None
+        """
+        results = self._index.search(text) if self._index else []
+        if not results:
+            return None
+        best_score, best = results[0]
+        if best_score < self.threshold:
+            return None
+        if len(results) > 1 and best_score - results[1][0] < self.margin:
+            logger.info(f"书名匹配不确定：{[(e.title, s) for s, e in results[:3]]}")
+            return None
+        return best
+
+    def _classify(self, text, playmate):
+        chars = normalize(text)
+        if not chars:
+            return "empty", {"next_step": -2}
+
+        chat_pos = _position(chars, CHAT_KEYWORDS)
+        story_pos = _position(chars, STORY_KEYWORDS)
+        entry = None
+        if chat_pos < 0 and _STORY_VERB_CHARS.intersection(chars):
+            entry = self.match_book(chars)
+            if entry and story_pos < 0:
+                story_pos = _verb_before(chars, entry.chars)
+        if _negated(chars, story_pos) or _negated(chars, chat_pos):
+            return None, None
+
+        if story_pos >= 0 and chat_pos < 0:
+            if entry:
+                return "book", {
+                    "next_step": 1,
+                    "book_id": entry.book_id,
+                    "tips": random.choice(STORY_TIPS).format(title=entry.title),
+                }
+        if chat_pos >= 0 and story_pos < 0:
+            return "chat", {
+                "next_step": 4,
+                "tips": random.choice(CHAT_TIPS).format(playmate=playmate),
+            }
+        return None, None
+
+    def match(self, text, playmate=""):
+        """
+        尝试在本地确定用户意图
+
+        :param text: 用户说的话
+        :param playmate: 虚拟小伙伴的名字，用于聊天的提示语
+        :returns: 与 Classify 输出相同格式的 yaml 文本，无法确定时返回 None
+        """
+        start = time.perf_counter()
+        rule, result = self._classify(text, playmate)
+        self.stats.record_stage("local", time.perf_counter() - start)
+        if result is None:
+            self.stats.record_miss()
+            return None
+        self.stats.record_hit(rule)
+        logger.info(f"本地意图匹配命中 {rule}：{text} -> {result}")
+        # json 字符串同时也是合法的 yaml 标量，书名里的引号、冒号不会破坏格式
+        return "\n".join(
+            [
+                f"next_step: {result['next_step']}",
+                f"book_id: {json.dumps(result.get('book_id', ''), ensure_ascii=False)}",
+                "audio:",
+                f"tips: {json.dumps(result.get('tips', ''), ensure_ascii=False)}",
+            ]
+        )
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_intent_matcher():
+    """
+    获取进程内共享的意图匹配器，未开启时返回 None
+    """
+    global _matcher
+    if not config.get("/intent_matcher/enable", True):
+        return None
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                _matcher = IntentMatcher(
+                    threshold=config.get("/intent_matcher/threshold", 0.8),
+                    margin=config.get("/intent_matcher/margin", 0.15),
+                )
+    return _matcher
+
+
+def get_stats():
+    """
+    意图匹配的统计信息，匹配器还未创建时返回 None
+    """
+    return _matcher.stats.to_dict() if _matcher else None
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# 讲绘本时固定朗读的句子，以及朗读时使用的语音参数
+
+# 开场、翻页和结束用语
+OPEN_BOOK = ["现在我们翻开第一页", "现在我们翻开书", "小宝贝，来把书翻开", "让我们来打开第一页"]
+NEXT_PAGE = ["让我们翻开下一页", "现在看看下一页讲了什么", "接下来我们来看下一页", "好了，来看下一页", "看看下一页讲什么"]
+FINISH = ["现在，故事讲完了", "现在，就讲到这里吧", "好了，这个故事讲完了", "这本书就讲到这里吧", "就讲到这儿吧"]
+
+# 讲绘本时的语速和情感，TellStory 朗读与预合成必须一致，否则缓存无法命中
+SPEED_RATIO = 0.8
+EMOTION = "happy"
+
+# 旁白（书名、封面、页面描述、固定用语）使用的角色
+NARRATOR = -1
+
+
+def fixed_phrases():
+    """
+    所有绘本共用的固定用语
+    """
+    return OPEN_BOOK + NEXT_PAGE + FINISH
+
+
+def book_segments(book, from_sequence=None, with_phrases=True):
+    """
+    按播放顺序列出一本绘本里所有已知的句子
+
+    :param book: BookRepository.load_book 返回的 Book
+    :param from_sequence: 打断后继续时的页码，之前的页面不再列出
+    :param with_phrases: 是否在第一段中包含固定用语
+    :returns: 分段列表，第一段是书名、副标题、封面（以及固定用语），之后每页一段；
+              每段是 (text, speed_ratio, emotion, character_category) 的列表
+    """
+    cover = [text for text in book.description if text]
+    if with_phrases:
+        cover += fixed_phrases()
+    segments = [[(text, SPEED_RATIO, EMOTION, NARRATOR) for text in cover]]
+    for page in book.pages:
+        if from_sequence is not None and page.sequence < from_sequence:
+            continue
+        lines = [
+            (text.text, SPEED_RATIO, EMOTION, text.character_category)
+            for text in page.texts
+            if text.text
+        ]
+        if page.picture_content:
+            lines.append((page.picture_content, SPEED_RATIO, EMOTION, NARRATOR))
+        segments.append(lines)
+    return segments
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# 绘本图片指纹：内容哈希识别完全相同的文件，感知哈希识别重新拍摄、重新压缩的同一页
+import hashlib
+
+from PIL import Image
+
+# 感知哈希的边长，16 时为 256 位
+HASH_SIZE = 16
+
+
+def fingerprint(image_path, hash_size=HASH_SIZE):
+    """
+    计算图片指纹（阻塞，在线程池中调用）
+
+    :returns: (内容哈希, 感知哈希)，都是十六进制字符串
+    """
+    digest = hashlib.sha1()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+    # 差值哈希：缩成 (hash_size + 1) x hash_size 的灰度图，逐行比较相邻像素的明暗
+    with Image.open(image_path) as image:
+        image.draft("L", (hash_size * 8, hash_size * 8))
+        small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return digest.hexdigest(), f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def distance(a, b):
+    """
+    两个感知哈希不同的位数
+    """
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
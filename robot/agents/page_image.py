@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# 发给多模态大模型之前的图片预处理：缩小、重新编码、去掉元数据，按内容缓存编码结果
+import base64
+import collections
+import hashlib
+import io
+import os
+import threading
+
+from PIL import Image, ImageOps
+
+from robot import config, constants, logging
+
+logger = logging.getLogger(__name__)
+
+# base64：发给大模型的图片；size：base64 的字节数，即实际发送的大小；
+# original_size：原图文件大小；cached：是否直接使用了缓存
+PageImage = collections.namedtuple(
+    "PageImage", ["base64", "size", "original_size", "width", "height", "cached"]
+)
+
+FORMATS = {"jpeg": ("JPEG", "jpg"), "webp": ("WEBP", "webp")}
+
+
+class PageImageEncoder(object):
+    """
+    绘本图片编码器
+
+    - 长边缩小到 max_edge，按 EXIF 摆正，去掉透明通道
+    - 按 quality 编码成 JPEG 或 WebP，不保留 EXIF、ICC 等元数据
+    - 编码结果按 (原图内容哈希, 编码参数) 缓存在 temp/page_images，重试和重新录入同一张图片时直接使用
+    - 缓存总大小超过 budget_bytes 时删除最久没用过的文件
+    """
+
+    def __init__(self, root=None, max_edge=1536, quality=85, image_format="jpeg", budget_bytes=256 * 1024 * 1024):
+        """
+        :param root: 缓存目录，默认为 temp/page_images
+        :param max_edge: 图片长边的最大像素数
+        :param quality: 编码质量（1-100）
+        :param image_format: jpeg 或 webp
+        :param budget_bytes: 缓存文件总大小上限（字节）
+        """
+        if image_format not in FORMATS:
+            raise ValueError(f"不支持的图片格式：{image_format}")
+        self.root = root or os.path.join(constants.TEMP_PATH, "page_images")
+        self.max_edge = max_edge
+        self.quality = quality
+        self.image_format = image_format
+        self.budget_bytes = budget_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # 缓存文件总大小，启动时统计一次，之后随写入和淘汰更新
+        self._bytes = sum(size for _, size, _ in self._files())
+
+    def make_key(self, image_path):
+        """
+        计算缓存键：原图内容和编码参数都参与计算，改了参数不会用到旧的缓存
+
+        :returns: 40 位十六进制字符串
+        """
+        digest = hashlib.sha1()
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        digest.update(f"|{self.max_edge}|{self.quality}|{self.image_format}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.{FORMATS[self.image_format][1]}")
+
+    def encode(self, image_path):
+        """
+        编码一张图片（阻塞，在线程池中调用）
+
+        :returns: PageImage
+        """
+        original_size = os.path.getsize(image_path)
+        key = self.make_key(image_path)
+        path = self._path(key)
+        cached = os.path.exists(path)
+        if cached:
+            with open(path, "rb") as f:
+                data = f.read()
+            # 更新访问时间，淘汰时按它排序
+            os.utime(path)
+            with Image.open(io.BytesIO(data)) as image:
+                width, height = image.size
+        else:
+            data, width, height = self._encode(image_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再改名，并发编码同一张图片时不会读到写了一半的文件
+            temp = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp, "wb") as f:
+                f.write(data)
+            os.replace(temp, path)
+            with self._lock:
+                self._bytes += len(data)
+
+        encoded = base64.b64encode(data).decode("utf-8")
+        with self._lock:
+            if cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.bytes_in += original_size
+            self.bytes_out += len(encoded)
+        if not cached and self._bytes > self.budget_bytes:
+            self._evict()
+        return PageImage(encoded, len(encoded), original_size, width, height, cached)
+
+    def _encode(self, image_path):
+        image_format = FORMATS[self.image_format][0]
+        with Image.open(image_path) as image:
+            # JPEG 按 1/2、1/4、1/8 缩小解码，比解码原图再缩小快得多
+            image.draft("RGB", (self.max_edge, self.max_edge))
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA", "P"):
+                # 透明部分铺白底，JPEG 不支持透明
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, "white")
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+            output = io.BytesIO()
+            # 不传 exif、icc_profile，保存时不带元数据
+            if image_format == "JPEG":
+                image.save(output, format=image_format, quality=self.quality, optimize=True)
+            else:
+                image.save(output, format=image_format, quality=self.quality)
+            return output.getvalue(), image.width, image.height
+
+    def _files(self):
+        """
+        :returns: 所有缓存文件的 (访问时间, 大小, 路径)，不包括正在写入的临时文件
+        """
+        files = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _evict(self):
+        """
+        总大小超过预算时按最久没用过的顺序删除，降到预算的 90%
+        """
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.budget_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        with self._lock:
+            self._bytes = total
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+            }
+
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_encoder():
+    """
+    获取进程内共享的图片编码器
+    """
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                _encoder = PageImageEncoder(
+                    max_edge=config.get("/book_ingest/image_max_edge", 1536),
+                    quality=config.get("/book_ingest/image_quality", 85),
+                    image_format=config.get("/book_ingest/image_format", "jpeg"),
+                    budget_bytes=config.get("/book_ingest/image_cache_mb", 256) * 1024 * 1024,
+                )
+    return _encoder
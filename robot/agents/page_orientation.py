@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# 绘本图片方向校正：先按 EXIF 摆正，再在缩小的灰度图上检测文字方向，把握不大的图片才用原图检测
+import collections
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+from pytesseract import Output, pytesseract
+
+try:
+    # 常驻进程内的 tesseract，检测时不用每次启动 tesseract 子进程
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+from robot import config, logging
+
+logger = logging.getLogger(__name__)
+
+# EXIF 中的方向标签
+EXIF_ORIENTATION = 0x0112
+
+# rotate：图片需要顺时针旋转的角度；confidence：tesseract 的把握；stage：由哪一级检测得出
+Orientation = collections.namedtuple("Orientation", ["rotate", "confidence", "stage", "exif"])
+
+
+class OrientationError(Exception):
+    """
+    tesseract 无法判断图片方向（例如文字太少）
+    """
+
+    pass
+
+
+class PageOrientation(object):
+    """
+    绘本图片方向校正
+
+    逐级检测，前一级有把握就不再进行后面更慢的检测：
+
+    1. 按 EXIF 方向标签摆正（手机拍摄的照片大多到这里就是正的）
+    2. JPEG 解码时直接缩小到 max_edge，在灰度图上做方向检测
+    3. 第 2 级的把握低于 min_confidence 时，用原图（小图放大一倍）检测，失败时再二值化后检测一次
+
+    安装了 tesserocr 时每个线程复用一个进程内的 tesseract 实例，否则通过 pytesseract 调用 tesseract 命令。
+    只有需要旋转的图片才重新保存。
+    """
+
+    def __init__(self, max_edge=1600, min_confidence=2.0, language="chi_sim+eng"):
+        """
+        :param max_edge: 快速检测时图片长边缩小到的像素数
+        :param min_confidence: 快速检测的把握达到这个值时直接采用
+        :param language: pytesseract 检测时使用的语言
+        """
+        self.max_edge = max_edge
+        self.min_confidence = min_confidence
+        self.language = language
+        self.backend = "tesserocr" if tesserocr else "pytesseract"
+        self._local = threading.local()
+        self._apis = []
+        self._lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.elapsed = 0.0
+
+    def correct(self, image_path, language=None):
+        """
+        校正图片方向，需要旋转时覆盖原图
+
+        :param image_path: 图片路径
+        :param language: tesseract 语言，默认使用构造时的语言
+        :returns: Orientation
+        """
+        orientation = self.detect(image_path, language)
+        if orientation.rotate or orientation.exif:
+            with Image.open(image_path) as image:
+                image_format = image.format
+                rotated = ImageOps.exif_transpose(image)
+            if orientation.rotate:
+                # PIL 的 rotate 是逆时针
+                rotated = rotated.rotate(-orientation.rotate, expand=True)
+            if image_format == "JPEG":
+                rotated.save(image_path, format=image_format, quality=95)
+            else:
+                rotated.save(image_path, format=image_format)
+            logger.info(f"{image_path} 旋转 {orientation.rotate} 度（{orientation.stage}）")
+        return orientation
+
+    def detect(self, image_path, language=None):
+        """
+        检测图片方向，不修改图片
+
+        :returns: Orientation，rotate 是按 EXIF 摆正之后还需要顺时针旋转的角度
+        """
+        language = language or self.language
+        start = time.perf_counter()
+        with Image.open(image_path) as image:
+            exif = image.getexif().get(EXIF_ORIENTATION, 1) not in (0, 1)
+            # JPEG 按 1/2、1/4、1/8 缩小解码，比解码原图再缩小快得多
+            image.draft("L", (self.max_edge, self.max_edge))
+            small = ImageOps.exif_transpose(image).convert("L")
+        small.thumbnail((self.max_edge, self.max_edge))
+
+        best = None
+        try:
+            rotate, confidence = self._osd(small, language)
+            best = Orientation(rotate, confidence, "fast", exif)
+        except OrientationError as e:
+            logger.debug(f"{image_path} 快速检测方向失败：{e}")
+
+        if best is None or best.confidence < self.min_confidence:
+            full = self._detect_full(image_path, language, exif)
+            if full is not None and (best is None or full.confidence >= best.confidence):
+                best = full
+        if best is None:
+            logger.warning(f"{image_path} 无法检测方向，保持原样")
+            best = Orientation(0, 0.0, "none", exif)
+
+        with self._lock:
+            self.counts[best.stage] += 1
+            self.elapsed += time.perf_counter() - start
+        return best
+
+    def _detect_full(self, image_path, language, exif):
+        with Image.open(image_path) as image:
+            gray = ImageOps.exif_transpose(image).convert("L")
+        if max(gray.size) <= self.max_edge:
+            # 小图上的文字太小，放大一倍再检测
+            gray = gray.resize((gray.width * 2, gray.height * 2), Image.BICUBIC)
+        try:
+            rotate, confidence = self._osd(gray, language)
+            return Orientation(rotate, confidence, "full", exif)
+        except OrientationError as e:
+            logger.debug(f"{image_path} 检测方向失败：{e}")
+        binary = cv2.adaptiveThreshold(
+            np.asarray(gray), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
+        )
+        try:
+            rotate, confidence = self._osd(Image.fromarray(binary), language)
+            return Orientation(rotate, confidence, "threshold", exif)
+        except OrientationError as e:
+            logger.debug(f"{image_path} 二值化后检测方向失败：{e}")
+        return None
+
+    def _osd(self, image, language):
+        """
+        :returns: (顺时针旋转角度, 把握)
+        :raises OrientationError: 无法判断方向
+        """
+        if tesserocr:
+            api = self._api()
+            api.SetImage(image)
+            osd = api.DetectOrientationScript()
+            if not osd:
+                raise OrientationError("文字太少")
+            # orient_deg 是文字相对正向逆时针转过的角度
+            return (360 - osd["orient_deg"]) % 360, osd["orient_conf"]
+        try:
+            osd = pytesseract.image_to_osd(image, lang=language, output_type=Output.DICT)
+        except pytesseract.TesseractError as e:
+            raise OrientationError(str(e)) from e
+        return osd["rotate"], osd["orientation_conf"]
+
+    def _api(self):
+        # tesseract 实例不是线程安全的，每个线程一个，线程结束前一直复用
+        api = getattr(self._local, "api", None)
+        if api is None:
+            api = tesserocr.PyTessBaseAPI(lang="osd", psm=tesserocr.PSM.OSD_ONLY)
+            self._local.api = api
+            with self._lock:
+                self._apis.append(api)
+        return api
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                "backend": self.backend,
+                "pages": total,
+                "stages": dict(self.counts),
+                "avg_ms": round(self.elapsed / total * 1000, 1) if total else None,
+            }
+
+    def close(self):
+        """
+        释放进程内的 tesseract 实例
+        """
+        with self._lock:
+            apis, self._apis = self._apis, []
+        for api in apis:
+            api.End()
+
+
+_orientation = None
+_orientation_lock = threading.Lock()
+
+
+def get_orientation():
+    """
+    获取进程内共享的图片方向校正器
+    """
+    global _orientation
+    if _orientation is None:
+        with _orientation_lock:
+            if _orientation is None:
+                _orientation = PageOrientation(
+                    max_edge=config.get("/book_ingest/orient_max_edge", 1600),
+                    min_confidence=config.get("/book_ingest/orient_min_confidence", 2.0),
+                )
+    return _orientation
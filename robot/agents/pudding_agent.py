@@ -18,10 +18,13 @@ from ruamel.yaml.compat import StringIO
 import json
 import re
 import tiktoken
-import sqlite3
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-import threading
+
+from robot.Runtime import get_runtime
+from robot.agents import narration, sentence_stream
+from robot.agents.book_catalog import get_catalog
+from robot.agents.book_repository import get_repository
+from robot.agents.intent_matcher import get_intent_matcher
 
 
 def truncated_string(
@@ -68,108 +71,16 @@ def is_yaml(yaml_str):
     return True
 
 def get_all_books():
-    conn_book = sqlite3.connect('./story_db/picture_books.db')
-    cursor_book = conn_book.cursor()
-    # 执行查询
-    cursor_book.execute("SELECT id, cn_title FROM t_picture_book")
-
-    # 获取所有记录
-    rows = cursor_book.fetchall()
-
-    # 关闭连接
-    conn_book.commit()
-    cursor_book.close()
-    conn_book.close()
-
-    # 提取 cn_title 列
-    titles_with_ids = [(row[0], row[1]) for row in rows]
-    return titles_with_ids
+    return get_repository().get_all_books()
 
 def get_book_description_by_id(id):
-    conn_book = sqlite3.connect('./story_db/picture_books.db')
-    cursor_book = conn_book.cursor()
-
-    # 执行查询
-    cursor_book.execute('''
-    SELECT
-        t_picture_book.cn_title,
-        t_picture_book.en_title,
-        t_picture_book.cn_subtitle,
-        t_picture_book.en_subtitle,
-        t_picture_book.picture_content  
-    FROM
-        t_picture_book
-    WHERE
-        t_picture_book.id = ?
-    ''', (id,))
-
-    # 获取所有记录
-    row = cursor_book.fetchone()
-
-    # 关闭连接
-    cursor_book.close()
-    conn_book.close()
-
-    return row
+    return get_repository().get_book_description(id)
 
 def get_book_content_by_book_id(book_id):
-    conn_book = sqlite3.connect('./story_db/picture_books.db')
-    cursor_book = conn_book.cursor()
-
-    # 执行查询
-    cursor_book.execute('''
-    SELECT
-        t_picture_book_content.id,
-        t_picture_book_content.sequence,
-        t_picture_book_content.picture_content,
-        t_picture_book_content.sequence
-    FROM
-        t_picture_book_content
-    WHERE
-        t_picture_book_content.book_id = ?
-    ORDER BY
-        t_picture_book_content.sequence;
-    ''', (book_id,))
-
-    # 获取所有记录
-    rows = cursor_book.fetchall()
-
-    # 关闭连接
-    cursor_book.close()
-    conn_book.close()
-
-    return rows
+    return get_repository().get_book_contents(book_id)
 
 def get_book_text_by_content_id(content_id):
-    conn_book = sqlite3.connect('./story_db/picture_books.db')
-    cursor_book = conn_book.cursor()
-
-    # 执行查询
-    cursor_book.execute('''
-    SELECT
-        t_picture_book_text.id,
-        t_picture_book_text.language,
-        t_picture_book_text.text,
-        t_picture_book_text.type,
-        t_picture_book_text.character,
-        t_picture_book_text.character_category,
-        t_picture_book_text.sequence
-    FROM
-        t_picture_book_text
-    WHERE
-        t_picture_book_text.content_id = ?
-    ORDER BY
-        t_picture_book_text.sequence;
-    ''', (content_id,))
-
-    # 获取所有记录
-    rows = cursor_book.fetchall()
-
-    # 关闭连接
-    cursor_book.close()
-    conn_book.close()
-
-    return rows
+    return get_repository().get_book_texts(content_id)
 
 class TellStory(Action):
     name: str = "PlayMedia"
@@ -240,7 +151,7 @@ class TellStory(Action):
 
     run: ClassVar[callable]
 
-    def __init__(self, tts_callback, tts_callback_sync, tts_callback_with_priority, listen_callback, setStoryMode, set_book_id, set_book_content_id, set_book_content_sequence, set_book_content_text_id, set_book_content_text_sequence, **data: Any):
+    def __init__(self, tts_callback, tts_callback_sync, tts_callback_with_priority, listen_callback, setStoryMode, set_book_id, set_book_content_id, set_book_content_sequence, set_book_content_text_id, set_book_content_text_sequence, prefetch_callback=None, **data: Any):
         super().__init__(**data)
         self.tts_callback = tts_callback
         self.tts_callback_sync = tts_callback_sync
@@ -252,8 +163,7 @@ class TellStory(Action):
         self.set_book_content_sequence = set_book_content_sequence
         self.set_book_content_text_id = set_book_content_text_id
         self.set_book_content_text_sequence = set_book_content_text_sequence
-
-        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.prefetch_callback = prefetch_callback
 
         self.lock = asyncio.Lock()  # 用于控制朗读任务的锁
 
@@ -296,29 +206,15 @@ class TellStory(Action):
 
     def _run_async_in_thread(self, async_func, *args, **kwargs):
         """
-        在新线程中运行异步函数，并支持阻塞等待
-        :param async_func: 异步函数
+        在运行时的专用工作线程中运行异步函数，并阻塞等待其完成
+
+        在朗读线程的 onCompleted 中调用，不能与智能体共用常驻工作线程：
+        这些线程可能都被没有结束的 team.run 占着，朗读线程会一直等下去
+        :param async_func: 异步函数（其中有录音等阻塞调用）
         :param args: 异步函数的参数
         :param kwargs: 异步函数的关键字参数
         """
-
-        # 创建一个 Event 对象用于阻塞
-        event = threading.Event()
-
-        def run():
-            loop = asyncio.new_event_loop()  # 创建新的事件循环
-            asyncio.set_event_loop(loop)
-
-            # 运行异步函数，并在完成后设置 event
-            loop.run_until_complete(async_func(*args, **kwargs))
-            event.set()  # 当异步函数执行完，解除阻塞
-            loop.close()
-
-        # 启动新线程
-        threading.Thread(target=run).start()
-
-        # 阻塞直到异步函数完成
-        event.wait()
+        get_runtime().run_blocking(async_func(*args, **kwargs), group="question", pool="question")
 
     async def reply_for_question(self, question, cn_title, picture_discription, content_texts):
         logger.info(f"picture_discription:{picture_discription}-------------------------------------")
@@ -340,12 +236,17 @@ class TellStory(Action):
         yaml.preserve_quotes = True  # 尝试保留原始引号
         yaml.indent(mapping=2, sequence=4, offset=2)
 
-        open_book = ["现在我们翻开第一页", "现在我们翻开书", "小宝贝，来把书翻开", "让我们来打开第一页"]
-        next_page = ["让我们翻开下一页", "现在看看下一页讲了什么", "接下来我们来看下一页", "好了，来看下一页", "看看下一页讲什么"]
-        finish = ["现在，故事讲完了", "现在，就讲到这里吧", "好了，这个故事讲完了", "这本书就讲到这里吧", "就讲到这儿吧"]
-
-        book_description = get_book_description_by_id(book_id)
-        if book_description:
+        open_book = narration.OPEN_BOOK
+        next_page = narration.NEXT_PAGE
+        finish = narration.FINISH
+
+        # 一次查询加载整本绘本（封面、页面和文字）
+        book = get_repository().load_book(book_id)
+        if book:
+            book_description = book.description
+            # 后台预合成整本绘本的语音，播放时直接命中缓存
+            if self.prefetch_callback:
+                self.prefetch_callback(narration.book_segments(book, book_content_sequence))
             # 进入故事模式
             self.setStoryMode(True)
             self.set_book_id(book_id)
@@ -387,22 +288,23 @@ class TellStory(Action):
 
             first_page = True
 
-            book_contents = get_book_content_by_book_id(book_id)
+            book_contents = book.pages
             if book_contents:
                 for content in book_contents:
                     self.set_book_content_id(content[0])
                     self.set_book_content_sequence(content[3])
-                    # 获取绘本的文本内容
-                    book_content_texts = get_book_text_by_content_id(content[0])
+                    # 绘本的文本内容已随整本绘本一起加载，转成普通元组以保持提示词格式不变
+                    book_content_texts = [tuple(text) for text in content.texts]
 
                     logger.info(f"随机问题生成素材：{book_description[0]}，{content[2]}-----------------")
 
-                    # 生成随机问题
-                    loop = asyncio.get_event_loop()
-                    background_future = loop.run_in_executor(self.executor, asyncio.run,
-                                                             self.generate_random_question(book_description[0],
-                                                                                           content[2],
-                                                                                           book_content_texts))
+                    # 生成随机问题，在共享事件循环中进行，不受这里同步朗读调用的阻塞
+                    background_future = asyncio.wrap_future(
+                        get_runtime().submit(
+                            self.generate_random_question(book_description[0], content[2], book_content_texts),
+                            group="question",
+                        )
+                    )
 
                     if not first_page:
                         # 判断是否是打断后继续
@@ -523,10 +425,29 @@ class Gossip(Action):
     - 直接输出你的回复，绝对不要加上"{playmate}："作为前缀。输出不超过200个字符。
     """
 
-    def __init__(self, tts_callback_sync, listen_callback, **data: Any):
+    def __init__(self, tts_callback_sync, listen_callback, pipeline_callback=None, **data: Any):
         super().__init__(**data)
         self.tts_callback_sync = tts_callback_sync
         self.listen_callback = listen_callback
+        self.pipeline_callback = pipeline_callback
+
+    async def _reply(self, gossip_prompt):
+        """
+        生成回复并朗读，开启流式回复时边生成边朗读
+        """
+        if not sentence_stream.enabled():
+            rsp_gossip = await self._aask(gossip_prompt)
+            self.tts_callback_sync(rsp_gossip, volume=20, speed_ratio=0.9, character_category=-2, cache=False)
+            return rsp_gossip
+
+        stream = sentence_stream.SpeechStream(
+            lambda text: self.tts_callback_sync(text, volume=20, cache_play_silence_duration=0, speed_ratio=0.9, character_category=-2, cache=False),
+            prepare=self.pipeline_callback and (lambda text: self.pipeline_callback(text, speed_ratio=0.9, character_category=-2)),
+        )
+        rsp_gossip = await stream.ask(self.llm, gossip_prompt)
+        # 说完再听小宝贝说话
+        await asyncio.get_running_loop().run_in_executor(None, stream.wait)
+        return rsp_gossip
 
     async def run(self, context, nickname, playmate):
         pardon = [f"{nickname}你还在吗？", f"我没听清呢。", f"{nickname}你能再说一遍吗?"]
@@ -538,12 +459,10 @@ class Gossip(Action):
 
             logger.info(f"gossip 提示词：{gossip_prompt}")
 
-            rsp_gossip = await self._aask(gossip_prompt)
+            rsp_gossip = await self._reply(gossip_prompt)
 
             logger.info(rsp_gossip)
 
-            self.tts_callback_sync(rsp_gossip, volume=20, speed_ratio=0.9, character_category=-2, cache=False)
-
             answer = self.listen_callback(silent_count_threshold=40, recording_timeout=120, silent=False)
 
             if answer.strip():
@@ -636,30 +555,50 @@ class AnswerQuestion(Action):
 
     run: ClassVar[callable]
 
-    def __init__(self, tts_callback, tts_callback_with_priority, player_resume_callback, clearQueue_callback, **data: Any):
+    # 要换一本绘本时回答由 TellStory 之前的开场白朗读，这里不再边生成边朗读
+    SWITCH_BOOK_PATTERN: ClassVar[re.Pattern] = re.compile(r"switch_book[\"']?\s*:\s*[\"']?(true|True|yes)")
+
+    def __init__(self, tts_callback, tts_callback_with_priority, player_resume_callback, clearQueue_callback, tts_callback_sync=None, pipeline_callback=None, **data: Any):
         super().__init__(**data)
         self.tts_callback = tts_callback
         self.tts_callback_with_priority = tts_callback_with_priority
         self.player_resume_callback = player_resume_callback
         self.clearQueue_callback = clearQueue_callback
+        self.tts_callback_sync = tts_callback_sync
+        self.pipeline_callback = pipeline_callback
+
+    async def _answer(self, prompt):
+        """
+        请求大模型回答；开启流式回复时从 yaml 的 tips 字段边生成边朗读
+
+        :returns: (完整回复, SpeechStream)，没有边生成边朗读时 SpeechStream 为 None
+        """
+        if not sentence_stream.enabled() or self.tts_callback_sync is None:
+            return await self._aask(prompt), None
+
+        stream = sentence_stream.SpeechStream(
+            lambda text: self.tts_callback_sync(text, volume=20, cache_play_silence_duration=0, speed_ratio=0.8, emotion="happy", cache=False, append_history=False),
+            prepare=self.pipeline_callback and (lambda text: self.pipeline_callback(text, speed_ratio=0.8, emotion="happy")),
+            field="tips",
+            accept=lambda text: not self.SWITCH_BOOK_PATTERN.search(text),
+        )
+        return await stream.ask(self.llm, prompt), stream
 
     async def run(self, books, question, book_id, book_content_id, book_content_sequence, book_content_text_id, book_content_text_sequence):
         if question and question != "None":
-            book_description = get_book_description_by_id(book_id)
-            cn_title = book_description[0]
+            book = get_repository().load_book(book_id)
+            cn_title = book.description[0]
 
             contents = []
             current_picture_discription = ""
             current_content_texts = []
-            book_contents = get_book_content_by_book_id(book_id)
-            for book_content in book_contents:
+            for book_content in book.pages:
                 if book_content[1] <= book_content_sequence:
                     contents.append(f"第{book_content[3]}页图片内容：{book_content[2]}")
                 if book_content[0] == book_content_id:
                     current_picture_discription = book_content[2]
 
-                book_content_texts = get_book_text_by_content_id(book_content[0])
-                for book_content_text in book_content_texts:
+                for book_content_text in book_content.texts:
                     if book_content[1] <= book_content_sequence and book_content_text[6] <= book_content_text_sequence:
                         contents.append(f"第{book_content[3]}页文字内容：{book_content_text[2]}")
                     if book_content[0] == book_content_id and book_content_text[0] == book_content_text_id:
@@ -667,7 +606,7 @@ class AnswerQuestion(Action):
 
             prompt = self.ANSWER_PROMPT_TEMPLATE.format(years=4, books=books, audio="", cn_title=cn_title, contents=json.dumps(contents, ensure_ascii=False), current_picture_discription=current_picture_discription, current_content_texts=json.dumps(current_content_texts, ensure_ascii=False), question=question, nickname="小宝贝")
             logger.info(f"回答问题的Prompt：{prompt}")
-            rsp_answer = await self._aask(prompt)
+            rsp_answer, stream = await self._answer(prompt)
             logger.info(rsp_answer)
             rsp_result = parse_yaml_code(rsp_answer)
 
@@ -676,18 +615,28 @@ class AnswerQuestion(Action):
             yaml.indent(mapping=2, sequence=4, offset=2)
             data = yaml.load(rsp_result)
 
-            self.player_resume_callback()
+            if stream is not None and stream.sentences:
+                # 回答说完再继续讲绘本
+                await asyncio.get_running_loop().run_in_executor(None, stream.wait)
 
             if "switch_book" in data and data["switch_book"]:
                 self.clearQueue_callback()
                 self.player_resume_callback()
 
+                if stream is not None and stream.sentences and "tips" in data:
+                    # tips 在 switch_book 之前生成，已经朗读过了
+                    del data["tips"]
+                    buf = StringIO()
+                    yaml.dump(data, buf)
+                    rsp_result = buf.getvalue()
                 return rsp_result
             else:
                 self.player_resume_callback()
 
-                self.tts_callback_with_priority(data["tips"], volume=20, speed_ratio=0.8, emotion="happy", cache=False)
-                time.sleep(0.01)  # 休眠0.01秒，等待语音插入队列完成
+                if stream is None or not stream.sentences:
+                    # 没有边生成边朗读时，这里才朗读回答
+                    self.tts_callback_with_priority(data["tips"], volume=20, speed_ratio=0.8, emotion="happy", cache=False)
+                    time.sleep(0.01)  # 休眠0.01秒，等待语音插入队列完成
 
                 code_text = (f"""
                 next_step: {data["next_step"]}
@@ -757,7 +706,7 @@ class Actuator(Role):
     get_memories: ClassVar[callable]
     _think: ClassVar[callable]
 
-    def __init__(self, nickname, playmate, tts_callback, tts_callback_sync, tts_callback_with_priority, listen_callback, player_resume_callback, setStoryMode, clearQueue_callback, set_book_id, set_book_content_id, set_book_content_sequence, set_book_content_text_id, set_book_content_text_sequence, **kwargs):
+    def __init__(self, nickname, playmate, tts_callback, tts_callback_sync, tts_callback_with_priority, listen_callback, player_resume_callback, setStoryMode, clearQueue_callback, set_book_id, set_book_content_id, set_book_content_sequence, set_book_content_text_id, set_book_content_text_sequence, prefetch_callback=None, pipeline_callback=None, **kwargs):
         super().__init__(**kwargs)
 
         self.nickname = nickname
@@ -774,6 +723,8 @@ class Actuator(Role):
         self.set_book_content_sequence = set_book_content_sequence
         self.set_book_content_text_id = set_book_content_text_id
         self.set_book_content_text_sequence = set_book_content_text_sequence
+        self.prefetch_callback = prefetch_callback
+        self.pipeline_callback = pipeline_callback
 
         gpt4o_llm = Config.from_yaml_file(Path("config/gpt4o.yaml"))
         gpt4o_ca_llm = Config.from_yaml_file(Path("config/gpt4o_ca.yaml"))
@@ -786,10 +737,10 @@ class Actuator(Role):
         moonshot_8k_llm = Config.from_yaml_file(Path("config/moonshot_8k.yaml"))
 
         self._watch([Classify, AnswerQuestion, Gossip])
-        self.set_actions([Gossip(self.tts_callback_sync, self.listen_callback, config=doubao_lite_32k_llm),
-                          TellStory(self.tts_callback, self.tts_callback_sync, self.tts_callback_with_priority, self.listen_callback, self.setStoryMode, self.set_book_id, self.set_book_content_id, self.set_book_content_sequence, self.set_book_content_text_id, self.set_book_content_text_sequence, config=gpt4o_mini_llm),
+        self.set_actions([Gossip(self.tts_callback_sync, self.listen_callback, pipeline_callback=self.pipeline_callback, config=doubao_lite_32k_llm),
+                          TellStory(self.tts_callback, self.tts_callback_sync, self.tts_callback_with_priority, self.listen_callback, self.setStoryMode, self.set_book_id, self.set_book_content_id, self.set_book_content_sequence, self.set_book_content_text_id, self.set_book_content_text_sequence, prefetch_callback=self.prefetch_callback, config=gpt4o_mini_llm),
                           PlayMedia(config=gpt4o_mini_llm),
-                          AnswerQuestion(self.tts_callback, self.tts_callback_with_priority, self.player_resume_callback, self.clearQueue_callback, config=gpt4o_mini_llm),
+                          AnswerQuestion(self.tts_callback, self.tts_callback_with_priority, self.player_resume_callback, self.clearQueue_callback, tts_callback_sync=self.tts_callback_sync, pipeline_callback=self.pipeline_callback, config=gpt4o_mini_llm),
                           AskNewRequirement(self.tts_callback, self.listen_callback),
                           Speak(self.tts_callback),
                           ])
@@ -872,7 +823,7 @@ class Actuator(Role):
                             return msg
                         if "next_step" in msg and msg["next_step"] == 3:
                             # self.rc.todo = AnswerQuestion(self.tts_callback)
-                            books = get_all_books()
+                            books = get_catalog().prompt
 
                             question = ""
                             book_id = None
@@ -1035,10 +986,15 @@ class StoryBot(Role):
         self._watch([UserRequirement, AskNewRequirement])
         self.set_actions([Classify(config=gpt4o_mini_llm)])
 
+        # 启动时预加载绘本目录和书名索引
+        get_catalog()
+        get_intent_matcher()
+
     async def _act(self) -> Message:
         todo = self.rc.todo
 
-        books = get_all_books()
+        # 绘本目录常驻内存，这里不访问数据库
+        books = get_catalog().prompt
 
         book_id = None
         book_content_id = None
@@ -1073,8 +1029,15 @@ class StoryBot(Role):
                 msg = Message(content=code_text, role=self.name, cause_by=type(todo))
                 return msg
             else:
-                context_str = f'《{content["user_input"]}》,'
-                code_text = await todo.run(context_str, books, self.nickname, self.playmate)
+                # 明确的请求先在本地匹配，匹配不上再交给大模型
+                matcher = get_intent_matcher()
+                code_text = matcher.match(content["user_input"], self.playmate) if matcher else None
+                if code_text is None:
+                    context_str = f'《{content["user_input"]}》,'
+                    start = time.perf_counter()
+                    code_text = await todo.run(context_str, books, self.nickname, self.playmate)
+                    if matcher:
+                        matcher.stats.record_stage("llm", time.perf_counter() - start)
                 msg = Message(content=code_text, role=self.name, cause_by=type(todo))
                 return msg
         else:
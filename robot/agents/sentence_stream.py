@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+# 大模型边生成边朗读：流式输出按标点切句，每凑出一句就开始合成播放
+import collections
+import re
+import threading
+import time
+
+from metagpt.logs import LLM_STREAM_LISTENER
+
+from robot import config, logging, utils
+
+logger = logging.getLogger(__name__)
+
+# 小数点、千分位两边都是数字时不切分
+_NUMBER_MARKS = ".,"
+
+
+def enabled():
+    return config.get("/llm_stream/enable", True)
+
+
+def _length(text, punctuations):
+    return sum(1 for char in text if not char.isspace() and char not in punctuations)
+
+
+class SentenceSplitter(object):
+    """
+    把陆续到达的文字按 utils.getPunctuations() 切成句子
+
+    短于 min_chars 个字的小句（例如“好呀，”）与后一句合并，避免合成很多零碎的短句；
+    英文句点和逗号要等到下一个字到达，确认不是 3.5、1,000 这样的数字再切
+    """
+
+    def __init__(self, min_chars=6):
+        self.min_chars = min_chars
+        self.punctuations = set(utils.getPunctuations())
+        self._buf = ""
+
+    def feed(self, text):
+        """
+        :returns: 这次新凑出的完整句子列表
+        """
+        self._buf += text
+        buf = self._buf
+        sentences = []
+        start = 0
+        i = 0
+        while i < len(buf):
+            char = buf[i]
+            if char not in self.punctuations:
+                i += 1
+                continue
+            if char in _NUMBER_MARKS:
+                if i + 1 == len(buf):
+                    break
+                if i > 0 and buf[i - 1].isdigit() and buf[i + 1].isdigit():
+                    i += 1
+                    continue
+            # 连续的标点（“！！”“？\n”）归到同一句，标点在末尾时等下一个字
+            end = i + 1
+            while end < len(buf) and (buf[end] in self.punctuations or buf[end].isspace()):
+                end += 1
+            if end == len(buf):
+                break
+            if _length(buf[start:end], self.punctuations) >= self.min_chars:
+                sentences.append(buf[start:end].strip())
+                start = end
+            i = end
+        self._buf = buf[start:]
+        return sentences
+
+    def flush(self):
+        """
+        输出结束，剩下的文字作为最后一句
+        """
+        rest, self._buf = self._buf.strip(), ""
+        return [rest] if _length(rest, self.punctuations) else []
+
+
+class FieldStream(object):
+    """
+    从流式输出的 JSON（或 YAML）中逐步取出一个字符串字段的值
+
+    字段的值还没生成完时，已经解码出来的部分就可以交给 SentenceSplitter 朗读。
+    支持 JSON 字符串，YAML 的双引号、单引号、普通多行和 | > 块。
+    """
+
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self, field):
+        self.field = field
+        self._pattern = re.compile(
+            r'(?P<json>"%s"\s*:)|^(?P<indent>[ \t]*)%s[ \t]*:' % (re.escape(field), re.escape(field)),
+            re.M,
+        )
+        self.text = ""
+        self._pos = 0
+        self._state = "key"
+        self._json = False
+        self._indent = 0
+        self._fold = " "
+        self._continued = False
+        self._skip_space = False
+
+    @property
+    def done(self):
+        return self._state == "done"
+
+    def feed(self, text):
+        """
+        :returns: 这次新解码出的字段内容
+        """
+        self.text += text
+        out = []
+        while self._state != "done" and getattr(self, "_" + self._state)(out):
+            pass
+        return "".join(out)
+
+    # 以下每个状态处理尽量多的文字，需要等待更多输出时返回 False
+
+    def _key(self, out):
+        m = self._pattern.search(self.text)
+        if m is None:
+            return False
+        self._json = m.group("json") is not None
+        self._indent = 0 if self._json else len(m.group("indent").expandtabs())
+        self._pos = m.end()
+        self._state = "value"
+        return True
+
+    def _value(self, out):
+        text = self.text
+        while self._pos < len(text) and text[self._pos] in " \t" + ("\r\n" if self._json else ""):
+            self._pos += 1
+        if self._pos >= len(text):
+            return False
+        char = text[self._pos]
+        if char == '"':
+            self._pos += 1
+            self._state = "double"
+        elif self._json:
+            # null、数字等不是字符串的值
+            self._state = "done"
+        elif char == "'":
+            self._pos += 1
+            self._state = "single"
+        elif char in "|>":
+            newline = text.find("\n", self._pos)
+            if newline < 0:
+                return False
+            self._fold = "\n" if char == "|" else " "
+            self._pos = newline + 1
+            self._state = "line_start"
+        elif char in "\r\n":
+            # 值从下一行开始
+            self._pos += 1
+            self._fold = " "
+            self._state = "line_start"
+        else:
+            self._fold = " "
+            self._continued = True
+            self._state = "line"
+        return True
+
+    def _double(self, out):
+        text = self.text
+        while self._pos < len(text):
+            char = text[self._pos]
+            if self._skip_space and char in " \t":
+                self._pos += 1
+                continue
+            self._skip_space = False
+            if char == '"':
+                self._pos += 1
+                self._state = "done"
+                return False
+            if char == "\\":
+                if self._pos + 1 >= len(text):
+                    return False
+                escape = text[self._pos + 1]
+                if escape == "u":
+                    code = text[self._pos + 2 : self._pos + 6]
+                    if len(code) < 4:
+                        return False
+                    try:
+                        out.append(chr(int(code, 16)))
+                    except ValueError:
+                        out.append(code)
+                    self._pos += 6
+                    continue
+                out.append(self._ESCAPES.get(escape, escape))
+                self._pos += 2
+                continue
+            if char in "\r\n" and not self._json:
+                # YAML 引号内的换行折叠成空格
+                out.append(" ")
+                self._skip_space = True
+            else:
+                out.append(char)
+            self._pos += 1
+        return False
+
+    def _single(self, out):
+        text = self.text
+        while self._pos < len(text):
+            char = text[self._pos]
+            if char == "'":
+                if self._pos + 1 >= len(text):
+                    return False
+                if text[self._pos + 1] == "'":
+                    out.append("'")
+                    self._pos += 2
+                    continue
+                self._pos += 1
+                self._state = "done"
+                return False
+            out.append(" " if char in "\r\n" else char)
+            self._pos += 1
+        return False
+
+    def _line(self, out):
+        text = self.text
+        newline = text.find("\n", self._pos)
+        end = len(text) if newline < 0 else newline
+        out.append(text[self._pos : end].rstrip("\r"))
+        self._pos = end
+        if newline < 0:
+            return False
+        self._pos += 1
+        self._state = "line_start"
+        return True
+
+    def _line_start(self, out):
+        """
+        一行结束后看下一行的缩进：比字段更深的是值的延续，否则值结束了
+        """
+        text = self.text
+        pos = self._pos
+        while pos < len(text) and text[pos] in " \t":
+            pos += 1
+        if pos >= len(text):
+            return False
+        if text[pos] in "\r\n":
+            # 空行
+            out.append("\n")
+            self._pos = text.find("\n", pos) + 1 if "\n" in text[pos:] else len(text)
+            return True
+        if len(text[self._pos : pos].expandtabs()) <= self._indent or text.startswith("```", pos):
+            self._state = "done"
+            return False
+        if self._continued:
+            out.append(self._fold)
+        self._continued = True
+        self._pos = pos
+        self._state = "line"
+        return True
+
+
+class SpeechStream(object):
+    """
+    大模型边生成边朗读
+
+    token 陆续到达时切成句子，第一句凑齐就开始朗读，不用等整段回复生成完。
+    朗读在单独的线程中按顺序进行；某一句正在播放时，排在它后面的那一句先调用 prepare
+    发出合成请求，播放完上一句时下一句的音频已经在路上。
+    """
+
+    def __init__(self, speak, prepare=None, field=None, accept=None, min_chars=None):
+        """
+        :param speak: speak(sentence) 朗读一句话，阻塞到播放完
+        :param prepare: prepare(sentence) 提前合成一句话，参数与 speak 一致
+        :param field: 不为 None 时输出是 JSON/YAML，只朗读这个字段的值
+        :param accept: accept(已生成的全部文字)，返回 False 时不再朗读之后的句子（例如要换绘本）
+        :param min_chars: 短于这么多字的小句与后一句合并，默认使用配置 /llm_stream/min_chars
+        """
+        self.speak = speak
+        self.prepare = prepare
+        self.field = FieldStream(field) if field else None
+        self.accept = accept
+        if min_chars is None:
+            min_chars = config.get("/llm_stream/min_chars", 6)
+        self.splitter = SentenceSplitter(min_chars)
+        self.text = ""
+        self.sentences = []
+        self.muted = False
+        self._pending = collections.deque()
+        self._playing = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._start = time.monotonic()
+
+    async def ask(self, llm, prompt):
+        """
+        流式请求大模型，边生成边朗读
+
+        :returns: 完整的回复
+        """
+        self._start = time.monotonic()
+        token = LLM_STREAM_LISTENER.set(self.feed)
+        try:
+            return await llm.aask(prompt, stream=True)
+        finally:
+            LLM_STREAM_LISTENER.reset(token)
+            self.close()
+
+    def feed(self, token):
+        self.text += token
+        if self.field is not None:
+            token = self.field.feed(token)
+        self._enqueue(self.splitter.feed(token))
+
+    def close(self):
+        """
+        输出结束，朗读剩下的文字
+        """
+        self._enqueue(self.splitter.flush())
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        等所有句子都朗读完
+
+        :returns: 是否在超时前朗读完
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._closed and not self._pending and not self._playing, timeout
+            )
+
+    def _enqueue(self, sentences):
+        for sentence in sentences:
+            if self.muted or (self.accept and not self.accept(self.text)):
+                self.muted = True
+                return
+            if not self.sentences:
+                logger.info(f"开始生成后 {(time.monotonic() - self._start) * 1000:.0f} ms 朗读第一句：{sentence}")
+            self.sentences.append(sentence)
+            with self._cond:
+                self._pending.append(sentence)
+                # 上一句正在播放，这句就是下一句
+                ahead = self._playing and len(self._pending) == 1
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+                self._cond.notify_all()
+            if ahead and self.prepare:
+                self.prepare(sentence)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                sentence = self._pending.popleft()
+                following = self._pending[0] if self._pending else None
+                self._playing = True
+            try:
+                if following is not None and self.prepare:
+                    self.prepare(following)
+                self.speak(sentence)
+            except Exception as e:
+                logger.error(f"朗读失败：{sentence}，{e}", stack_info=True)
+            finally:
+                with self._cond:
+                    self._playing = False
+                    self._cond.notify_all()
@@ -12,6 +12,7 @@ DATA_PATH = os.path.join(APP_PATH, "static")
 TEMP_PATH = os.path.join(APP_PATH, "temp")
 TEMPLATE_PATH = os.path.join(APP_PATH, "server", "templates")
 PLUGIN_PATH = os.path.join(APP_PATH, "plugins")
+STORY_DB_PATH = os.path.join(APP_PATH, "story_db")
 DEFAULT_CONFIG_NAME = "default.yml"
 CUSTOM_CONFIG_NAME = "config.yml"
 
@@ -62,6 +63,16 @@ def getData(*fname):
     return os.path.join(DATA_PATH, *fname)
 
 
+def getStoryDB(fname="picture_books.db"):
+    """
+    获取绘本数据库的路径
+
+    :param fname: 数据库文件名，默认为 picture_books.db
+    :returns: 绘本数据库的存储路径
+    """
+    return os.path.join(STORY_DB_PATH, fname)
+
+
 def getDefaultConfigPath():
     return getData(DEFAULT_CONFIG_NAME)
 
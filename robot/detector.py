@@ -2,7 +2,7 @@ import time
 
 from snowboy import snowboydecoder
 import azure.cognitiveservices.speech as speechsdk
-from robot import config, logging, utils, constants
+from robot import config, logging, utils, constants, AudioInput, Vad
 
 logger = logging.getLogger(__name__)
 
@@ -105,6 +105,11 @@ def initDetector(wukong):
             detector.start(
                 detected_callback=callbacks,
                 audio_recorder_callback=wukong.conversation.converse,
+                audio_frame_callback=wukong.conversation.onRecordFrame,
+                vad=Vad.get_vad(sample_rate=detector.detector.SampleRate()),
+                audio_input=AudioInput.get_input(
+                    detector.detector.SampleRate(), detector.detector.NumChannels()
+                ),
                 interrupt_check=wukong._interrupt_callback,
                 silent_count_threshold=config.get("silent_threshold", 15),
                 recording_timeout=config.get("recording_timeout", 5) * 4,
@@ -11,8 +11,10 @@ import hmac
 
 import asyncio
 import base64
+import collections
 import gzip
 import json
+import threading
 import wave
 from enum import Enum
 from hashlib import sha256
@@ -24,6 +26,11 @@ import requests
 
 import time
 
+from robot import logging
+from robot.Runtime import get_runtime
+
+logger = logging.getLogger(__name__)
+
 PROTOCOL_VERSION = 0b0001
 DEFAULT_HEADER_SIZE = 0b0001
 
@@ -66,6 +73,8 @@ MESSAGE_SERIALIZATION_METHODS = {0: "no serialization", 1: "JSON", 15: "custom t
 MESSAGE_COMPRESSIONS = {0: "no compression", 1: "gzip", 15: "custom compression method"}
 
 default_header = bytearray(b'\x11\x10\x11\x00')
+# full client request 的固定包头（JSON + gzip），每次请求直接拼接
+FULL_REQUEST_HEADER = bytes(default_header)
 
 request_json = {
     "app": {
@@ -199,6 +208,8 @@ class AsrWsClient:
         :param config: config
         """
         self.audio_path = audio_path
+        # 内存中的音频数据，设置后不再读 audio_path
+        self.audio_data = kwargs.get("audio_data")
         self.cluster = cluster
         self.success_code = 1000  # success code, default is 1000
         self.seg_duration = int(kwargs.get("seg_duration", 15000))
@@ -330,14 +341,20 @@ class AsrWsClient:
         return result
 
     async def execute(self):
-        with open(self.audio_path, mode="rb") as _f:
-            data = _f.read()
-        audio_data = bytes(data)
+        if self.audio_data is not None:
+            audio_data = bytes(self.audio_data)
+        else:
+            with open(self.audio_path, mode="rb") as _f:
+                audio_data = _f.read()
         if self.format == "mp3":
             segment_size = self.mp3_seg_size
             return await self.segment_data_processor(audio_data, segment_size)
+        if self.format == "raw":
+            size_per_sec = self.channel * self.bits // 8 * self.rate
+            segment_size = int(size_per_sec * self.seg_duration / 1000)
+            return await self.segment_data_processor(audio_data, segment_size)
         if self.format != "wav":
-            raise Exception("format should in wav or mp3")
+            raise Exception("format should in wav, raw or mp3")
         nchannels, sampwidth, framerate, nframes, wav_len = read_wav_info(
             audio_data)
         size_per_sec = nchannels * sampwidth * framerate
@@ -345,6 +362,391 @@ class AsrWsClient:
         return await self.segment_data_processor(audio_data, segment_size)
 
 
+class AsrStreamSession(AsrWsClient):
+    """
+    流式语音识别：录音过程中把 PCM 帧直接送入已经打开的 websocket，
+    边说边返回识别结果，说完后只需等最后一包的识别结果
+
+    录音线程调用 feed() 送入音频帧，录音结束后调用 finish() 取得最终结果；
+    websocket 在共享运行时的事件循环中收发，创建时立即开始连接，握手与说话同时进行。
+    """
+
+    def __init__(self, cluster, on_partial=None, **kwargs):
+        """
+        :param on_partial: 识别结果变化时调用，参数为目前为止的识别文本
+        """
+        kwargs.setdefault("format", "raw")
+        kwargs.setdefault("codec", "raw")
+        super(AsrStreamSession, self).__init__(None, cluster, **kwargs)
+        self.on_partial = on_partial
+        self.text = ""
+        self.first_partial_time = None
+        # 队列在事件循环线程中第一次用到时创建
+        self._frames = None
+        self._loop = get_runtime().loop
+        self._future = asyncio.run_coroutine_threadsafe(self._run(), self._loop)
+        self._started = time.monotonic()
+
+    def feed(self, data):
+        """
+        送入一帧 PCM 音频（线程安全）
+        """
+        if not self._future.done():
+            self._loop.call_soon_threadsafe(self._put, bytes(data))
+
+    def finish(self, timeout=3):
+        """
+        录音结束，等待最终识别结果
+
+        :param timeout: 最多等待多少秒
+        :returns: 识别文本；识别失败或超时返回 None，调用方可以改用录音文件识别
+        """
+        self._loop.call_soon_threadsafe(self._put, None)
+        end = time.monotonic()
+        try:
+            text = self._future.result(timeout)
+            logger.info(f"流式识别完成，说完后 {(time.monotonic() - end) * 1000:.0f} ms 得到结果")
+            return text
+        except Exception as e:
+            logger.warning(f"流式识别失败：{e!r}")
+            self._future.cancel()
+            return None
+
+    def cancel(self):
+        """
+        放弃这次识别
+        """
+        self._future.cancel()
+
+    def _queue(self):
+        if self._frames is None:
+            self._frames = asyncio.Queue()
+        return self._frames
+
+    def _put(self, data):
+        self._queue().put_nowait(data)
+
+    def _audio_request(self, chunk, last):
+        payload_bytes = gzip.compress(chunk)
+        audio_only_request = bytearray(
+            generate_last_audio_default_header() if last else generate_audio_default_header()
+        )
+        audio_only_request.extend((len(payload_bytes)).to_bytes(4, 'big'))  # payload size(4 bytes)
+        audio_only_request.extend(payload_bytes)  # payload
+        return audio_only_request
+
+    async def _run(self):
+        request_params = self.construct_request(str(uuid.uuid4()))
+        payload_bytes = gzip.compress(str.encode(json.dumps(request_params)))
+        full_client_request = bytearray(generate_full_default_header())
+        full_client_request.extend((len(payload_bytes)).to_bytes(4, 'big'))  # payload size(4 bytes)
+        full_client_request.extend(payload_bytes)  # payload
+        header = self.token_auth() if self.auth_method == "token" else self.signature_auth(full_client_request)
+        async with websockets.connect(self.ws_url, extra_headers=header, max_size=1000000000) as ws:
+            await ws.send(full_client_request)
+            result = parse_response(await ws.recv())
+            if 'payload_msg' in result and result['payload_msg']['code'] != self.success_code:
+                raise RuntimeError(f"流式识别请求被拒绝：{result['payload_msg']}")
+            receiver = asyncio.ensure_future(self._receive(ws))
+            # 总是留住最新的一帧，录音结束时把它作为最后一包发送
+            pending = None
+            while True:
+                data = await self._queue().get()
+                if data is None:
+                    break
+                if pending is not None:
+                    await ws.send(self._audio_request(pending, False))
+                pending = data
+                if receiver.done():
+                    break
+            if not receiver.done():
+                await ws.send(self._audio_request(pending or b"", True))
+            return await receiver
+
+    async def _receive(self, ws):
+        while True:
+            result = parse_response(await ws.recv())
+            payload_msg = result.get('payload_msg')
+            if not payload_msg:
+                continue
+            code = payload_msg.get('code')
+            if code == 1013:
+                # No valid speeches found in input audio
+                return ""
+            if code != self.success_code:
+                raise RuntimeError(f"流式识别出错：{payload_msg}")
+            results = payload_msg.get('result') or []
+            text = results[0].get('text', "") if results else ""
+            if text and text != self.text:
+                if self.first_partial_time is None:
+                    self.first_partial_time = time.monotonic() - self._started
+                self.text = text
+                self.on_partial and self.on_partial(text)
+            if payload_msg.get('sequence', 0) < 0:
+                return self.text
+
+
+class TTSStopped(Exception):
+    """
+    流式合成被 stop_websocket_stream() 中止，已经收到的音频不完整
+    """
+
+
+def parse_tts_response(res):
+    """
+    解析一帧 TTS 服务端响应，不打印调试信息
+
+    :returns: (音频数据或 None, 是否结束, 错误信息或 None)
+    """
+    header_size = res[0] & 0x0f
+    message_type = res[1] >> 4
+    message_type_specific_flags = res[1] & 0x0f
+    message_compression = res[2] & 0x0f
+    payload = res[header_size * 4:]
+    if message_type == 0xb:  # audio-only server response
+        if message_type_specific_flags == 0:  # no sequence number as ACK
+            return None, False, None
+        sequence_number = int.from_bytes(payload[:4], "big", signed=True)
+        return payload[8:], sequence_number < 0, None
+    if message_type == 0xf:
+        code = int.from_bytes(payload[:4], "big", signed=False)
+        error_msg = payload[8:]
+        if message_compression == 1:
+            error_msg = gzip.decompress(error_msg)
+        return None, True, f"{code} {str(error_msg, 'utf-8')}"
+    if message_type == 0xc:  # frontend server response
+        return None, False, None
+    return None, True, f"undefined message type: {message_type}"
+
+
+class TTSStream(object):
+    """
+    一次合成请求的音频流
+
+    请求在连接池的事件循环中执行，音频块先放入缓冲区，调用方可以在任意事件循环中
+    用 async for 读取；请求可以在读取之前提前发出（流水线）。
+    """
+
+    def __init__(self, key=None):
+        self.key = key
+        self.future = None
+        self._chunks = collections.deque()
+        self._done = False
+        self._error = None
+        self._waiter = None
+        self._lock = threading.Lock()
+
+    def _notify(self):
+        with self._lock:
+            waiter = self._waiter
+        if waiter:
+            loop, event = waiter
+            loop.call_soon_threadsafe(event.set)
+
+    def put(self, chunk):
+        self._chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error=None):
+        # 只有第一次结束有效，cancel() 之后请求协程再结束不会覆盖结果
+        with self._lock:
+            if self._done:
+                return
+            self._error = error
+            self._done = True
+        self._notify()
+
+    @property
+    def done(self):
+        return self._done
+
+    def cancel(self):
+        """
+        放弃这次请求，正在使用的连接会被关闭
+        """
+        if self.future and not self._done:
+            self.future.cancel()
+        self.finish()
+
+    async def __aiter__(self):
+        event = asyncio.Event()
+        with self._lock:
+            self._waiter = (asyncio.get_running_loop(), event)
+        while True:
+            # 先清除事件再取数据，取数据期间到达的数据块会再次唤醒
+            event.clear()
+            while self._chunks:
+                yield self._chunks.popleft()
+            if self._done and not self._chunks:
+                if self._error:
+                    raise self._error
+                return
+            await event.wait()
+
+
+class TTSConnectionPool(object):
+    """
+    TTS websocket 连接池
+
+    - 连接在共享运行时的事件循环中建立和使用，调用方可以在任意线程、任意事件循环中使用
+    - 始终保持 size 个已完成 TLS 握手和鉴权的空闲连接，合成时不再等待握手
+    - 合成结束后连接放回池中复用；服务端不支持在同一连接上继续合成时，
+      自动改为每次使用新连接（仍然提前握手）
+    - 分别统计握手耗时和合成耗时
+    """
+
+    def __init__(self, url, token, size=2, idle_timeout=50):
+        """
+        :param url: websocket 地址
+        :param token: 鉴权 token
+        :param size: 保持的空闲连接数
+        :param idle_timeout: 空闲超过这么多秒的连接不再使用，避免用到已被服务端关闭的连接
+        """
+        self.url = url
+        self.headers = {"Authorization": f"Bearer; {token}"}
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.reuse = True
+        self._idle = collections.deque()
+        self._connecting = 0
+        self.handshakes = 0
+        self.handshake_time = 0.0
+        self.requests = 0
+        self.completed = 0
+        self.reused = 0
+        self.reuse_failures = 0
+        self.errors = 0
+        self.first_chunk_time = 0.0
+        self.synthesis_time = 0.0
+
+    def warm(self):
+        """
+        提前建立空闲连接
+        """
+        asyncio.run_coroutine_threadsafe(self._warm(), get_runtime().loop)
+
+    def submit(self, request, key=None):
+        """
+        发出一次合成请求，立即返回
+
+        :param request: 完整的 full client request 二进制数据
+        :returns: TTSStream
+        """
+        stream = TTSStream(key)
+        stream.future = asyncio.run_coroutine_threadsafe(
+            self._request(request, stream), get_runtime().loop
+        )
+        return stream
+
+    async def _connect(self):
+        start = time.monotonic()
+        ws = await websockets.connect(
+            self.url, extra_headers=self.headers, ping_interval=None, max_size=None
+        )
+        self.handshakes += 1
+        self.handshake_time += time.monotonic() - start
+        return ws
+
+    async def _warm(self):
+        while len(self._idle) + self._connecting < self.size:
+            self._connecting += 1
+            try:
+                ws = await self._connect()
+                self._idle.append((ws, time.monotonic(), False))
+            except Exception as e:
+                logger.warning(f"TTS 连接预热失败：{e}")
+                return
+            finally:
+                self._connecting -= 1
+
+    async def _acquire(self):
+        """
+        :returns: (连接, 是否曾经合成过)
+        """
+        now = time.monotonic()
+        while self._idle:
+            ws, released, used = self._idle.popleft()
+            if ws.open and now - released < self.idle_timeout:
+                return ws, used
+            asyncio.ensure_future(ws.close())
+        return await self._connect(), False
+
+    def _release(self, ws, reusable):
+        if reusable and self.reuse and ws.open:
+            self._idle.append((ws, time.monotonic(), True))
+        else:
+            asyncio.ensure_future(ws.close())
+
+    async def _request(self, request, stream):
+        self.requests += 1
+        for attempt in range(2):
+            ws, used = None, False
+            received = False
+            start = time.monotonic()
+            # 建立连接失败、被取消等任何情况都要结束 stream，否则读取方会一直等待
+            try:
+                ws, used = await self._acquire()
+                if used:
+                    self.reused += 1
+                # 补足空闲连接，下一句不用等握手
+                asyncio.ensure_future(self._warm())
+                start = time.monotonic()
+                await ws.send(request)
+                while True:
+                    chunk, done, error = parse_tts_response(await ws.recv())
+                    if error:
+                        raise RuntimeError(f"TTS 服务端错误：{error}")
+                    if chunk:
+                        if not received:
+                            self.first_chunk_time += time.monotonic() - start
+                        received = True
+                        stream.put(chunk)
+                    if done:
+                        break
+            except websockets.ConnectionClosed as e:
+                if ws is not None:
+                    await ws.close()
+                if used and not received and attempt == 0:
+                    # 服务端在上一次合成后关闭了连接，换一个新连接重试，以后不再复用
+                    self.reuse_failures += 1
+                    if self.reuse:
+                        logger.info("TTS 服务端不支持连接复用，改为每次使用预先握手的新连接")
+                        self.reuse = False
+                    continue
+                self.errors += 1
+                stream.finish(e)
+                return
+            except asyncio.CancelledError:
+                stream.finish(TTSStopped("TTS 请求被取消"))
+                if ws is not None:
+                    await ws.close()
+                raise
+            except Exception as e:
+                self.errors += 1
+                stream.finish(e)
+                if ws is not None:
+                    await ws.close()
+                return
+            self.completed += 1
+            self.synthesis_time += time.monotonic() - start
+            self._release(ws, True)
+            stream.finish()
+            return
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "completed": self.completed,
+            "handshakes": self.handshakes,
+            "reused": self.reused,
+            "reuse_failures": self.reuse_failures,
+            "errors": self.errors,
+            "handshake_ms": round(self.handshake_time / self.handshakes * 1000, 1) if self.handshakes else None,
+            "first_chunk_ms": round(self.first_chunk_time / self.completed * 1000, 1) if self.completed else None,
+            "synthesis_ms": round(self.synthesis_time / self.completed * 1000, 1) if self.completed else None,
+        }
+
+
 # 字节跳动火山引擎TTS请求
 class volcSpeech(object):
     __slots__ = (
@@ -356,12 +758,26 @@ class volcSpeech(object):
         "HOST",
         "API_URL_WS",
         "API_URL_HTTP",
-        "STOP"
+        "STOP",
+        "POOL",
+        "PIPELINED",
+        "ACTIVE",
+        "LOCK",
     )
 
-    def __init__(self, APPID, TOKEN, CLUSTER, ASR_CLUSTER, VOICE_TYPE, HOST, API_URL_WS, API_URL_HTTP):
+    # 最多提前发出的请求数
+    MAX_PIPELINED = 2
+
+    def __init__(self, APPID, TOKEN, CLUSTER, ASR_CLUSTER, VOICE_TYPE, HOST, API_URL_WS, API_URL_HTTP, pool_size=2, idle_timeout=50):
         self.APPID, self.TOKEN, self.CLUSTER, self.ASR_CLUSTER, self.VOICE_TYPE, self.HOST, self.API_URL_WS, self.API_URL_HTTP = APPID, TOKEN, CLUSTER, ASR_CLUSTER, VOICE_TYPE, HOST, API_URL_WS, API_URL_HTTP
-        self.STOP = False
+        # 停止代数：stop_websocket_stream() 每调用一次加一，只中止在此之前开始的合成
+        self.STOP = 0
+        # websocket 连接池，第一次合成时才建立连接
+        self.POOL = TTSConnectionPool(API_URL_WS, TOKEN, pool_size, idle_timeout)
+        self.PIPELINED = collections.OrderedDict()
+        self.ACTIVE = set()
+        # PIPELINED 和 ACTIVE 会被合成线程、SpeechStream 的预合成线程和打断线程同时修改
+        self.LOCK = threading.Lock()
 
     @property
     def appid(self):
@@ -619,89 +1035,110 @@ class volcSpeech(object):
         # return voice_type
         return "BV700_streaming"
 
-    async def tts_ws(self, phrase, silent=125, speed_ratio=1.0, emotion="happy", character_category=-1, operation="query"):
-        submit_request_json = copy.deepcopy(request_json)
-        submit_request_json["app"]["appid"] = self.APPID
-        submit_request_json["app"]["token"] = self.TOKEN
-        submit_request_json["app"]["cluster"] = self.CLUSTER
-        submit_request_json["audio"]["voice_type"] = self._get_voice_type(character_category)
-        submit_request_json["audio"]["speed_ratio"] = speed_ratio
-        submit_request_json["audio"]["emotion"] = emotion
-        submit_request_json["request"]["reqid"] = str(uuid.uuid4())
-        submit_request_json["request"]["text"] = phrase
-        submit_request_json["request"]["operation"] = operation
-        submit_request_json["request"]["silence_duration"] = silent
-
-        # 构建请求并压缩
-        payload_bytes = str.encode(json.dumps(submit_request_json))
-        payload_bytes = gzip.compress(payload_bytes)
+    def _build_request(self, phrase, silent, speed_ratio, emotion, character_category, operation, encoding):
+        """
+        构建 full client request：直接构造请求字典（不再深拷贝模板），拼接固定包头
+        """
+        submit_request_json = {
+            "app": {"appid": self.APPID, "token": self.TOKEN, "cluster": self.CLUSTER},
+            "user": request_json["user"],
+            "audio": {
+                "voice_type": self._get_voice_type(character_category),
+                "encoding": encoding,
+                "speed_ratio": speed_ratio,
+                "volume_ratio": 1.0,
+                "pitch_ratio": 1.0,
+                "emotion": emotion,
+            },
+            "request": {
+                "reqid": str(uuid.uuid4()),
+                "text": phrase,
+                "text_type": "plain",
+                "operation": operation,
+                "silence_duration": silent,
+            },
+        }
+        payload_bytes = gzip.compress(json.dumps(submit_request_json).encode("utf-8"))
+        return FULL_REQUEST_HEADER + len(payload_bytes).to_bytes(4, "big") + payload_bytes
 
-        # 准备发送请求
-        full_client_request = bytearray(default_header)
-        full_client_request.extend((len(payload_bytes)).to_bytes(4, 'big'))  # payload size(4 bytes)
-        full_client_request.extend(payload_bytes)  # payload
+    def _request_key(self, phrase, silent, speed_ratio, emotion, character_category, operation, encoding):
+        return (phrase, silent, speed_ratio, emotion, self._get_voice_type(character_category), operation, encoding)
 
+    def _submit(self, phrase, silent, speed_ratio, emotion, character_category, operation, encoding):
+        """
+        优先使用已经提前发出的同一请求，否则立即发出
+        """
+        key = self._request_key(phrase, silent, speed_ratio, emotion, character_category, operation, encoding)
+        with self.LOCK:
+            stream = self.PIPELINED.pop(key, None)
+        if stream is None:
+            stream = self.POOL.submit(
+                self._build_request(phrase, silent, speed_ratio, emotion, character_category, operation, encoding), key
+            )
+        return stream
+
+    def pipeline(self, phrase, silent=125, speed_ratio=1.0, emotion="happy", character_category=-1, operation="submit"):
+        """
+        在当前句子还在合成或播放时提前发出下一句的流式合成请求，音频先缓存在内存中，
+        之后以相同参数调用 tts_ws_stream 时直接读取
+        """
+        key = self._request_key(phrase, silent, speed_ratio, emotion, character_category, operation, "pcm")
+        stale = []
+        with self.LOCK:
+            if key in self.PIPELINED:
+                return
+            self.PIPELINED[key] = self.POOL.submit(
+                self._build_request(phrase, silent, speed_ratio, emotion, character_category, operation, "pcm"), key
+            )
+            while len(self.PIPELINED) > self.MAX_PIPELINED:
+                stale.append(self.PIPELINED.popitem(last=False)[1])
+        for stream in stale:
+            stream.cancel()
 
-        # WebSocket 连接和数据接收
-        header = {"Authorization": f"Bearer; {self.TOKEN}"}
+    async def tts_ws(self, phrase, silent=125, speed_ratio=1.0, emotion="happy", character_category=-1, operation="query"):
         audio_data = BytesIO()  # 用于存储音频数据
 
-        self.STOP = False
+        stop = self.STOP
 
         start = time.time()
-        async with websockets.connect(self.API_URL_WS, extra_headers=header, ping_interval=None) as ws:
-            await ws.send(full_client_request)
-            while True:
-                res = await ws.recv()
-                done = self.parse_response(res, audio_data)
-                if done:
-                    break
-                if self.STOP:
+        stream = self._submit(phrase, silent, speed_ratio, emotion, character_category, operation, "mp3")
+        with self.LOCK:
+            self.ACTIVE.add(stream)
+        try:
+            async for audio_chunk in stream:
+                audio_data.write(audio_chunk)
+                if self.STOP != stop:
                     break
+        finally:
+            with self.LOCK:
+                self.ACTIVE.discard(stream)
+            stream.cancel()
         print('tts_stream Time elapsed:', round(time.time() - start, 3))
         # 返回音频数据
         return audio_data
 
     async def tts_ws_stream(self, phrase, silent=125, speed_ratio=1.0, emotion="happy", character_category=-1, operation="submit"):
-        submit_request_json = copy.deepcopy(request_json)
-        submit_request_json["app"]["appid"] = self.APPID
-        submit_request_json["app"]["token"] = self.TOKEN
-        submit_request_json["app"]["cluster"] = self.CLUSTER
-        submit_request_json["audio"]["voice_type"] = self._get_voice_type(character_category)
-        submit_request_json["audio"]["speed_ratio"] = speed_ratio
-        submit_request_json["audio"]["emotion"] = emotion
-        submit_request_json["audio"]["encoding"] = "pcm"
-        submit_request_json["request"]["reqid"] = str(uuid.uuid4())
-        submit_request_json["request"]["text"] = phrase
-        submit_request_json["request"]["operation"] = operation
-        submit_request_json["request"]["silence_duration"] = silent
-
-        # 构建请求并压缩
-        payload_bytes = str.encode(json.dumps(submit_request_json))
-        payload_bytes = gzip.compress(payload_bytes)
-
-        # 准备发送请求
-        full_client_request = bytearray(default_header)
-        full_client_request.extend((len(payload_bytes)).to_bytes(4, 'big'))  # payload size(4 bytes)
-        full_client_request.extend(payload_bytes)  # payload
-
-        # WebSocket 连接和数据接收
-        header = {"Authorization": f"Bearer; {self.TOKEN}"}
-
-        self.STOP = False
-
-        start = time.time()
-        async with websockets.connect(self.API_URL_WS, extra_headers=header, ping_interval=None) as ws:
-            await ws.send(full_client_request)
-            while not self.STOP:
-                res = await ws.recv()
-                audio_chunk, done = self.parse_response_stream(res)
-
-                if audio_chunk:  # 如果有音频数据块
-                    yield audio_chunk  # 返回音频数据块
-
-                if done:
+        stop = self.STOP
+
+        stream = self._submit(phrase, silent, speed_ratio, emotion, character_category, operation, "pcm")
+        with self.LOCK:
+            self.ACTIVE.add(stream)
+        try:
+            async for audio_chunk in stream:
+                if self.STOP != stop:
                     break
+                yield audio_chunk  # 返回音频数据块
+            if self.STOP != stop:
+                # 被中止的合成不完整，不能当作正常结束（否则会被写入缓存）
+                raise TTSStopped(phrase)
+        finally:
+            with self.LOCK:
+                self.ACTIVE.discard(stream)
+            # 提前结束时放弃请求，正在使用的连接会被关闭
+            stream.cancel()
+
+    def stats(self):
+        return self.POOL.stats()
 
     def TTS(self, phrase, silent=125, speed_ratio=1.0, emotion="happy", character_category=-1):
         header = {"Authorization": f"Bearer; {self.TOKEN}"}
@@ -728,7 +1165,13 @@ class volcSpeech(object):
             return data
 
     def stop_websocket_stream(self):
-        self.STOP = True
+        self.STOP += 1
+        # 正在进行和提前发出的请求一并放弃
+        with self.LOCK:
+            streams = list(self.ACTIVE) + list(self.PIPELINED.values())
+            self.PIPELINED.clear()
+        for stream in streams:
+            stream.cancel()
 
 
     def execute_one(self, audio_item, cluster, **kwargs):
@@ -749,10 +1192,31 @@ class volcSpeech(object):
             audio_type=audio_type,
             **kwargs
         )
-        result = asyncio.run(asr_http_client.execute())
+        result = get_runtime().run(asr_http_client.execute())
         return {"id": audio_id, "path": audio_path, "result": result}
 
-    def ASR(self, audio_path, audio_format):
+    def ASR_stream(self, on_partial=None, sample_rate=16000):
+        """
+        开始一次流式识别
+
+        :returns: AsrStreamSession，录音时调用 feed()，结束后调用 finish()
+        """
+        return AsrStreamSession(
+            self.ASR_CLUSTER,
+            on_partial=on_partial,
+            appid=self.APPID,
+            token=self.TOKEN,
+            sample_rate=sample_rate,
+        )
+
+    def ASR(self, audio_path, audio_format, audio_data=None, sample_rate=16000):
+        """
+        识别一段录音
+
+        :param audio_path: 音频文件路径，传入 audio_data 时只用于日志
+        :param audio_format: wav、mp3 或 raw（16 位单声道 PCM）
+        :param audio_data: 内存中的音频数据，不为 None 时不读文件
+        """
         result = self.execute_one(
             {
                 'id': 1,
@@ -762,5 +1226,7 @@ class volcSpeech(object):
             appid=self.APPID,
             token=self.TOKEN,
             format=audio_format,
+            audio_data=audio_data,
+            sample_rate=sample_rate,
         )
         return result
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import socket
+import unittest
+from unittest import mock
+
+from robot.Runtime import Runtime
+from robot.sdk import VolcSpeech
+
+
+def _refused_url():
+    # 绑定后立即关闭，得到一个没有服务监听的端口
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f"ws://127.0.0.1:{port}/"
+
+
+class TTSConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.runtime = Runtime(workers=1, agent_workers=1)
+        patcher = mock.patch.object(VolcSpeech, "get_runtime", return_value=self.runtime)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.runtime.shutdown)
+
+    def test_refused_connection_ends_stream_with_error(self):
+        pool = VolcSpeech.TTSConnectionPool(_refused_url(), "token", size=1)
+        stream = pool.submit(b"request")
+
+        async def read():
+            async for _ in stream:
+                pass
+
+        with self.assertRaises(OSError):
+            asyncio.run(asyncio.wait_for(read(), 5))
+        self.assertTrue(stream.done)
+        self.assertEqual(pool.stats()["errors"], 1)
+
+    def test_cancel_ends_stream(self):
+        pool = VolcSpeech.TTSConnectionPool(_refused_url(), "token", size=1)
+        stream = pool.submit(b"request")
+        stream.cancel()
+
+        async def read():
+            return [chunk async for chunk in stream]
+
+        self.assertEqual(asyncio.run(asyncio.wait_for(read(), 5)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,10 +8,9 @@ import re
 import time
 import json
 import yaml
-import hashlib
-import subprocess
 from . import constants, config
 from robot import logging
+from robot.VoiceCache import VoiceCache, get_cache
 from pydub import AudioSegment
 from pytz import timezone
 import _thread as thread
@@ -259,55 +258,18 @@ def getTimemStap():
     return str(time.time()).replace(".", "")
 
 
-def getCache(msg):
-    """获取缓存的语音"""
-    md5 = hashlib.md5(msg.encode("utf-8")).hexdigest()
-    cache_paths = [
-        os.path.join(constants.TEMP_PATH, md5 + ext)
-        for ext in [".mp3", ".wav", ".asiff"]
-    ]
-    return next((path for path in cache_paths if os.path.exists(path)), None)
-
-async def getCache_async(msg):
-    """获取缓存的语音"""
-    md5 = hashlib.md5(msg.encode("utf-8")).hexdigest()
-    cache_paths = [
-        os.path.join(constants.TEMP_PATH, md5 + ext)
-        for ext in [".mp3", ".wav", ".asiff"]
-    ]
-    return next((path for path in cache_paths if os.path.exists(path)), None)
-
-
-def saveCache(voice, msg):
-    """获取缓存的语音"""
-    _, ext = os.path.splitext(voice)
-    md5 = hashlib.md5(msg.encode("utf-8")).hexdigest()
-    target = os.path.join(constants.TEMP_PATH, md5 + ext)
-    shutil.copyfile(voice, target)
-    return target
-
-def saveHttpVoiceCache(voice, msg):
-    """将音频流缓存到文件中，并调整音量"""
-    md5 = hashlib.md5(msg.encode("utf-8")).hexdigest()
-    target = os.path.join(constants.TEMP_PATH, f"{md5}.mp3")
-
-    # 读取 MP3 流
-    audio = AudioSegment.from_file(voice, format="mp3")
+def getCacheKey(msg, voice_type=None, speed_ratio=None, emotion=None):
+    """
+    计算缓存语音的键
 
-    # # 计算增益（以分贝为单位）
-    # if volume == 0:
-    #     gain_dB = -float('inf')  # 静音
-    # else:
-    #     gain_dB = 20 * math.log10(volume / 100.0)  # 根据百分比计算分贝增益
-    #
-    # # 调整音量
-    # adjusted_audio = audio.apply_gain(gain_dB)
+    同一段文字用不同的发音人、语速或情感合成出来的语音不同，这些参数都参与计算
+    """
+    return VoiceCache.make_key(msg, voice_type, speed_ratio, emotion)
 
-    # 将调整后的音频写回 MP3 文件
-    with open(target, 'wb') as f:
-        audio.export(f, format="mp3")
 
-    return target
+def getCache(msg, **voice):
+    """获取缓存的语音"""
+    return get_cache().get(msg, **voice)
 
 
 def saveToFile(voice, msg):
@@ -323,55 +285,29 @@ def saveToFile(voice, msg):
 
     return target
 
-def saveWsVoiceCache(voice_stream, msg):
-    """将音频流缓存到文件中，并调整音量"""
-    md5 = hashlib.md5(msg.encode("utf-8")).hexdigest()
-    target = os.path.join(constants.TEMP_PATH, f"{md5}.mp3")
-
-    # 读取 MP3 流
-    voice_stream.seek(0)
-    audio = AudioSegment.from_file(voice_stream, format="mp3")
-
-    # # 计算增益（以分贝为单位）
-    # if volume == 0:
-    #     gain_dB = -float('inf')  # 静音
-    # else:
-    #     gain_dB = 20 * math.log10(volume / 100.0)  # 根据百分比计算分贝增益
-    #
-    # # 调整音量
-    # adjusted_audio = audio.apply_gain(gain_dB)
-
-    # 将调整后的音频写回 MP3 文件
-    with open(target, 'wb') as f:
-        audio.export(f, format="mp3")
-
-    return target
-
-
-async def saveWsStreamVoiceCache(pcm_chunks, msg):
-    """将流式 PCM 音频数据缓存为 MP3 文件"""
 
-    # 生成缓存文件的路径（以 MD5 hash 为文件名）
-    md5 = hashlib.md5(msg.encode("utf-8")).hexdigest()
-    target_wav = os.path.join(constants.TEMP_PATH, f"{md5}.wav")
-    target_mp3 = os.path.join(constants.TEMP_PATH, f"{md5}.mp3")
+async def saveWsStreamVoiceCache(pcm_chunks, msg, **voice):
+    """将流式 PCM 音频数据原样写入语音缓存"""
+    return get_cache().put_pcm(pcm_chunks, msg, **voice)
 
-    # 将所有 PCM 音频块写入一个 WAV 文件
-    with wave.open(target_wav, 'wb') as wav_file:
-        wav_file.setnchannels(1)  # 单声道
-        wav_file.setsampwidth(2)  # 16-bit PCM
-        wav_file.setframerate(24000)  # 设置采样率 (通常是 16kHz)
-        for chunk in pcm_chunks:
-            wav_file.writeframes(chunk)
 
-    # 读取 WAV 文件并转换为 MP3
-    audio = AudioSegment.from_wav(target_wav)
-    audio.export(target_mp3, format="mp3")
-
-    check_and_delete(target_wav)
-
-    # 返回 MP3 文件路径
-    return target_mp3
+def saveVoiceFileCache(voice, msg, **voice_params):
+    """
+    将合成好的语音文件解码成 PCM 写入语音缓存，与流式合成的缓存使用同一种编码，
+    getCache 才能查到；原文件随后删除
+    """
+    # 缓存的 PCM 只按单声道 16 位播放，其他声道数、位深先转换
+    audio = AudioSegment.from_file(voice).set_channels(1).set_sample_width(2)
+    path = get_cache().put_pcm(
+        [audio.raw_data],
+        msg,
+        sample_rate=audio.frame_rate,
+        channels=audio.channels,
+        sample_width=audio.sample_width,
+        **voice_params,
+    )
+    os.remove(voice)
+    return path
 
 
 def lruCache():
@@ -380,11 +316,7 @@ def lruCache():
     def run(*args):
         if config.get("/lru_cache/enable", True):
             days = config.get("/lru_cache/days", 7)
-            subprocess.run(
-                'find . -name "*.mp3" -atime +%d -exec rm {} \;' % days,
-                cwd=constants.TEMP_PATH,
-                shell=True,
-            )
+            get_cache().evict(max_age=days * 24 * 3600)
 
     thread.start_new_thread(run, ())
 
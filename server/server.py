@@ -19,7 +19,8 @@ from tornado.websocket import WebSocketHandler
 from urllib.parse import unquote
 
 from robot.sdk.History import History
-from robot import config, utils, logging, Updater, constants
+from robot import config, utils, logging, Updater, constants, Vad, VoiceCache
+from robot.agents import intent_matcher
 from tools import make_json, solr_tools
 
 logger = logging.getLogger(__name__)
@@ -229,6 +230,29 @@ class GetLogHandler(BaseHandler):
         self.finish()
 
 
+class MetricsHandler(BaseHandler):
+    def get(self):
+        if not self.validate(self.get_argument("validate", default=None)):
+            res = {"code": 1, "message": "illegal visit"}
+        else:
+            res = {
+                "code": 0,
+                "message": "ok",
+                "intent": intent_matcher.get_stats(),
+                "tts_cache": VoiceCache.get_stats(),
+                "speech": conversation.speech.stats() if conversation else None,
+                "tts_ws": conversation.tts.get_stats() if conversation else None,
+                "tts_pipeline": conversation.synthesis.stats() if conversation else None,
+                "runtime": conversation.runtime.stats() if conversation else None,
+                "vad": Vad.get_stats(),
+                "barge_in": conversation.barge_in.stats()
+                if conversation and conversation.barge_in
+                else None,
+            }
+        self.write(json.dumps(res, ensure_ascii=False))
+        self.finish()
+
+
 class LogPageHandler(BaseHandler):
     def get(self):
         if not self.isValidated():
@@ -455,6 +479,7 @@ application = tornado.web.Application(
         (r"/operate", OperateHandler),
         (r"/logpage", LogPageHandler),
         (r"/log", GetLogHandler),
+        (r"/metrics", MetricsHandler),
         (r"/logout", LogoutHandler),
         (r"/api", APIHandler),
         (r"/qa", QAHandler),
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
-import collections
 import pyaudio
+import threading
 from . import snowboydetect
 from robot import utils, logging
 import time
@@ -19,6 +19,10 @@ RESOURCE_FILE = os.path.join(TOP_DIR, "resources/common.res")
 DETECT_DING = os.path.join(TOP_DIR, "resources/ding.wav")
 DETECT_DONG = os.path.join(TOP_DIR, "resources/dong.wav")
 
+# samples per PyAudio callback and per RunDetection() call, so that the
+# silence/recording counters always count frames of the same length
+FRAME_SAMPLES = 2048
+
 
 def py_error_handler(filename, line, function, err, fmt):
     pass
@@ -42,20 +46,69 @@ def no_alsa_error():
 
 
 class RingBuffer(object):
-    """Ring buffer to hold audio from PortAudio"""
+    """Ring buffer to hold audio from PortAudio.
+
+    The storage is a preallocated bytearray. The PortAudio callback appends
+    with `extend` and notifies a condition variable; the detection loop
+    blocks in `read` until a whole frame is available instead of polling.
+    When the reader falls behind, the oldest audio is overwritten.
+    """
 
     def __init__(self, size=4096):
-        self._buf = collections.deque(maxlen=size)
+        self._buf = bytearray(size)
+        self._size = size
+        self._start = 0
+        self._len = 0
+        self._cond = threading.Condition()
 
     def extend(self, data):
-        """Adds data to the end of buffer"""
-        self._buf.extend(data)
+        """Adds data to the end of buffer, wakes up a blocked reader"""
+        n = len(data)
+        with self._cond:
+            if n >= self._size:
+                data = data[n - self._size :]
+                n = self._size
+                self._start = 0
+                self._len = 0
+            end = (self._start + self._len) % self._size
+            first = min(n, self._size - end)
+            self._buf[end : end + first] = data[:first]
+            self._buf[: n - first] = data[first:]
+            overflow = self._len + n - self._size
+            if overflow > 0:
+                self._start = (self._start + overflow) % self._size
+                self._len -= overflow
+            self._len += n
+            self._cond.notify()
+
+    def read(self, n, timeout=None):
+        """Blocks until `n` bytes are available and removes them from the
+        beginning of buffer.
+
+        :param n: number of bytes to read.
+        :param timeout: maximum time in seconds to wait.
+        :return: `n` bytes, or b"" if the timeout expired first.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._len >= n, timeout):
+                return b""
+            first = min(n, self._size - self._start)
+            tmp = bytes(self._buf[self._start : self._start + first])
+            if n > first:
+                tmp += self._buf[: n - first]
+            self._start = (self._start + n) % self._size
+            self._len -= n
+            return tmp
 
     def get(self):
         """Retrieves data from the beginning of buffer and clears it"""
-        tmp = bytes(bytearray(self._buf))
-        self._buf.clear()
-        return tmp
+        with self._cond:
+            return self.read(self._len, 0)
+
+    def clear(self):
+        with self._cond:
+            self._start = 0
+            self._len = 0
 
 
 def play_audio_file(fname=DETECT_DING):
@@ -94,6 +147,9 @@ class ActiveListener(object):
         self.detector = snowboydetect.SnowboyDetect(
             resource_filename=resource.encode(), model_str=model_str.encode()
         )
+        self.frame_bytes = (
+            self.detector.NumChannels() * self.detector.BitsPerSample() // 8 * FRAME_SAMPLES
+        )
         self.ring_buffer = RingBuffer(
             self.detector.NumChannels() * self.detector.SampleRate() * 5
         )
@@ -104,6 +160,10 @@ class ActiveListener(object):
         sleep_time=0.03,
         silent_count_threshold=15,
         recording_timeout=100,
+        audio_frame_callback=None,
+        vad=None,
+        audio_input=None,
+        preroll_since=None,
     ):
         """
         :param interrupt_check: a function that returns True if the main loop
@@ -111,20 +171,44 @@ class ActiveListener(object):
         :param silent_count_threshold: indicates how long silence must be heard
                                        to mark the end of a phrase that is
                                        being recorded.
-        :param float sleep_time: how much time in second every loop waits.
+        :param float sleep_time: how long in seconds a read may block waiting
+                                 for audio before `interrupt_check` is
+                                 polled again.
         :param recording_timeout: limits the maximum length of a recording.
+        :param audio_frame_callback: if specified, called with every recorded
+                                     frame as it is captured (streaming ASR).
+        :param vad: if specified, an endpointer (see robot.Vad) whose
+                    `process(frame)` decides when the phrase has ended,
+                    instead of snowboy's silence status.
+        :param audio_input: if specified, a shared input (see robot.AudioInput)
+                            to read from instead of opening a new stream.
+        :param preroll_since: with `audio_input`, audio captured after this
+                              time.monotonic() value is prepended to the
+                              recording.
         :return: recorded file path
         """
-        DYNAMIC_SILENT_THRESHOLD = 4
-
         logger.debug("activeListen listen()")
 
         self._running = True
+        self.audio_input = audio_input
+
+        if audio_input is not None:
+            self.ring_buffer = audio_input.subscribe(preroll_since)
+            try:
+                return self._listen(
+                    interrupt_check,
+                    sleep_time,
+                    silent_count_threshold,
+                    recording_timeout,
+                    audio_frame_callback,
+                    vad,
+                )
+            finally:
+                audio_input.unsubscribe(self.ring_buffer)
 
         def audio_callback(in_data, frame_count, time_info, status):
             self.ring_buffer.extend(in_data)
-            play_data = chr(0) * len(in_data)
-            return play_data, pyaudio.paContinue
+            return None, pyaudio.paContinue
 
         with no_alsa_error():
             self.audio = pyaudio.PyAudio()
@@ -140,7 +224,7 @@ class ActiveListener(object):
                 ),
                 channels=self.detector.NumChannels(),
                 rate=self.detector.SampleRate(),
-                frames_per_buffer=2048,
+                frames_per_buffer=FRAME_SAMPLES,
                 stream_callback=audio_callback,
             )
         except Exception as e:
@@ -149,6 +233,26 @@ class ActiveListener(object):
 
         logger.debug("audio stream opened")
 
+        return self._listen(
+            interrupt_check,
+            sleep_time,
+            silent_count_threshold,
+            recording_timeout,
+            audio_frame_callback,
+            vad,
+        )
+
+    def _listen(
+        self,
+        interrupt_check,
+        sleep_time,
+        silent_count_threshold,
+        recording_timeout,
+        audio_frame_callback,
+        vad,
+    ):
+        DYNAMIC_SILENT_THRESHOLD = 4
+
         if interrupt_check():
             logger.debug("detect voice return")
             return
@@ -159,15 +263,15 @@ class ActiveListener(object):
         voice_detected = False  # 标志变量，记录是否检测到语音
 
         logger.debug("begin activeListen loop")
+        vad and vad.reset()
 
         while self._running is True:
 
             if interrupt_check():
                 logger.debug("detect voice break")
                 break
-            data = self.ring_buffer.get()
-            if len(data) == 0:
-                time.sleep(sleep_time)
+            data = self.ring_buffer.read(self.frame_bytes, sleep_time)
+            if not data:
                 continue
 
             status = self.detector.RunDetection(data)
@@ -177,6 +281,8 @@ class ActiveListener(object):
             stopRecording = False
             if recordingCount > recording_timeout:
                 stopRecording = True
+            elif vad is not None:
+                stopRecording = vad.process(data)
             elif status == -2:  # silence found
                 if silentCount > dynamic_silent_threshold:
                     stopRecording = True
@@ -195,8 +301,8 @@ class ActiveListener(object):
 
             recordingCount = recordingCount + 1
             self.recordedData.append(data)
-            logger.info(f"recordingCount:{recordingCount}")
-            logger.info(f"silentCount:{silentCount}")
+            audio_frame_callback and audio_frame_callback(data)
+            logger.debug(f"recordingCount:{recordingCount} silentCount:{silentCount}")
 
         logger.debug("finished.")
 
@@ -212,19 +318,16 @@ class ActiveListener(object):
         # use wave to save data
         wf = wave.open(filename, "wb")
         wf.setnchannels(self.detector.NumChannels())
-        wf.setsampwidth(
-            self.audio.get_sample_size(
-                self.audio.get_format_from_width(self.detector.BitsPerSample() / 8)
-            )
-        )
+        wf.setsampwidth(self.detector.BitsPerSample() // 8)
         wf.setframerate(self.detector.SampleRate())
         wf.writeframes(data)
         wf.close()
         logger.debug("finished saving: " + filename)
 
-        self.stream_in.stop_stream()
-        self.stream_in.close()
-        self.audio.terminate()
+        if self.audio_input is None:
+            self.stream_in.stop_stream()
+            self.stream_in.close()
+            self.audio.terminate()
 
         return filename
 
@@ -281,6 +384,9 @@ class HotwordDetector(object):
         if len(sensitivity) != 0:
             self.detector.SetSensitivity(sensitivity_str.encode())
 
+        self.frame_bytes = (
+            self.detector.NumChannels() * self.detector.BitsPerSample() // 8 * FRAME_SAMPLES
+        )
         self.ring_buffer = RingBuffer(
             self.detector.NumChannels() * self.detector.SampleRate() * 5
         )
@@ -293,10 +399,13 @@ class HotwordDetector(object):
         audio_recorder_callback=None,
         silent_count_threshold=15,
         recording_timeout=100,
+        audio_frame_callback=None,
+        vad=None,
+        audio_input=None,
     ):
         """
-        Start the voice detector. For every `sleep_time` second it checks the
-        audio buffer for triggering keywords. If detected, then call
+        Start the voice detector. It blocks until a full frame of audio has
+        been captured and checks it for triggering keywords. If detected, then call
         corresponding function in `detected_callback`, which can be a single
         function (single model) or a list of callback functions (multiple
         models). Every loop it also calls `interrupt_check` -- if it returns
@@ -307,7 +416,9 @@ class HotwordDetector(object):
                                   `decoder_model`.
         :param interrupt_check: a function that returns True if the main loop
                                 needs to stop.
-        :param float sleep_time: how much time in second every loop waits.
+        :param float sleep_time: how long in seconds a read may block waiting
+                                 for audio before `interrupt_check` is
+                                 polled again.
         :param audio_recorder_callback: if specified, this will be called after
                                         a keyword has been spoken and after the
                                         phrase immediately after the keyword has
@@ -318,29 +429,41 @@ class HotwordDetector(object):
                                        to mark the end of a phrase that is
                                        being recorded.
         :param recording_timeout: limits the maximum length of a recording.
+        :param audio_frame_callback: if specified, called with every frame of
+                                     the phrase as it is recorded, before
+                                     `audio_recorder_callback` gets the file.
+        :param vad: if specified, an endpointer (see robot.Vad) whose
+                    `process(frame)` decides when the phrase has ended,
+                    instead of `silent_count_threshold`.
+        :param audio_input: if specified, a shared input (see robot.AudioInput)
+                            to read from instead of opening a new stream. The
+                            stream stays open while the keyword callback runs,
+                            so nothing said right after the keyword is lost.
         :return: None
         """
         self._running = True
+        self.audio_input = audio_input
 
-        def audio_callback(in_data, frame_count, time_info, status):
-            if utils.isRecordable():
-                self.ring_buffer.extend(in_data)
-                play_data = chr(0) * len(in_data)
-            else:
-                play_data = chr(0)
-            return play_data, pyaudio.paContinue
+        if audio_input is not None:
+            self.ring_buffer = audio_input.subscribe()
+        else:
 
-        with no_alsa_error():
-            self.audio = pyaudio.PyAudio()
-        self.stream_in = self.audio.open(
-            input=True,
-            output=False,
-            format=self.audio.get_format_from_width(self.detector.BitsPerSample() / 8),
-            channels=self.detector.NumChannels(),
-            rate=self.detector.SampleRate(),
-            frames_per_buffer=2048,
-            stream_callback=audio_callback,
-        )
+            def audio_callback(in_data, frame_count, time_info, status):
+                if utils.isRecordable():
+                    self.ring_buffer.extend(in_data)
+                return None, pyaudio.paContinue
+
+            with no_alsa_error():
+                self.audio = pyaudio.PyAudio()
+            self.stream_in = self.audio.open(
+                input=True,
+                output=False,
+                format=self.audio.get_format_from_width(self.detector.BitsPerSample() / 8),
+                channels=self.detector.NumChannels(),
+                rate=self.detector.SampleRate(),
+                frames_per_buffer=FRAME_SAMPLES,
+                stream_callback=audio_callback,
+            )
 
         if interrupt_check():
             logger.debug("detect voice return")
@@ -364,9 +487,8 @@ class HotwordDetector(object):
             if interrupt_check():
                 logger.debug("detect voice break")
                 break
-            data = self.ring_buffer.get()
-            if len(data) == 0:
-                time.sleep(sleep_time)
+            data = self.ring_buffer.read(self.frame_bytes, sleep_time)
+            if not data:
                 continue
 
             status = self.detector.RunDetection(data)
@@ -395,12 +517,16 @@ class HotwordDetector(object):
                         and utils.is_proper_time()
                     ):
                         state = "ACTIVE"
+                        vad and vad.reset()
+                        audio_frame_callback and audio_frame_callback(data)
                     continue
 
             elif state == "ACTIVE":
                 stopRecording = False
                 if recordingCount > recording_timeout:
                     stopRecording = True
+                elif vad is not None:
+                    stopRecording = vad.process(data)
                 elif status == -2:  # silence found
                     if silentCount > silent_count_threshold:
                         stopRecording = True
@@ -417,6 +543,7 @@ class HotwordDetector(object):
 
                 recordingCount = recordingCount + 1
                 self.recordedData.append(data)
+                audio_frame_callback and audio_frame_callback(data)
 
         logger.debug("finished.")
 
@@ -432,11 +559,7 @@ class HotwordDetector(object):
         # use wave to save data
         wf = wave.open(filename, "wb")
         wf.setnchannels(self.detector.NumChannels())
-        wf.setsampwidth(
-            self.audio.get_sample_size(
-                self.audio.get_format_from_width(self.detector.BitsPerSample() / 8)
-            )
-        )
+        wf.setsampwidth(self.detector.BitsPerSample() // 8)
         wf.setframerate(self.detector.SampleRate())
         wf.writeframes(data)
         wf.close()
@@ -449,7 +572,10 @@ class HotwordDetector(object):
         :return: None
         """
         if self._running:
-            self.stream_in.stop_stream()
-            self.stream_in.close()
-            self.audio.terminate()
+            if self.audio_input is not None:
+                self.audio_input.unsubscribe(self.ring_buffer)
+            else:
+                self.stream_in.stop_stream()
+                self.stream_in.close()
+                self.audio.terminate()
             self._running = False
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+录音结束到得到识别结果之间，各种音频准备方式的耗时：
+
+- mp3：旧版做法，utils.convert_wav_to_mp3 调用 ffmpeg 转出 mp3 临时文件，再读文件上传
+- wav：从录音文件读出 PCM，在内存中生成 wav
+- pcm：录音器内存中的帧直接拼接成 AudioClip（activeListen 的做法）
+
+只统计音频准备时间时不需要网络；加上 --live 时用配置中的 volc-asr 完整识别一次，
+得到说完话到拿到识别文本的端到端耗时。
+
+用法：python3 -m tools.bench_asr [录音 wav 文件] [--live]
+
+不指定录音文件时生成一段 6 秒的 16 kHz 测试音。在树莓派上运行可以得到实际部署环境下的数据。
+"""
+import os
+import platform
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from robot import ASR, utils
+from robot.AudioClip import AudioClip
+
+SAMPLE_RATE = 16000
+FRAME = 2048 * 2
+
+
+def make_wav(seconds=6):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pcm = (np.sin(2 * np.pi * 220 * t) * 8000).astype(np.int16).tobytes()
+    fd, path = tempfile.mkstemp(suffix=".wav")
+    with os.fdopen(fd, "wb") as f, wave.open(f, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(pcm)
+    return path
+
+
+def read_frames(path):
+    with wave.open(path, "rb") as wav:
+        pcm = wav.readframes(wav.getnframes())
+    return [pcm[i : i + FRAME] for i in range(0, len(pcm), FRAME)]
+
+
+def prepare_mp3(path, frames):
+    mp3_path = utils.convert_wav_to_mp3(path)
+    with open(mp3_path, "rb") as f:
+        data = f.read()
+    os.remove(mp3_path)
+    return data
+
+
+def prepare_wav(path, frames):
+    return AudioClip.from_wav(path).wav()
+
+
+def prepare_pcm(path, frames):
+    return AudioClip.from_frames(frames, SAMPLE_RATE, path=path).pcm
+
+
+def bench(fn, rounds=5):
+    fn()  # 预热
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def live(path, frames):
+    asr = ASR.get_engine_by_slug("volc-asr")
+
+    def old():
+        mp3_path = utils.convert_wav_to_mp3(path)
+        asr.engine.ASR(mp3_path, "mp3")
+        os.remove(mp3_path)
+
+    def new():
+        asr.transcribe(AudioClip.from_frames(frames, SAMPLE_RATE, path=path))
+
+    for name, fn in [("mp3", old), ("pcm", new)]:
+        print(f"{name}  说完到识别结果 {bench(fn, rounds=3) * 1000:8.1f} ms")
+
+
+def run(path=None, with_live=False):
+    generated = path is None
+    path = path or make_wav()
+    frames = read_frames(path)
+    seconds = sum(len(f) for f in frames) / 2 / SAMPLE_RATE
+    print(f"{platform.machine()}，录音 {seconds:.1f} 秒")
+    for name, fn in [("mp3", prepare_mp3), ("wav", prepare_wav), ("pcm", prepare_pcm)]:
+        size = len(fn(path, frames))
+        elapsed = bench(lambda: fn(path, frames))
+        print(f"{name}  准备音频 {elapsed * 1000:8.2f} ms，上传 {size / 1024:7.1f} KB")
+    if with_live:
+        live(path, frames)
+    if generated:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    run(args[0] if args else None, "--live" in sys.argv)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+对比每本绘本的加载耗时：
+
+- legacy：旧版写法，每次查询都重新 connect/close，每一页单独查询一次文字
+- repository：BookRepository 连接池 + 一次查询加载整本绘本
+
+用法：python3 -m tools.bench_book_repository [数据库路径] [重复次数]
+
+为了不把仓库里的数据库切换成 WAL 模式，测试在数据库的临时副本上进行。
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from robot import constants
+from robot.agents.book_repository import BookRepository
+
+
+def legacy_load_book(db_path, book_id):
+    def query(sql, params, one=False):
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        rows = cursor.fetchone() if one else cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return rows
+
+    description = query(
+        "SELECT cn_title, en_title, cn_subtitle, en_subtitle, picture_content FROM t_picture_book WHERE id = ?",
+        (book_id,),
+        one=True,
+    )
+    contents = query(
+        "SELECT id, sequence, picture_content, sequence FROM t_picture_book_content WHERE book_id = ? ORDER BY sequence",
+        (book_id,),
+    )
+    pages = []
+    for content in contents:
+        texts = query(
+            "SELECT id, language, text, type, character, character_category, sequence "
+            "FROM t_picture_book_text WHERE content_id = ? ORDER BY sequence",
+            (content[0],),
+        )
+        pages.append((content, texts))
+    return description, pages
+
+
+def bench(fn, book_ids, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for book_id in book_ids:
+            fn(book_id)
+    return (time.perf_counter() - start) / (rounds * len(book_ids)) * 1000
+
+
+def run(db_path=None, rounds=20):
+    db_path = db_path or constants.getStoryDB()
+    workdir = tempfile.mkdtemp()
+    try:
+        legacy_db = os.path.join(workdir, "legacy.db")
+        pooled_db = os.path.join(workdir, "pooled.db")
+        shutil.copyfile(db_path, legacy_db)
+        shutil.copyfile(db_path, pooled_db)
+
+        repository = BookRepository(pooled_db)
+        repository.ensure_schema()
+        book_ids = [book_id for book_id, _ in repository.get_all_books()]
+        if not book_ids:
+            print("数据库里没有绘本")
+            return
+
+        legacy = bench(lambda book_id: legacy_load_book(legacy_db, book_id), book_ids, rounds)
+        pooled = bench(repository.load_book, book_ids, rounds)
+        repository.close()
+
+        print(f"绘本数量：{len(book_ids)}，重复次数：{rounds}")
+        print(f"legacy     每本平均 {legacy:.3f} ms")
+        print(f"repository 每本平均 {pooled:.3f} ms")
+        print(f"加速比     {legacy / pooled:.1f}x")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    run(args[0] if args else None, int(args[1]) if len(args) > 1 else 20)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+唤醒词检测循环的空闲 CPU 占用和取帧延迟：
+
+- poll：旧版做法，deque 逐字节存放音频，检测线程每 sleep_time（0.03 秒）醒来一次，
+        用 bytes(bytearray(deque)) 取出全部数据
+- block：snowboy.snowboydecoder.RingBuffer，预分配缓冲区，检测线程在条件变量上阻塞，
+         凑满一帧才被 PyAudio 回调唤醒
+
+用一个线程模拟 PyAudio 回调（每 128 毫秒送入 2048 个采样），RunDetection 用一次
+numpy 求均值代替，只比较取数据本身的开销。
+
+用法：python3 -m tools.bench_capture [每种方式运行的秒数]
+
+在树莓派上运行可以得到实际部署环境下的数据。
+"""
+import collections
+import platform
+import sys
+import threading
+import time
+
+import numpy as np
+
+from snowboy.snowboydecoder import FRAME_SAMPLES, RingBuffer
+
+SAMPLE_RATE = 16000
+FRAME_BYTES = FRAME_SAMPLES * 2
+SLEEP_TIME = 0.03
+
+
+class LegacyRingBuffer(object):
+    def __init__(self, size=4096):
+        self._buf = collections.deque(maxlen=size)
+
+    def extend(self, data):
+        self._buf.extend(data)
+
+    def get(self):
+        tmp = bytes(bytearray(self._buf))
+        self._buf.clear()
+        return tmp
+
+
+def detect(data):
+    return np.frombuffer(data, dtype=np.int16).mean()
+
+
+def produce(ring, stop, sent):
+    frame = (np.random.randint(-500, 500, FRAME_SAMPLES)).astype(np.int16).tobytes()
+    interval = FRAME_SAMPLES / SAMPLE_RATE
+    next_time = time.monotonic()
+    while not stop.is_set():
+        next_time += interval
+        time.sleep(max(0, next_time - time.monotonic()))
+        sent.append(time.monotonic())
+        ring.extend(frame)
+
+
+def poll(ring, stop, sent, latency):
+    while not stop.is_set():
+        data = ring.get()
+        if len(data) == 0:
+            time.sleep(SLEEP_TIME)
+            continue
+        if sent:
+            latency.append(time.monotonic() - sent[-1])
+        detect(data)
+
+
+def block(ring, stop, sent, latency):
+    while not stop.is_set():
+        data = ring.read(FRAME_BYTES, SLEEP_TIME)
+        if not data:
+            continue
+        if sent:
+            latency.append(time.monotonic() - sent[-1])
+        detect(data)
+
+
+def bench(ring, consumer, seconds):
+    stop = threading.Event()
+    sent, latency = [], []
+    threads = [
+        threading.Thread(target=produce, args=(ring, stop, sent)),
+        threading.Thread(target=consumer, args=(ring, stop, sent, latency)),
+    ]
+    cpu = time.process_time()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    cpu = time.process_time() - cpu
+    return cpu / seconds * 100, np.mean(latency) * 1000 if latency else float("nan")
+
+
+def run(seconds=10):
+    size = SAMPLE_RATE * 2 * 5
+    print(f"{platform.machine()} / Python {platform.python_version()}，每种方式 {seconds} 秒")
+    for name, ring, consumer in [
+        ("poll ", LegacyRingBuffer(size), poll),
+        ("block", RingBuffer(size), block),
+    ]:
+        cpu, latency = bench(ring, consumer, seconds)
+        print(f"{name}  CPU {cpu:6.2f}%，回调到取得一帧平均 {latency:6.2f} ms")
+
+
+if __name__ == "__main__":
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 10)
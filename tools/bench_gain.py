@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+播放器音量处理的吞吐量（每秒处理的采样数）：
+
+- float：旧版做法，每块 np.frombuffer(...) * (volume / 100) 再 astype(np.int16)，
+         每块分配两个临时数组，超过满幅时会溢出回绕
+- int：之前混音线程的做法，astype(np.int32) * volume // 100 叠加后 np.clip，
+       每块同样要分配临时数组
+- fixed：robot.Dsp.GainStage，Q14 定点增益写入预分配的 int32 缓冲区，
+         叠加后软限幅并饱和
+
+用法：python3 -m tools.bench_gain [块大小（采样数）] [总秒数]
+
+在树莓派等 ARM 设备上运行可以得到实际部署环境下的数据。
+"""
+import platform
+import sys
+import time
+
+import numpy as np
+
+from robot.Dsp import GainStage, gain_for
+
+VOLUME = 50
+SAMPLE_RATE = 24000
+
+
+def make_blocks(block, seconds):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pcm = (np.sin(2 * np.pi * 440 * t) * 30000).astype(np.int16).tobytes()
+    size = block * 2
+    return [pcm[i : i + size] for i in range(0, len(pcm) - size + 1, size)]
+
+
+def legacy(blocks):
+    for data in blocks:
+        audio_array = np.frombuffer(data, dtype=np.int16)
+        audio_array = (audio_array * (VOLUME / 100)).astype(np.int16)
+        audio_array.tobytes()
+
+
+def integer(blocks, block):
+    acc = np.zeros(block, dtype=np.int32)
+    for data in blocks:
+        acc[:] = 0
+        acc += np.frombuffer(data, dtype=np.int16).astype(np.int32) * VOLUME // 100
+        np.clip(acc, -32768, 32767, out=acc)
+        acc.astype(np.int16)
+
+
+def fixed(blocks, block):
+    stage = GainStage(block, fade=block // 2)
+    acc = np.zeros(block, dtype=np.int32)
+    out = np.zeros(block, dtype=np.int16)
+    gain = gain_for(VOLUME)
+    for data in blocks:
+        acc[:] = 0
+        stage.mix(np.frombuffer(data, dtype=np.int16), acc, gain)
+        stage.limit(acc)
+        out[:] = acc
+
+
+def bench(fn, samples, rounds=5):
+    fn()  # 预热
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return samples / best
+
+
+def run(block=2048, seconds=30):
+    blocks = make_blocks(block, seconds)
+    samples = len(blocks) * block
+    print(f"{platform.machine()} / numpy {np.__version__}，块大小 {block} 采样，共 {samples} 采样")
+    for name, fn in [
+        ("float", lambda: legacy(blocks)),
+        ("int  ", lambda: integer(blocks, block)),
+        ("fixed", lambda: fixed(blocks, block)),
+    ]:
+        rate = bench(fn, samples)
+        print(f"{name}  {rate / 1e6:8.1f} M 采样/秒，实时倍数 {rate / SAMPLE_RATE:10.0f}x")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    run(int(args[0]) if args else 2048, float(args[1]) if len(args) > 1 else 30)
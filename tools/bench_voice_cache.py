@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+语音缓存命中时的首个采样就绪耗时（time-to-first-sample）：
+
+- pcm：VoiceCache 索引查询 + 内存映射 PCM 缓存 + 第一块调整音量，可以直接写入 PyAudio
+- mp3：旧版做法，按 md5 探测三种扩展名，再把整段 MP3 解码成 PCM 才能拿到第一块
+       （旧版交给 play 进程解码，这里用 pydub 近似，需要安装 pydub 和 ffmpeg）
+
+用法：python3 -m tools.bench_voice_cache [语音秒数] [重复次数]
+
+测试在临时目录中进行，不会影响 temp/voice_cache。
+"""
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from robot.VoiceCache import PcmAudio, VoiceCache
+
+TEXT = "从前有一只小熊，它住在森林里。"
+VOICE = {"voice_type": "BV700_streaming", "speed_ratio": 0.8, "emotion": "happy"}
+CHUNK = 4096
+VOLUME = 20
+
+
+def make_pcm(seconds, sample_rate=24000):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return (np.sin(2 * np.pi * 440 * t) * 12000).astype(np.int16).tobytes()
+
+
+def first_chunk(data):
+    audio_array = np.frombuffer(data[:CHUNK], dtype=np.int16)
+    return (audio_array * (VOLUME / 100)).astype(np.int16).tobytes()
+
+
+def bench(fn, rounds):
+    fn()  # 预热
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.95) - 1]
+
+
+def run(seconds=5, rounds=50):
+    workdir = tempfile.mkdtemp()
+    try:
+        pcm = make_pcm(seconds)
+        cache = VoiceCache(os.path.join(workdir, "voice_cache"))
+        cache.put_pcm([pcm[i : i + 9600] for i in range(0, len(pcm), 9600)], TEXT, **VOICE)
+
+        def pcm_ttfs():
+            path = cache.get(TEXT, **VOICE)
+            with PcmAudio(path) as audio:
+                first_chunk(audio.data)
+
+        print(f"语音长度：{seconds} 秒，重复次数：{rounds}")
+        median, p95 = bench(pcm_ttfs, rounds)
+        print(f"pcm  首个采样就绪 中位数 {median:.3f} ms，p95 {p95:.3f} ms")
+
+        try:
+            from pydub import AudioSegment
+        except ImportError:
+            print("mp3  未安装 pydub，跳过旧版对比")
+            return
+
+        md5 = hashlib.md5(TEXT.encode("utf-8")).hexdigest()
+        mp3_path = os.path.join(workdir, md5 + ".mp3")
+        AudioSegment(pcm, sample_width=2, frame_rate=24000, channels=1).export(mp3_path, format="mp3")
+
+        def mp3_ttfs():
+            paths = [os.path.join(workdir, md5 + ext) for ext in [".mp3", ".wav", ".asiff"]]
+            path = next((p for p in paths if os.path.exists(p)), None)
+            first_chunk(AudioSegment.from_mp3(path).raw_data)
+
+        median, p95 = bench(mp3_ttfs, max(1, rounds // 5))
+        print(f"mp3  首个采样就绪 中位数 {median:.3f} ms，p95 {p95:.3f} ms")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    run(float(args[0]) if args else 5, int(args[1]) if len(args) > 1 else 50)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+离线批量合成绘本语音：遍历 picture_books.db 中的所有绘本，把书名、封面、
+每页文字和描述以及固定用语全部合成到语音缓存中。
+
+- 使用 asyncio 工作池并发调用 VolcTTS.get_speech_ws_stream，并限制每秒请求数
+- 已经在缓存中的句子直接跳过，中断后重新执行即可从断点继续
+- 合成结果记录在 temp/tts_manifest.json 中
+"""
+import asyncio
+import json
+import os
+import time
+
+from robot import constants, logging, utils
+from robot.VoiceCache import get_cache
+from robot.agents import narration
+from robot.agents.book_repository import get_repository
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = os.path.join(constants.TEMP_PATH, "tts_manifest.json")
+
+
+class RateLimiter(object):
+    """
+    限制每秒最多发起 rate 个请求
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next = 0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.interval
+
+
+def load_manifest(path=MANIFEST):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest, path=MANIFEST):
+    tmp = path + ".part"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def collect_lines(tts, repository=None):
+    """
+    列出所有绘本需要合成的句子，相同的句子（如固定用语）只合成一次
+
+    :returns: {cache_key: {"text", "speed_ratio", "emotion", "character_category", "voice_type", "books"}}
+    """
+    repository = repository or get_repository()
+    lines = {}
+
+    def add(line, book_id=None):
+        text, speed_ratio, emotion, character_category = line
+        voice_type = tts.get_voice_type(character_category)
+        key = utils.getCacheKey(text, voice_type=voice_type, speed_ratio=speed_ratio, emotion=emotion)
+        item = lines.setdefault(
+            key,
+            {
+                "text": text,
+                "speed_ratio": speed_ratio,
+                "emotion": emotion,
+                "character_category": character_category,
+                "voice_type": voice_type,
+                "books": [],
+            },
+        )
+        if book_id and book_id not in item["books"]:
+            item["books"].append(book_id)
+
+    for text in narration.fixed_phrases():
+        add((text, narration.SPEED_RATIO, narration.EMOTION, narration.NARRATOR))
+    for book_id, _ in repository.get_all_books():
+        book = repository.load_book(book_id)
+        if not book:
+            continue
+        for segment in narration.book_segments(book, with_phrases=False):
+            for line in segment:
+                add(line, book_id)
+    return lines
+
+
+async def _render_one(tts, item, limiter, retries):
+    voice = {
+        "voice_type": item["voice_type"],
+        "speed_ratio": item["speed_ratio"],
+        "emotion": item["emotion"],
+    }
+    for attempt in range(retries + 1):
+        await limiter.wait()
+        try:
+            pcm_chunks = []
+            async for chunk in tts.get_speech_ws_stream(
+                item["text"], 125, item["speed_ratio"], item["emotion"], item["character_category"]
+            ):
+                pcm_chunks.append(chunk)
+            if not pcm_chunks:
+                raise RuntimeError("没有收到音频数据")
+            return await utils.saveWsStreamVoiceCache(pcm_chunks, item["text"], **voice)
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            delay = 2 ** attempt
+            logger.warning(f"合成失败，{delay} 秒后重试：{item['text']}，{e}")
+            await asyncio.sleep(delay)
+
+
+async def render(tts, concurrency=4, rate=5, retries=2, manifest_path=MANIFEST):
+    """
+    合成所有绘本的语音
+
+    :param tts: 支持流式合成的 TTS 引擎
+    :param concurrency: 工作协程数
+    :param rate: 每秒最多发起的合成请求数
+    :param retries: 单句失败后的重试次数
+    :returns: (合成数, 跳过数, 失败数)
+    """
+    lines = collect_lines(tts)
+    manifest = load_manifest(manifest_path)
+    queue = asyncio.Queue()
+    skipped = 0
+    for key, item in lines.items():
+        voice = {k: item[k] for k in ("voice_type", "speed_ratio", "emotion")}
+        cached = get_cache().peek(item["text"], **voice)
+        if cached:
+            manifest[key] = dict(item, file=os.path.basename(cached))
+            skipped += 1
+        else:
+            queue.put_nowait(key)
+    total = queue.qsize()
+    logger.info(f"共 {len(lines)} 句，已缓存 {skipped} 句，待合成 {total} 句")
+    save_manifest(manifest, manifest_path)
+
+    limiter = RateLimiter(rate)
+    done, failed = 0, 0
+
+    async def worker():
+        nonlocal done, failed
+        while True:
+            try:
+                key = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            item = lines[key]
+            try:
+                target = await _render_one(tts, item, limiter, retries)
+                manifest[key] = dict(item, file=os.path.basename(target))
+                done += 1
+            except Exception as e:
+                failed += 1
+                logger.error(f"合成失败：{item['text']}，{e}")
+            # 每句完成后都落盘，随时中断都能从断点继续
+            save_manifest(manifest, manifest_path)
+            print(f"[{done + failed}/{total}] {item['text'][:30]}")
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return done, skipped, failed
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+用录好的 wav 回放调试端点检测（robot.Vad）
+
+每个文件按录音器的帧长（2048 个采样）逐帧送入 VAD，文件末尾补一段静音，
+输出开口时间、最后一段语音、判定说完的时间、拖尾时间和停顿次数。
+
+提供标注文件时（CSV，每行：文件名,说完的秒数）还会统计：
+- 截断：判定说完时孩子其实还没说完
+- 多等：标注的说完时间到判定说完之间的时长
+
+用法：
+    python3 -m tools.vad_replay 录音.wav [更多 wav 或目录] [--labels 标注.csv]
+        [--engine energy] [--trail 3] [--参数名 值 ...]
+
+--参数名 值 覆盖 VAD 的默认参数（与配置中 vad 下的默认值相同），
+例如 --hangover_ms 900 --margin_db 8。
+录音需要是 16 位单声道，采样率与录音器一致（16000）。
+"""
+import csv
+import os
+import sys
+import wave
+
+import numpy as np
+
+from robot import Vad
+
+FRAME_SAMPLES = 2048
+
+
+def load(path, trail):
+    with wave.open(path, "rb") as wav:
+        assert wav.getnchannels() == 1 and wav.getsampwidth() == 2, f"{path} 不是 16 位单声道"
+        rate = wav.getframerate()
+        pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+    # 补上的静音带一点底噪，和真实环境接近
+    noise = (np.random.randn(int(trail * rate)) * 30).astype(np.int16)
+    return np.concatenate((pcm, noise)), rate, len(pcm) / rate
+
+
+def replay(path, engine, trail, overrides):
+    samples, rate, duration = load(path, trail)
+    vad = Vad.create(engine, sample_rate=rate, **overrides)
+    decided = None
+    for i in range(0, len(samples), FRAME_SAMPLES):
+        if vad.process(samples[i : i + FRAME_SAMPLES].tobytes()):
+            decided = (i + FRAME_SAMPLES) / rate
+            break
+    return {
+        "file": os.path.basename(path),
+        "duration": duration,
+        "result": vad.result,
+        "start": vad.first_speech_ms / 1000 if vad.first_speech_ms is not None else None,
+        "last_speech": vad.last_speech_ms / 1000 if vad.last_speech_ms is not None else None,
+        "decided": decided,
+        "hangover_ms": vad.hangover,
+        "pauses": len(vad.pauses),
+        "noise_floor_db": vad.noise_floor_db,
+        "process_us": vad.process_us,
+    }
+
+
+def load_labels(path):
+    labels = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) >= 2 and not row[0].startswith("#"):
+                labels[os.path.basename(row[0].strip())] = float(row[1])
+    return labels
+
+
+def fmt(value, spec=".2f"):
+    return "-" if value is None else format(value, spec)
+
+
+def parse_args(argv):
+    files, options = [], {}
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg.startswith("--"):
+            options[arg[2:]] = argv[i + 1]
+            i += 2
+            continue
+        if os.path.isdir(arg):
+            files.extend(
+                os.path.join(arg, name) for name in sorted(os.listdir(arg)) if name.endswith(".wav")
+            )
+        else:
+            files.append(arg)
+        i += 1
+    return files, options
+
+
+def run(argv):
+    files, options = parse_args(argv)
+    if not files:
+        raise SystemExit(__doc__)
+    engine = options.pop("engine", "energy")
+    trail = float(options.pop("trail", 3))
+    labels = load_labels(options.pop("labels")) if "labels" in options else {}
+    overrides = {key: float(value) for key, value in options.items()}
+    if "webrtc_mode" in overrides:
+        overrides["webrtc_mode"] = int(overrides["webrtc_mode"])
+
+    print("文件                      时长   开口  最后语音   判定   拖尾ms 停顿  底噪dB  us/帧  标注   多等")
+    cut, waits = 0, []
+    for path in files:
+        r = replay(path, engine, trail, overrides)
+        label = labels.get(r["file"])
+        wait = None
+        if label is not None and r["decided"] is not None:
+            wait = r["decided"] - label
+            if wait < 0:
+                cut += 1
+            else:
+                waits.append(wait)
+        print(
+            f"{r['file'][:24]:24}  {r['duration']:5.2f} {fmt(r['start']):>5} {fmt(r['last_speech']):>8}"
+            f" {fmt(r['decided']):>7} {r['hangover_ms']:7d} {r['pauses']:4d}"
+            f" {fmt(r['noise_floor_db'], '.1f'):>7} {r['process_us']:6.0f} {fmt(label):>5} {fmt(wait):>6}"
+            f"  {r['result'] if r['result'] != Vad.END else ''}"
+        )
+    if labels:
+        avg = sum(waits) / len(waits) if waits else None
+        print(f"\n截断 {cut} 个，平均多等 {fmt(avg)} 秒")
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
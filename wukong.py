@@ -72,6 +72,7 @@ class Wukong(object):
 
     def _signal_handler(self, signal, frame):
         self._interrupted = True
+        self.conversation.runtime.shutdown()
         utils.clean()
         self.lifeCycleHandler.onKilled()
 
@@ -119,6 +120,8 @@ class Wukong(object):
       update                   - 手动更新 wukong-robot
       upload [thredNum]        - 手动上传 QA 集语料，重建 solr 索引。
                                  threadNum 表示上传时开启的线程数（可选。默认值为 10）
+      render [concurrency] [rate] - 离线合成所有绘本的语音到缓存，可中断后继续。
+                                 concurrency 为并发数（默认 4），rate 为每秒请求数（默认 5）
       profiling                - 运行过程中打印耗时数据
     如需更多帮助，请访问：https://wukong.hahack.com/#/run
 ====================================================================================="""
@@ -166,6 +169,24 @@ class Wukong(object):
         except Exception as e:
             logger.error(f"上传失败：{e}", stack_info=True)
 
+    def render(self, concurrency=4, rate=5):
+        """
+        离线合成所有绘本的语音到缓存
+        """
+        import asyncio
+        from robot import TTS
+        from tools import tts_render
+
+        try:
+            tts = TTS.VolcTTS.get_instance()
+            done, skipped, failed = asyncio.run(
+                tts_render.render(tts, concurrency=concurrency, rate=rate)
+            )
+            print(f"合成 {done} 句，跳过 {skipped} 句，失败 {failed} 句")
+            print(f"清单：{tts_render.MANIFEST}")
+        except Exception as e:
+            logger.error(f"合成失败：{e}", stack_info=True)
+
     def restart(self):
         """
         重启 wukong-robot